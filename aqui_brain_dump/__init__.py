@@ -1,39 +1,62 @@
 from pathlib import Path
 
-import markdown
-
-from aqui_brain_dump.backlinks_wikilinks import WikiLinkExtension
-from aqui_brain_dump.extension_citations import CitationExtension
-from aqui_brain_dump.extension_tags import TagExtension
-from aqui_brain_dump.extension_wikiimage import WikiImageExtension
 from aqui_brain_dump.git_process import get_creation_date, get_last_modification_date, get_number_commits
-from aqui_brain_dump.parse_bibliography import parse_bibliography
+from aqui_brain_dump.parse_bibliography import BibliographyStore
 
 content_path = Path('./content').absolute()
 static_path = Path('.') / 'static'
 output_path = Path('./output').absolute()
 template_path = Path('./templates').absolute()
 bibliography_file = Path('./citation_library.json').absolute()
-try:
-    bibliography = parse_bibliography(bibliography_file)
-except FileNotFoundError:
-    print('No bibliography file')
-    bibliography = {}
+cache_path = Path('./.garden_cache').absolute()
+bibliography = BibliographyStore(bibliography_file, cache_dir=cache_path)
 static_url = 'static'
 base_url = 'https://notes.aquiles.me'
 
-md = markdown.Markdown(extensions=[
-    'meta',
-    WikiLinkExtension(),
-    WikiImageExtension(),
-    TagExtension(),
-    CitationExtension(bibliography_data=bibliography),
-    'admonition',
-    'markdown_checklist.extension',
-    'fenced_code',
-    'codehilite',
-    'footnotes',
-    ])
+_md = None
+
+
+def get_markdown():
+    """ Returns the Markdown instance shared by all notes, creating it on first use.
+
+    Markdown, the custom extensions and Pygments (through ``codehilite``) are only imported at this point, so that
+    commands that never convert a note do not pay for them. Code blocks are highlighted through
+    :mod:`aqui_brain_dump.highlight_cache`.
+    """
+    global _md
+    if _md is None:
+        import markdown
+
+        from aqui_brain_dump import highlight_cache
+        from aqui_brain_dump.extension_anchors import AnchorExtension
+        from aqui_brain_dump.backlinks_wikilinks import WikiLinkExtension
+        from aqui_brain_dump.extension_citations import CitationExtension
+        from aqui_brain_dump.extension_tags import TagExtension
+        from aqui_brain_dump.extension_wikiimage import WikiImageExtension
+
+        _md = markdown.Markdown(extensions=[
+            'meta',
+            WikiLinkExtension(),
+            WikiImageExtension(),
+            TagExtension(),
+            CitationExtension(bibliography_data=bibliography),
+            'admonition',
+            'markdown_checklist.extension',
+            'fenced_code',
+            'codehilite',
+            'footnotes',
+            AnchorExtension(),
+            ])
+        highlight_cache.install()
+    return _md
+
+
+def __getattr__(name):
+    # Keeps ``from aqui_brain_dump import md`` working without building the instance at import time
+    if name == 'md':
+        return get_markdown()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 
 DEFUALT_MATHJAX_SETTING = r"""
 window.MathJax = {
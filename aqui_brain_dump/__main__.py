@@ -1,92 +1,261 @@
 import os
 import sys
-import time
-from datetime import datetime, timezone
+from datetime import timezone
+from functools import partial
 import logging
 from pathlib import Path
 from shutil import copyfile, copytree
 from collections import OrderedDict
 import math
 
-from jinja2 import Environment, FileSystemLoader
-
 from aqui_brain_dump import bibliography, content_path, datetimeformat, output_path, static_path, static_url
+from aqui_brain_dump.analyze_links import asset_url, validate_references
+from aqui_brain_dump.assets import fingerprint_static
+from aqui_brain_dump.discovery import walk
+from aqui_brain_dump.garden_index import update_index
 from aqui_brain_dump.note import Note
+from aqui_brain_dump.neighbourhood import DEFAULT_HOPS, LocalGraph
+from aqui_brain_dump.related import DEFAULT_TOP_K as DEFAULT_RELATED, find_related
+from aqui_brain_dump.tags import DEFAULT_PAGE_SIZE as DEFAULT_TAG_PAGE_SIZE, build_tag_tree, paginate, tag_page_url
+from aqui_brain_dump.trace import span
+from aqui_brain_dump.util import now, peak_memory_mb
 
 
 logger = logging.getLogger(__name__)
 
 
 def main(base_url='https://notes.aquiles.me', parse_git=True):
-    logger.info('Starting to compile the notes')
-    logger.info(f'Got base_url={base_url}')
-    logger.info(f'Got parse_git={parse_git}')
-    if len(sys.argv) > 1:
-        logger.info(f'Setting base url to {sys.argv[1]}')
-        base_url = sys.argv[1]
+    if sys.argv[1:2] == ['serve']:
+        from aqui_brain_dump.serve import main as serve_main
+
+        return serve_main(sys.argv[2:])
 
-    parse_git = parse_git
-    if len(sys.argv) > 2:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='brain_dump', description='Build the website from the notes in ./content')
+    parser.add_argument('base_url', nargs='?', default=base_url, help=f'URL the site is served from (default: {base_url})')
+    parser.add_argument('no_git', nargs='?', help='Any value disables reading creation and modification dates from git')
+    parser.add_argument('--profile', nargs='?', const='stats/build_trace.json', metavar='TRACE_FILE',
+                        help='Record the time of every stage and note, save a Chrome trace '
+                             '(default: stats/build_trace.json) and print the slowest stages and notes')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='Keep only one note in memory at a time, converting each note twice. '
+                             'Slower, but memory does not grow with the size of the notes')
+    parser.add_argument('--tag-page-size', type=int, default=DEFAULT_TAG_PAGE_SIZE, metavar='N',
+                        help=f'Notes per tag page, 0 for a single page (default: {DEFAULT_TAG_PAGE_SIZE})')
+    parser.add_argument('--related', type=int, default=DEFAULT_RELATED, metavar='N',
+                        help=f'Related notes suggested for every note by similar text and tags, 0 to skip it '
+                             f'(default: {DEFAULT_RELATED})')
+    parser.add_argument('--hops', type=int, default=DEFAULT_HOPS, metavar='K',
+                        help=f'Links away from each note included in the local graph of its connections.json, 0 to '
+                             f'skip it (default: {DEFAULT_HOPS})')
+    parser.add_argument('--shards', type=int, metavar='N',
+                        help='Parse the notes in N processes and render them in N more, see aqui_brain_dump.shard')
+    args = parser.parse_args()
+
+    logger.info('Starting to compile the notes')
+    logger.info(f'Got base_url={args.base_url}')
+    if args.no_git is not None:
         logger.info('Setting parse git to False')
         parse_git = False
+    logger.info(f'Got parse_git={parse_git}')
+
+    if args.shards:
+        from aqui_brain_dump.shard import build_sharded
+
+        run = partial(build_sharded, args.shards, base_url=args.base_url, parse_git=parse_git,
+                      tag_page_size=args.tag_page_size, related=args.related, hops=args.hops)
+    else:
+        run = partial(build, base_url=args.base_url, parse_git=parse_git, low_memory=args.low_memory,
+                      tag_page_size=args.tag_page_size, related=args.related, hops=args.hops)
+
+    if args.profile:
+        from aqui_brain_dump import trace
+
+        trace.enable()
+        try:
+            run()
+        finally:
+            tracer = trace.disable()
+            trace.write_chrome_trace(tracer, args.profile)
+            trace.print_profile_summary(trace.summarize(tracer))
+        return
+
+    run()
+
+
+def build_stages(base_url='https://notes.aquiles.me', parse_git=True, low_memory=False,
+                 tag_page_size=DEFAULT_TAG_PAGE_SIZE, related=DEFAULT_RELATED, hops=DEFAULT_HOPS):
+    """ Returns the stages of a build as a list of (name, callable), in the order they have to run.
 
+    With ``low_memory``, discovering the notes keeps only what is needed for the graph (title, links, tags, metadata)
+    and each note is converted again right before it is rendered, then dropped.
+    """
+    return [
+        ('static', copy_static),
+        ('discover', partial(discover_notes, parse_git=parse_git, low_memory=low_memory)),
+        ('tags', partial(build_tag_pages, page_size=tag_page_size)),
+        ('literature', build_lit_pages),
+        ('backlinks', build_backlinks),
+        ('embeds', build_embeds),
+        ('references', check_references),
+        ('index', build_index),
+        ('related', partial(build_related, top_k=related)),
+        ('neighbourhoods', partial(build_local_graph, hops=hops)),
+        ('render', partial(render_notes, base_url=base_url)),
+        ('sitemap', partial(build_sitemap, base_url=base_url)),
+        ('feed', partial(build_feed, base_url=base_url)),
+        ('stats', copy_stats),
+    ]
+
+
+def build(base_url='https://notes.aquiles.me', parse_git=True, low_memory=False, tag_page_size=DEFAULT_TAG_PAGE_SIZE,
+          related=DEFAULT_RELATED, hops=DEFAULT_HOPS):
+    for name, stage in build_stages(base_url=base_url, parse_git=parse_git, low_memory=low_memory,
+                                    tag_page_size=tag_page_size, related=related, hops=hops):
+        logger.debug(f'Starting stage {name}')
+        with span(name, cat='stage'):
+            stage()
+    log_highlight_cache()
+    peak = peak_memory_mb()
+    if peak is not None:
+        logger.info(f'Peak memory: {peak:.0f} MB')
+
+
+def log_highlight_cache():
+    if 'aqui_brain_dump.highlight_cache' not in sys.modules:
+        return
+    from aqui_brain_dump.highlight_cache import cache
+
+    logger.info(f'Highlight cache: {cache.hits} code blocks reused, {cache.misses} highlighted')
+    cache.close()
+
+
+def copy_static():
     out_static_dir = output_path / static_url
     if out_static_dir.exists():
         import shutil
         shutil.rmtree(out_static_dir)
     copytree(str(static_path.absolute()), str(out_static_dir.absolute()))
+    fingerprint_static(static_path, out_static_dir)
+    Note.assets.update(asset_url(Path(static_url) / file.relative_to(static_path))
+                       for file in static_path.rglob('*') if file.is_file())
 
-    Note.bibliography = bibliography
 
-    f_walk = os.walk(content_path)
-    for dirs in f_walk:
-        if 'templates' in dirs[0]:
-            continue
-        if 'templates' in dirs[0]:
-            continue
-        logger.info(f'Entering to {dirs[0]}')
-        cur_dir = dirs[0]
-        sub_dir = os.path.abspath(cur_dir)
-        if sub_dir == '.':
-            sub_dir = ''
+def discover_notes(parse_git=True, low_memory=False, select=None):
+    """ Creates a note for every markdown file of the content and copies the other files to the output.
 
-        if sub_dir.startswith('.') or sub_dir.startswith('templates'):
-            continue
+    :param select: Optional function of the path relative to the content folder, returning whether this build handles
+        that file. Used to split the content in shards, see :mod:`aqui_brain_dump.shard`
+    """
+    Note.bibliography = bibliography
+    Note.low_memory = low_memory
+    bibliography.keep_entries = not low_memory
 
-        sub_dir = Path(sub_dir).absolute()
+    for sub_dir, files in walk():
+        logger.info(f'Entering to {sub_dir}')
         out_subdir = output_path / sub_dir.relative_to(content_path)
         out_subdir.mkdir(exist_ok=True, parents=True)
-        for file in dirs[2]:
+        for file in files:
+            if select is not None and not select(sub_dir.relative_to(content_path) / file):
+                continue
             if not file.endswith('.md'):
-                logger.debug(f'Copying {file} to {output_path / sub_dir.relative_to(content_path) / file}')
-                copyfile(os.path.join(cur_dir, file), output_path / sub_dir.relative_to(content_path) / file)
+                Note.assets.add(asset_url(sub_dir.relative_to(content_path) / file))
+                logger.debug(f'Copying {file} to {out_subdir / file}')
+                with span('copy'):
+                    copyfile(sub_dir / file, out_subdir / file)
                 continue
             filepath = content_path / sub_dir / file
             logger.debug(f'Creating note for {filepath}')
             Note.create_from_path(filepath, parse_git=parse_git)
 
     logger.info('Waiting for note parser executor to finish')
-    while len([f for f in Note.futures_executor if f.running()]):
-        time.sleep(.01)
+    Note.wait_for_executor()
+
+
+def build_embeds():
+    """ Finds the cycles of embedded notes and replaces every ``![[note]]`` by the content of the note. With
+    ``low_memory``, it is done every time the content of a note is loaded instead. """
+    Note.find_embed_cycles()
+    if Note.low_memory:
+        return
+    for note in Note.notes.values():
+        if note.embeds:
+            note.content = note.expand_embeds(note.content)
+
 
+def check_references():
+    """ Checks every internal link, image, embed and heading anchor against the notes, files and anchors found while
+    discovering the notes, and logs the broken ones with the line they are on. """
+    broken = validate_references(Note.notes, Note.assets)
+    for reference in broken:
+        logger.warning(f'{reference["source_path"]}:{reference["line"] or "?"}: {reference["written"]} is broken, '
+                       f'{reference["problem"]}')
+    logger.info(f'Checked internal links, {len(broken)} broken')
+
+
+def build_index():
+    """ Updates the notes that changed in the garden index, see :mod:`aqui_brain_dump.garden_index`. """
+    update_index(Note.notes)
+
+
+def build_related(top_k=DEFAULT_RELATED):
+    """ Suggests the ``top_k`` notes most similar to every note, see :mod:`aqui_brain_dump.related`. """
+    if not top_k:
+        return
+    find_related(Note.notes, top_k=top_k)
+
+
+def build_local_graph(hops=DEFAULT_HOPS):
+    """ Indexes the links of every note, so each ``connections.json`` includes the notes up to ``hops`` links away,
+    see :mod:`aqui_brain_dump.neighbourhood`. """
+    if not hops:
+        return
+    Note.local_graph = LocalGraph.from_notes(Note.notes, hops=hops)
+
+
+def build_tag_pages(page_size=DEFAULT_TAG_PAGE_SIZE):
+    """ Creates the pages of every tag and its ancestors, ``page_size`` notes per page (all of them if 0).
+
+    Besides the notes of the page as ``backlinks``, each page has the :class:`~aqui_brain_dump.tags.Tag` as ``tag``
+    (with its parent, children and counts) and a ``pagination`` dictionary with the page number, the number of pages
+    and the urls of the previous and next pages.
+    """
     logger.info('Creating Tags')
-    for tag, backlinks in Note.tags_dict.items():
-        t = tag.strip('#')
-        tag_page = Note.create_from_url(f'/tags/{t}')
-        tag_page.backlinks = backlinks
+    for tag in build_tag_tree(Note.tags_dict).values():
+        pages = paginate(tag.members, page_size)
+        urls = [tag_page_url(tag.name, number) for number in range(1, len(pages) + 1)]
+        for i, members in enumerate(pages):
+            tag_page = Note.create_from_url(urls[i])
+            if i:
+                tag_page.title = f'{Note.notes[urls[0]].title} (page {i + 1})'
+            tag_page.backlinks = members
+            tag_page.tag = tag
+            tag_page.pagination = {
+                'page': i + 1,
+                'pages': len(pages),
+                'previous': urls[i - 1] if i else None,
+                'next': urls[i + 1] if i + 1 < len(pages) else None,
+                'urls': urls,
+            }
+
 
+def build_lit_pages():
     for cite, backlinks in Note.lit_notes.items():
         cite_page = Note.create_from_lit(cite)
-        cite_page.backlinks = backlinks
+        cite_page.backlinks = sorted(backlinks, key=lambda n: n.url)
 
+
+def build_backlinks():
     logger.info('Building backlinks')
     Note.build_backlinks()
     logger.info('Waiting for backlinks executor to finish')
-
-    while len([f for f in Note.futures_executor if f.running()]):
-        time.sleep(.01)
+    Note.wait_for_executor()
     Note.note_executor.shutdown(wait=True)
+    Note.sort_collections()
 
+
+def render_notes(base_url='https://notes.aquiles.me'):
     logger.info('Rendering notes')
     for rel_path, note in Note.notes.items():
         logger.debug(f'Rendering {note}')
@@ -94,17 +263,29 @@ def main(base_url='https://notes.aquiles.me', parse_git=True):
 
     logger.info('Finished building notes')
 
-    logger.info('Building sitemap')
 
-    num_edits = [n.number_edits for n in Note.notes.values()]
-    min_number_edits = min(num_edits)
-    max_number_edits = max(num_edits)
+def get_environment():
+    """ Jinja environment for the sitemap and feed templates shipped with the package. """
+    from jinja2 import Environment, FileSystemLoader
 
-    logger.debug(f'Min num edits: {min_number_edits}, Max num edits: {max_number_edits}')
-    today = datetime.now(tz=timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
     env = Environment(loader=FileSystemLoader(os.path.dirname(os.path.abspath(__file__))))
     env.filters['datetime'] = datetimeformat
-    sitemap = env.get_template('sitemap.xml')
+    return env
+
+
+def edit_range():
+    num_edits = [n.number_edits for n in Note.notes.values()]
+    return min(num_edits), max(num_edits)
+
+
+def build_sitemap(base_url='https://notes.aquiles.me'):
+    logger.info('Building sitemap')
+
+    min_number_edits, max_number_edits = edit_range()
+
+    logger.debug(f'Min num edits: {min_number_edits}, Max num edits: {max_number_edits}')
+    today = now(tz=timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
+    sitemap = get_environment().get_template('sitemap.xml')
     # Compute network-based priorities using incoming (backlinks) and outgoing (links)
     # Use log1p to dampen large degrees; weight incoming higher than outgoing
     network_scores = {}
@@ -132,8 +313,12 @@ def main(base_url='https://notes.aquiles.me', parse_git=True):
              'base_url': base_url,
                 }))
 
+
+def build_feed(base_url='https://notes.aquiles.me'):
     logger.info('Building RSS Feed')
-    rss_feed = env.get_template('feed.rss')
+    min_number_edits, max_number_edits = edit_range()
+    today = now(tz=timezone.utc).strftime('%a, %d %b %Y %H:%M:%S %z')
+    rss_feed = get_environment().get_template('feed.rss')
     # Filter notes modified/created in the last week
     def _note_last_mod_timestamp(item):
         # item is (key, note)
@@ -154,12 +339,12 @@ def main(base_url='https://notes.aquiles.me', parse_git=True):
     # Filter notes to only include those with content (actual notes, not auto-generated pages)
     # and modified/created in the last 7 days
     import datetime as dt
-    one_week_ago = dt.datetime.now(tz=dt.timezone.utc) - dt.timedelta(days=7)
+    one_week_ago = now(tz=dt.timezone.utc) - dt.timedelta(days=7)
     
     filtered_items = []
     for key, note in Note.notes.items():
         # Skip notes without content (auto-generated tag pages, etc.)
-        if note.content is None or note.content == '':
+        if not note.has_content:
             continue
         
         # Get the last modification or creation date
@@ -178,20 +363,40 @@ def main(base_url='https://notes.aquiles.me', parse_git=True):
         if note_date >= one_week_ago:
             filtered_items.append((key, note))
     
-    # Sort by most recent first
-    sorted_items = sorted(filtered_items, key=_note_last_mod_timestamp, reverse=True)
+    # Sort by most recent first, and by url between notes of the same date
+    sorted_items = sorted(filtered_items, key=lambda item: (_note_last_mod_timestamp(item), item[0]), reverse=True)
     limited_notes = OrderedDict(sorted_items)
     
     logger.info(f'Found {len(limited_notes)} notes modified/created in the last week for RSS feed')
     with open(output_path / 'feed.rss', 'w', encoding='utf-8') as f:
-        f.write(rss_feed.render(
-            {'notes': limited_notes,
+        # Written as the template is evaluated, so that with low memory only one note has its content loaded
+        f.writelines(rss_feed.generate(
+            {'notes': LoadedNotes(limited_notes),
              'min_edits': min_number_edits,
              'max_edits': max_number_edits,
              'today': today,
              'base_url': base_url
              }))
 
+
+class LoadedNotes:
+    """ Wraps a dictionary of notes so that iterating over its items loads the content of each note just before it is
+    used and, with low memory, releases it right after. """
+    def __init__(self, notes):
+        self.notes = notes
+
+    def __len__(self):
+        return len(self.notes)
+
+    def items(self):
+        for key, note in self.notes.items():
+            note.load_content()
+            yield key, note
+            if Note.low_memory:
+                note.release_content()
+
+
+def copy_stats():
     logger.info('Copying stats files to output directory')
     import shutil
     out_stats_dir = output_path / 'stats'
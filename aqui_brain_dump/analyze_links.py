@@ -2,138 +2,232 @@
 Analyze internal links in the digital garden.
 - Identify orphaned notes (notes with no incoming links)
 - Identify broken wikilinks (links to non-existing notes)
+- Identify broken references: internal links, images and embeds to files, notes or headings that do not exist
+
+References are checked against what was found while converting the notes, the anchors and references of each note (see
+:mod:`aqui_brain_dump.extension_anchors`) and the files copied from the content, in a single pass over the notes and
+without reading their HTML again. Only the source file of a broken reference is read, to find the line it is on.
+
+The analysis reads the notes, links and references from the garden index (see :mod:`aqui_brain_dump.garden_index`),
+parsing only the notes that changed since it was last updated, or every note with ``reindex``.
 """
 import json
 import logging
-from datetime import datetime, timezone
-from pathlib import Path
+from collections import Counter
+from datetime import timezone
+from pathlib import Path, PurePath
 
-from aqui_brain_dump import content_path
-from aqui_brain_dump.note import Note
+from aqui_brain_dump import content_path, static_path, static_url
+from aqui_brain_dump.discovery import iter_files
+from aqui_brain_dump.extension_anchors import reference_target
+from aqui_brain_dump.garden_index import DEFAULT_INDEX_FILE, open_index
+from aqui_brain_dump.history import record_snapshot
+from aqui_brain_dump.util import now
 
 logger = logging.getLogger(__name__)
 
+# Files written by the build besides the notes and the files of the content
+GENERATED_URLS = {'/sitemap.xml', '/feed.rss', '/stats/garden_stats.json', '/stats/garden_graph.json'}
+
+
+def asset_url(rel_path):
+    """ Url of a file copied to the output, given its path relative to the output folder. """
+    return '/' + PurePath(rel_path).as_posix()
+
+
+def collect_assets():
+    """ Urls of the files of the content and static folders, as the build copies them. """
+    assets = {asset_url(file.relative_to(content_path)) for file in iter_files() if not file.name.endswith('.md')}
+    if static_path.is_dir():
+        assets.update(asset_url(Path(static_url) / file.relative_to(static_path))
+                      for file in static_path.rglob('*') if file.is_file())
+    return assets
+
+
+def _find_line(file_path, written, sources):
+    """ Number of the first line of ``file_path`` with ``written`` in it, or None. ``sources`` keeps the lines of the
+    files already read. """
+    lines = sources.get(file_path)
+    if lines is None:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            lines = []
+        sources[file_path] = lines
+    return next((number for number, line in enumerate(lines, 1) if written in line), None)
+
+
+def _find_page(path, urls):
+    """ Url in ``urls`` of the page at ``path``, which may lack the trailing slash or end in ``index.html``. """
+    if path in urls:
+        return path
+    if not path.endswith('/') and path + '/' in urls:
+        return path + '/'
+    if path.endswith('/index.html') and path[:-len('index.html')] in urls:
+        return path[:-len('index.html')]
+    return None
+
+
+def _reference_problem(path, fragment, url, anchors, assets):
+    """ Why a reference to ``path#fragment`` is broken, or None if it is not. ``url`` is the page at ``path``, if any,
+    and ``anchors`` its anchors, None for pages without markdown (tags, literature, notes that do not exist). """
+    if url is None:
+        if path in assets or path in GENERATED_URLS:
+            return None
+        return f'there is no note or file at {path}'
+    if not fragment or anchors is None or fragment in anchors:
+        return None
+    return f'{url} has no heading or anchor #{fragment}'
+
+
+def _broken_reference(title, url, path, line, written, href, problem):
+    return {
+        'source_title': title,
+        'source_url': url,
+        'source_path': path,
+        'line': line,
+        'written': written,
+        'target': href,
+        'problem': problem,
+    }
+
+
+def validate_references(notes, assets):
+    """
+    Checks every internal link, image and embed of every note, with their anchors.
+
+    Args:
+        notes: Dictionary url -> note, as ``Note.notes``, with resolved links
+        assets: Urls of the files copied to the output, see :func:`collect_assets`
+
+    Returns:
+        list: A dictionary for every broken reference, with the note and line it is on
+    """
+    broken = []
+    sources = {}
+    anchors = {}
+    for note in notes.values():
+        for href, written in getattr(note, 'references', ()):
+            path, fragment = reference_target(note.url, href, note.rewrites)
+            url = _find_page(path, notes)
+            target = notes.get(url)
+            if target is not None and target.has_content and target.cite_key is None:
+                if url not in anchors:
+                    anchors[url] = set(target.anchors)
+                target_anchors = anchors[url]
+            else:
+                target_anchors = None
+            problem = _reference_problem(path, fragment, url, target_anchors, assets)
+            if problem is not None:
+                line = _find_line(note.file_path, written, sources)
+                broken.append(_broken_reference(note.title, note.url, str(note.path), line, written, href, problem))
+    return broken
+
+
+def validate_indexed_references(index, assets):
+    """ As :func:`validate_references`, with the notes, anchors and references of a
+    :class:`~aqui_brain_dump.garden_index.GardenIndex`. """
+    urls = {url for (url,) in index.db.execute('SELECT url FROM notes')}
+    pages = urls | index.generated_urls()
+    anchors = {}
+    for url, anchor in index.db.execute('SELECT url, anchor FROM anchors'):
+        anchors.setdefault(url, set()).add(anchor)
+    broken = []
+    sources = {}
+    rows = index.db.execute('SELECT r.source, r.href, r.target, r.fragment, r.written, n.title, n.path '
+                            'FROM refs r JOIN notes n ON n.url = r.source ORDER BY r.source, r.rowid')
+    for source, href, path, fragment, written, title, note_path in rows:
+        url = _find_page(path, pages)
+        target_anchors = anchors.get(url, set()) if url in urls else None
+        problem = _reference_problem(path, fragment, url, target_anchors, assets)
+        if problem is not None:
+            line = _find_line(content_path / note_path, written, sources)
+            broken.append(_broken_reference(title, source, note_path, line, written, href, problem))
+    return broken
+
 
-def analyze_internal_links(output_file='stats/link_analysis.json', parse_git=False):
+def analyze_internal_links(output_file='stats/link_analysis.json', parse_git=False, history_file=None,
+                           index_file=DEFAULT_INDEX_FILE, reindex=False):
     """
     Analyze internal links and identify issues.
     
     Args:
         output_file: Path to save analysis JSON file
         parse_git: Whether to parse git information
+        history_file: History store to append the snapshot to. Defaults to history.sqlite next to output_file
+        index_file: Garden index to read the notes from, see :mod:`aqui_brain_dump.garden_index`
+        reindex: Parse every note again instead of only those that changed since the index was updated
     
     Returns:
         dict: Analysis results
     """
     logger.info('Analyzing internal links')
-    
-    # Parse all notes
-    import os
-    f_walk = os.walk(content_path)
-    for dirs in f_walk:
-        if 'templates' in dirs[0]:
-            continue
-        cur_dir = dirs[0]
-        sub_dir = Path(cur_dir).absolute()
-        
-        if str(sub_dir).startswith('.') or 'templates' in str(sub_dir):
-            continue
-        
-        for file in dirs[2]:
-            if not file.endswith('.md'):
-                continue
-            filepath = Path(cur_dir) / file
-            logger.debug(f'Creating note for link analysis: {filepath}')
-            Note.create_from_path(filepath, parse_git=parse_git)
-    
-    # Wait for all parsing to complete
-    import time
-    while len([f for f in Note.futures_executor if f.running()]):
-        time.sleep(.01)
-    Note.note_executor.shutdown(wait=True)
-    
-    # Build backlinks
-    Note.build_backlinks()
-    
+
+    with open_index(index_file, parse_git=parse_git, reindex=reindex) as index:
+        notes = index.query('SELECT url, title, path FROM notes ORDER BY url')
+        links = index.query('SELECT source, target FROM links ORDER BY source, target')
+        broken_references = validate_indexed_references(index, collect_assets())
+
     analysis = {
-        'timestamp': datetime.now(tz=timezone.utc).isoformat(),
+        'timestamp': now(tz=timezone.utc).isoformat(),
         'orphaned_notes': [],
         'broken_wikilinks': [],
         'notes_without_outgoing_links': [],
+        'broken_references': broken_references,
         'summary': {
-            'total_notes': 0,
+            'total_notes': len(notes),
             'orphaned_count': 0,
             'broken_links_count': 0,
+            'broken_references_count': 0,
             'notes_without_outgoing_count': 0
         }
     }
-    
-    # Track all existing note URLs
-    existing_urls = set()
-    for url, note in Note.notes.items():
-        if note.content is not None and note.content != '':
-            existing_urls.add(url)
-    
+
+    existing = {note['url']: note for note in notes}
+    outgoing = Counter(link['source'] for link in links)
+    incoming = Counter(link['target'] for link in links)
+
     # Analyze each note
-    for url, note in Note.notes.items():
-        # Skip auto-generated notes without content
-        if note.content is None or note.content == '':
-            continue
-        
-        analysis['summary']['total_notes'] += 1
-        
+    for note in notes:
+        num_links = outgoing[note['url']]
+        num_backlinks = incoming[note['url']]
+
         # Check for orphaned notes (no backlinks)
-        num_backlinks = len(note.backlinks) if hasattr(note, 'backlinks') else 0
         if num_backlinks == 0:
             analysis['orphaned_notes'].append({
-                'title': note.title,
-                'url': note.url,
-                'path': str(note.path),
-                'outgoing_links': len(note.links) if hasattr(note, 'links') else 0
+                'title': note['title'],
+                'url': note['url'],
+                'path': note['path'],
+                'outgoing_links': num_links
             })
-        
+
         # Check for notes without outgoing links
-        num_links = len(note.links) if hasattr(note, 'links') else 0
         if num_links == 0:
             analysis['notes_without_outgoing_links'].append({
-                'title': note.title,
-                'url': note.url,
-                'path': str(note.path),
+                'title': note['title'],
+                'url': note['url'],
+                'path': note['path'],
                 'backlinks': num_backlinks
             })
-        
-        # Check for broken wikilinks
-        if hasattr(note, 'links'):
-            for link in note.links:
-                # Normalize the link URL
-                link_url = link if link.startswith('/') else f'/{link}'
-                
-                # Check if the linked note exists
-                if link_url not in existing_urls:
-                    # Check if it's in notes but has no content (broken link)
-                    if link_url in Note.notes:
-                        target_note = Note.notes[link_url]
-                        if target_note.content is None or target_note.content == '':
-                            analysis['broken_wikilinks'].append({
-                                'source_title': note.title,
-                                'source_url': note.url,
-                                'source_path': str(note.path),
-                                'target_link': link_url,
-                                'target_expected_path': str(target_note.path) if hasattr(target_note, 'path') else 'unknown'
-                            })
-                    else:
-                        # Link doesn't exist at all
-                        analysis['broken_wikilinks'].append({
-                            'source_title': note.title,
-                            'source_url': note.url,
-                            'source_path': str(note.path),
-                            'target_link': link_url,
-                            'target_expected_path': 'Not found in notes'
-                        })
+
+    # Links to notes that do not exist
+    for link in links:
+        if link['target'] in existing:
+            continue
+        source = existing[link['source']]
+        analysis['broken_wikilinks'].append({
+            'source_title': source['title'],
+            'source_url': source['url'],
+            'source_path': source['path'],
+            'target_link': link['target'],
+            'target_expected_path': link['target'].strip('/') + '.md'
+        })
     
     # Update summary counts
     analysis['summary']['orphaned_count'] = len(analysis['orphaned_notes'])
     analysis['summary']['broken_links_count'] = len(analysis['broken_wikilinks'])
+    analysis['summary']['broken_references_count'] = len(analysis['broken_references'])
     analysis['summary']['notes_without_outgoing_count'] = len(analysis['notes_without_outgoing_links'])
     
     # Save to file
@@ -145,13 +239,8 @@ def analyze_internal_links(output_file='stats/link_analysis.json', parse_git=Fal
     
     logger.info(f'Link analysis saved to {output_path}')
     
-    # Also save a timestamped version
-    timestamp = datetime.now(tz=timezone.utc).strftime('%Y%m%d_%H%M%S')
-    historical_path = output_path.parent / f'link_analysis_{timestamp}.json'
-    with open(historical_path, 'w', encoding='utf-8') as f:
-        json.dump(analysis, f, indent=2, ensure_ascii=False)
-    
-    logger.info(f'Historical snapshot saved to {historical_path}')
+    # Also append a snapshot to the history store
+    record_snapshot('links', analysis, history_file=history_file or output_path.parent / 'history.sqlite')
     
     return analysis
 
@@ -166,6 +255,7 @@ def print_link_analysis_summary(analysis):
     print(f'  Total notes analyzed: {analysis["summary"]["total_notes"]}')
     print(f'  Orphaned notes: {analysis["summary"]["orphaned_count"]}')
     print(f'  Broken wikilinks: {analysis["summary"]["broken_links_count"]}')
+    print(f'  Broken references: {analysis["summary"]["broken_references_count"]}')
     print(f'  Notes without outgoing links: {analysis["summary"]["notes_without_outgoing_count"]}')
     
     # Orphaned notes
@@ -191,6 +281,16 @@ def print_link_analysis_summary(analysis):
         if len(analysis['broken_wikilinks']) > 20:
             print(f'    ... and {len(analysis["broken_wikilinks"]) - 20} more')
     
+    # Broken references
+    if analysis['broken_references']:
+        print(f'\n🔗💔 BROKEN REFERENCES (Links, images and embeds to missing files, notes or headings)')
+        print(f'  Found {len(analysis["broken_references"])} broken references:')
+        for i, reference in enumerate(analysis['broken_references'][:20], 1):  # Show first 20
+            print(f'    {i}. {reference["source_path"]}:{reference["line"] or "?"}: {reference["written"]}')
+            print(f'       {reference["problem"]}')
+        if len(analysis['broken_references']) > 20:
+            print(f'    ... and {len(analysis["broken_references"]) - 20} more')
+
     # Notes without outgoing links
     if analysis['notes_without_outgoing_links']:
         print(f'\n📝 NOTES WITHOUT OUTGOING LINKS')
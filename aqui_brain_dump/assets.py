@@ -0,0 +1,166 @@
+"""
+Fingerprinted static files.
+Every file of ``static/`` is copied to the output a second time with a hash of its content in its name
+(``css/style.css`` is also written as ``css/style.1a2b3c4d5e.css``), so it can be cached for as long as a browser wants:
+when the file changes, so does its name. Templates get the fingerprinted url with the ``asset`` filter::
+
+    <link rel="stylesheet" href="{{ 'css/style.css'|asset }}">
+
+which gives ``/static/css/style.1a2b3c4d5e.css``, or ``/static/css/style.css`` if the file was not fingerprinted (e.g.
+in the development server). The files keep their original name as well, so templates that do not use the filter and
+relative urls inside the files (``url(../fonts/a.woff2)``) still work.
+
+The build writes two manifests:
+
+- ``static/manifest.json``: for every file, its fingerprinted url, ETag and ``Cache-Control``, for scripts and servers.
+- ``_headers``, at the root of the output, in the format of Netlify and Cloudflare Pages: fingerprinted files are
+  cached for a year as ``immutable``, the original names are revalidated on every request. Both carry their ETag.
+
+The hash of every file is kept in ``.garden_cache/assets.json`` with its modification time and size, and only files
+whose stat changed are read and hashed again.
+"""
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path, PurePosixPath
+from shutil import copyfile
+
+from aqui_brain_dump import cache_path, output_path, static_path, static_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = cache_path / 'assets.json'
+CACHE_FORMAT = 1
+# Hex characters of the hash added to the names of the files
+FINGERPRINT_LENGTH = 10
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+MANIFEST_NAME = 'manifest.json'
+HEADERS_NAME = '_headers'
+CHUNK_SIZE = 1 << 20
+
+# Path relative to the static folder -> entry of the manifest, for the asset filter
+manifest = {}
+
+
+def fingerprinted_name(rel_path, digest):
+    """ ``css/style.css`` -> ``css/style.<hash>.css``. """
+    path = PurePosixPath(rel_path)
+    return str(path.with_name(f'{path.stem}.{digest[:FINGERPRINT_LENGTH]}{path.suffix}'))
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DigestCache:
+    """ SHA-256 of every file, kept with the modification time and size of the file when it was computed.
+
+    :param cache_file: Where the digests are kept between builds, None to keep them only in memory
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.files = {}
+        self.hits = 0
+        self.misses = 0
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f'Ignoring unreadable asset cache {self.cache_file}: {e}')
+            return
+        if data.get('format') == CACHE_FORMAT:
+            self.files = data['files']
+
+    def digest(self, file_path):
+        """ SHA-256 of a file, read again only if its stat changed since it was last computed. """
+        stat = os.stat(file_path)
+        key = str(file_path)
+        entry = self.files.get(key)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            self.hits += 1
+            return entry[2]
+        self.misses += 1
+        digest = file_digest(file_path)
+        self.files[key] = [stat.st_mtime_ns, stat.st_size, digest]
+        return digest
+
+    def save(self, keep=None):
+        """ Writes the cache, only with the files in ``keep`` if given. """
+        if self.cache_file is None:
+            return
+        if keep is not None:
+            keep = {str(file_path) for file_path in keep}
+            self.files = {key: entry for key, entry in self.files.items() if key in keep}
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'format': CACHE_FORMAT, 'files': self.files}, f)
+        os.replace(tmp_file, self.cache_file)
+
+
+def headers_file(entries):
+    """ Text of a ``_headers`` file for the entries of a manifest. """
+    blocks = []
+    for rel_path, entry in sorted(entries.items()):
+        blocks.append(f'{entry["url"]}\n  Cache-Control: {IMMUTABLE}\n  ETag: {entry["etag"]}\n')
+        blocks.append(f'/{static_url}/{rel_path}\n  Cache-Control: {REVALIDATE}\n  ETag: {entry["etag"]}\n')
+    return ''.join(blocks)
+
+
+def fingerprint_static(source=static_path, destination=None, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Writes a fingerprinted copy of every static file already copied to the output, with the manifests.
+
+    Args:
+        source: Static folder of the garden
+        destination: Where its files were copied, ``output/static`` by default
+        cache_file: Where to keep the digests between builds, None to hash every file
+
+    Returns:
+        dict: Path relative to the static folder -> ``url``, ``etag`` and ``cache_control``
+    """
+    source = Path(source)
+    destination = Path(destination) if destination is not None else output_path / static_url
+    cache = DigestCache(cache_file)
+    files = sorted(file for file in source.rglob('*') if file.is_file())
+    entries = {}
+    for file_path in files:
+        rel_path = file_path.relative_to(source).as_posix()
+        digest = cache.digest(file_path)
+        name = fingerprinted_name(rel_path, digest)
+        copyfile(destination / rel_path, destination / name)
+        entries[rel_path] = {
+            'url': f'/{static_url}/{name}',
+            'etag': f'"{digest[:32]}"',
+            'cache_control': IMMUTABLE,
+        }
+    cache.save(keep=files)
+
+    with open(destination / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, sort_keys=True)
+    with open(destination.parent / HEADERS_NAME, 'w', encoding='utf-8') as f:
+        f.write(headers_file(entries))
+    logger.info(f'Fingerprinted {len(entries)} static files, {cache.misses} hashed again')
+
+    manifest.clear()
+    manifest.update(entries)
+    return entries
+
+
+def static_asset(rel_path):
+    """ Jinja filter: url of a static file, fingerprinted if it is in the manifest. """
+    rel_path = str(rel_path).lstrip('/')
+    entry = manifest.get(rel_path)
+    if entry is None:
+        return f'/{static_url}/{rel_path}'
+    return entry['url']
@@ -7,18 +7,39 @@ It adds a new list attribute to the markdown object that holds all the targets o
 possible to build the graph of backlinks, but it still requires a two-pass approach in order to have the information
 ready for the template rendering.
 
+While the document is converted, the sentence around the first link to each target is kept in ``md.link_snippets``
+(url -> text), so backlinks can show the context in which they were made without converting the linking note again.
+
+``[[Some note#A heading]]`` links to the heading of the note, see :func:`aqui_brain_dump.extension_anchors.heading_id`,
+and ``[[#A heading]]`` to a heading of the same note.
+
 """
 import logging
 
+from markdown import util
 from markdown.extensions import Extension
 from markdown.inlinepatterns import InlineProcessor
+from markdown.treeprocessors import Treeprocessor
 import xml.etree.ElementTree as etree
 import re
 
+from aqui_brain_dump.extension_anchors import heading_id
 
 
 logger = logging.getLogger(__name__)
 
+# [[target]], [[target|text]] or [[target#section|text]]
+WIKILINK_RE = r'\[\[([\w_\|\/ -.]+)\]\]'
+# Longest snippet kept per link, longer sentences are cut around the link
+SNIPPET_LENGTH = 200
+# Elements whose text is a snippet on its own, nested blocks are left to themselves
+SNIPPET_BLOCKS = {'p', 'li', 'td', 'th', 'dt', 'dd', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+SENTENCE_END_RE = re.compile(r'[.!?](?=\s)')
+# Escaped characters and raw HTML still stashed away when the tree processor runs
+ESCAPED_RE = re.compile(f'{util.STX}([0-9]+){util.ETX}')
+STASHED_RE = re.compile(f'{util.STX}[^{util.ETX}]*{util.ETX}')
+
+
 def build_url(label, base, end):
     """ Build a url from the label, a base, and an end. """
     label = label.split('|')[0]
@@ -26,6 +47,41 @@ def build_url(label, base, end):
     return '{}{}{}'.format(base, clean_label, end)
 
 
+def split_label(label):
+    """ Splits the label of a wikilink, ``target#section|text``, into the target and the section (or None). """
+    target = label.split('|')[0]
+    target, _, section = target.partition('#')
+    return target.strip(), section.strip() or None
+
+
+def link_url(label, base='/', end='/', build=build_url):
+    """ Url a wikilink with the given label (what is between the brackets) points to. """
+    href = label.strip().split('|')[0].lower().replace(' ', '_')
+    if href.startswith('/'):
+        href = href[1:]
+    return build(href, base, end)
+
+
+def snippet(text, start, end, length=SNIPPET_LENGTH):
+    """ The sentence of ``text`` around ``text[start:end]``, cut to about ``length`` characters around it. """
+    begin = 0
+    for m in SENTENCE_END_RE.finditer(text, 0, start):
+        begin = m.end()
+    m = SENTENCE_END_RE.search(text, end)
+    stop = m.end() if m is not None else len(text)
+    prefix = suffix = ''
+    if stop - begin > length:
+        room = max(length - (end - start), 0) // 2
+        if start - room > begin:
+            begin = text.rfind(' ', begin, start - room) + 1 or start - room
+            prefix = '… '
+        if end + room < stop:
+            cut = text.find(' ', end + room, stop)
+            stop = cut if cut != -1 else end + room
+            suffix = ' …'
+    return prefix + ' '.join(text[begin:stop].split()) + suffix
+
+
 class WikiLinkExtension(Extension):
 
     def __init__(self, **kwargs):
@@ -40,15 +96,19 @@ class WikiLinkExtension(Extension):
 
     def reset(self):
         self.md.links = set()
+        self.md.link_snippets = {}
+        self.md.wikilink_nodes = {}
 
     def extendMarkdown(self, md):
         self.md = md
+        md.registerExtension(self)
         self.reset()
         # append to end of inline patterns
-        WIKILINK_RE = r'\[\[([\w_\|\/ -.]+)\]\]'
         wikilinkPattern = WikiLinksInlineProcessor(WIKILINK_RE, self.getConfigs())
         wikilinkPattern.md = md
         md.inlinePatterns.register(wikilinkPattern, 'wikilink', 75)
+        # After the inline patterns and before prettify, which only adds whitespace
+        md.treeprocessors.register(LinkSnippetTreeprocessor(md), 'link_snippets', 15)
 
 
 class WikiLinksInlineProcessor(InlineProcessor):
@@ -61,18 +121,26 @@ class WikiLinksInlineProcessor(InlineProcessor):
             base_url, end_url, html_class = self._getMeta()
             label = m.group(1).strip()
             text = label.split('|')[-1]
-            href = label.split('|')[0].lower().replace(' ', '_')
-            if href.startswith('/'):
-                href = href[1:]
-            url = self.config['build_url'](href, base_url, end_url)
-            logger.debug(f'Got link to {url}')
-            if not hasattr(self.md, 'links'):
-                self.md.links = set()
-
-            self.md.links.add(url)
+            target, section = split_label(label)
             a = etree.Element('a')
-            a.text = text
-            a.set('href', url.lower())
+            # The #section is not a tag
+            a.text = util.AtomicString(text) if section else text
+            href = ''
+            if target:
+                url = link_url(target, base_url, end_url, build=self.config['build_url'])
+                logger.debug(f'Got link to {url}')
+                if not hasattr(self.md, 'links'):
+                    self.md.links = set()
+                self.md.links.add(url)
+                href = url.lower()
+                if not hasattr(self.md, 'wikilink_nodes'):
+                    self.md.wikilink_nodes = {}
+                self.md.wikilink_nodes[a] = url
+            if section:
+                href += '#' + heading_id(section)
+            a.set('href', href)
+            if hasattr(self.md, 'reference_labels'):
+                self.md.reference_labels[a] = m.group(0)
 
             if html_class:
                 a.set('class', html_class)
@@ -95,5 +163,55 @@ class WikiLinksInlineProcessor(InlineProcessor):
         return base_url, end_url, html_class
 
 
+class LinkSnippetTreeprocessor(Treeprocessor):
+    """ Keeps the sentence around the first wikilink to each target in ``md.link_snippets``. Each block is read once,
+    however many links it has. """
+    def run(self, root):
+        nodes = getattr(self.md, 'wikilink_nodes', None)
+        if not nodes:
+            return
+        snippets = self.md.link_snippets
+        for block in root.iter():
+            if block.tag not in SNIPPET_BLOCKS:
+                continue
+            parts = []
+            found = []
+            self._collect(block, nodes, parts, found, 0)
+            if not found:
+                continue
+            text = ''.join(parts)
+            for url, start, end in found:
+                if url not in snippets:
+                    snippets[url] = snippet(text, start, end)
+        self.md.wikilink_nodes = {}
+
+    def _collect(self, element, nodes, parts, found, offset):
+        """ Appends the text of ``element`` to ``parts``, without nested blocks, and the position of each wikilink to
+        ``found``. Returns the length of the text up to the end of ``element``, ``offset`` being that up to its start.
+        """
+        start = offset
+        text = self._clean(element.text)
+        parts.append(text)
+        offset += len(text)
+        for child in element:
+            if child.tag not in SNIPPET_BLOCKS:
+                offset = self._collect(child, nodes, parts, found, offset)
+            tail = self._clean(child.tail)
+            parts.append(tail)
+            offset += len(tail)
+        if element in nodes:
+            found.append((nodes[element], start, offset))
+        return offset
+
+    @staticmethod
+    def _clean(text):
+        if not text:
+            return ''
+        if util.STX in text:
+            text = ESCAPED_RE.sub(lambda m: chr(int(m.group(1))), text)
+            text = STASHED_RE.sub('', text)
+        return text
+
+
 def makeExtension(**kwargs):  # pragma: no cover
     return WikiLinkExtension(**kwargs)
\ No newline at end of file
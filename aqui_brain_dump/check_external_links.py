@@ -1,20 +1,39 @@
 """
 Check external HTTP/HTTPS links in the digital garden.
 Attempts to fetch each external link and reports any errors.
+
+Links are checked concurrently by a pool of threads. Each thread keeps its own ``requests.Session`` so connections to
+the same host are reused. The number of simultaneous requests and the delay between requests are limited per host, so
+that a single site never sees more traffic than before even when many sites are checked in parallel.
+
+Results are kept in a persistent cache. Links checked recently are not checked again until their entry expires, with
+a longer lifetime for links that worked than for failing ones. When an entry expires, the stored ``ETag`` and
+``Last-Modified`` values are sent along so servers can answer with a cheap ``304 Not Modified``.
 """
 import json
 import logging
+import os
 import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 from urllib.parse import urlparse
 import time
 
-from aqui_brain_dump import content_path
+from aqui_brain_dump import cache_path
+from aqui_brain_dump.discovery import iter_notes
+from aqui_brain_dump.history import record_snapshot
 from aqui_brain_dump.note import Note
 
 logger = logging.getLogger(__name__)
 
+USER_AGENT = 'Mozilla/5.0 (Digital Garden Link Checker)'
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_ERRORS = {'Timeout', 'Connection Error'}
+DEFAULT_CACHE_FILE = cache_path / 'external_links.json'
+
 
 def extract_external_links(content):
     """
@@ -41,32 +60,42 @@ def extract_external_links(content):
     return set(matches + md_urls)
 
 
-def check_url(url, timeout=10):
+def check_url(url, timeout=10, session=None, etag=None, last_modified=None):
     """
     Check if a URL is accessible.
     
     Args:
         url: URL to check
         timeout: Request timeout in seconds
+        session: Optional requests.Session to reuse connections
+        etag: ETag from a previous check, sent as If-None-Match
+        last_modified: Last-Modified from a previous check, sent as If-Modified-Since
     
     Returns:
         dict: Result with status code, error, etc.
     """
+    import requests
+    http = session if session is not None else requests
+    headers = {'User-Agent': USER_AGENT}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
     try:
-        import requests
-        response = requests.head(url, timeout=timeout, allow_redirects=True, 
-                                headers={'User-Agent': 'Mozilla/5.0 (Digital Garden Link Checker)'})
+        response = http.head(url, timeout=timeout, allow_redirects=True, headers=headers)
         
         # If HEAD request fails, try GET
         if response.status_code >= 400:
-            response = requests.get(url, timeout=timeout, allow_redirects=True,
-                                  headers={'User-Agent': 'Mozilla/5.0 (Digital Garden Link Checker)'})
+            response = http.get(url, timeout=timeout, allow_redirects=True, stream=True, headers=headers)
+            response.close()
         
         return {
-            'status': 'ok' if response.status_code == 200 else 'warning',
+            'status': 'ok' if response.status_code in (200, 304) else 'warning',
             'status_code': response.status_code,
             'final_url': response.url,
-            'error': None
+            'error': None,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
         }
     except requests.exceptions.Timeout:
         return {
@@ -105,16 +134,192 @@ def check_url(url, timeout=10):
         }
 
 
+class LinkCache:
+    """
+    Persistent per-url record of the last check of each external link.
+    
+    Args:
+        cache_file: JSON file where the entries are kept
+        ok_ttl: Seconds before a link that was ok needs to be checked again
+        error_ttl: Seconds before a link that failed or gave a warning needs to be checked again
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, ok_ttl=7 * 24 * 3600, error_ttl=24 * 3600):
+        self.cache_file = Path(cache_file)
+        self.ok_ttl = ok_ttl
+        self.error_ttl = error_ttl
+        self.entries = {}
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+            logger.debug(f'Loaded {len(self.entries)} cached link results from {self.cache_file}')
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f'Ignoring unreadable link cache {self.cache_file}: {e}')
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def is_fresh(self, url, now=None):
+        entry = self.entries.get(url)
+        if entry is None:
+            return False
+        now = now if now is not None else time.time()
+        ttl = self.ok_ttl if entry['status'] == 'ok' else self.error_ttl
+        return now - entry['checked_at'] < ttl
+
+    def validators(self, url):
+        """ Returns the ETag and Last-Modified of the last successful check of a url, to make a conditional request. """
+        entry = self.entries.get(url) or {}
+        if entry.get('status') != 'ok':
+            return {}
+        return {'etag': entry.get('etag'), 'last_modified': entry.get('last_modified')}
+
+    def update(self, url, result, now=None):
+        """ Stores a fresh result. A 304 answer keeps the previous status code and final url. """
+        previous = self.entries.get(url) or {}
+        if result['status_code'] == 304 and previous:
+            result = dict(result, status_code=previous['status_code'], final_url=previous['final_url'],
+                          etag=result.get('etag') or previous.get('etag'),
+                          last_modified=result.get('last_modified') or previous.get('last_modified'))
+        self.entries[url] = {
+            'status': result['status'],
+            'status_code': result['status_code'],
+            'final_url': result['final_url'],
+            'error': result['error'],
+            'etag': result.get('etag'),
+            'last_modified': result.get('last_modified'),
+            'checked_at': now if now is not None else time.time(),
+        }
+        return result
+
+    def prune(self, urls):
+        """ Forgets every url not in ``urls``, so the cache does not grow with links that were removed. """
+        urls = set(urls)
+        self.entries = {url: entry for url, entry in self.entries.items() if url in urls}
+
+    def save(self):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+
+def interleave_by_host(urls):
+    """ Orders urls round-robin by host, so that consecutive urls rarely wait on the same host. """
+    by_host = OrderedDict()
+    for url in urls:
+        by_host.setdefault(urlparse(url).netloc.lower(), []).append(url)
+    queues = list(by_host.values())
+    ordered = []
+    for i in range(max((len(q) for q in queues), default=0)):
+        ordered.extend(q[i] for q in queues if i < len(q))
+    return ordered
+
+
+class LinkChecker:
+    """
+    Checks many urls concurrently while staying polite to each host.
+    
+    Args:
+        timeout: Request timeout in seconds
+        max_workers: Maximum number of requests in flight overall
+        per_host: Maximum number of requests in flight to the same host
+        delay: Minimum time in seconds between the start of two requests to the same host
+        retries: Number of extra attempts for timeouts, connection errors and 429/5xx answers
+        backoff: Base of the exponential backoff between attempts, in seconds
+    """
+    def __init__(self, timeout=10, max_workers=8, per_host=2, delay=0.5, retries=2, backoff=1.0):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.delay = delay
+        self.retries = retries
+        self.backoff = backoff
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._host_next_request = {}
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.per_host)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def _host_slot(self, host):
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._host_slots[host]
+
+    def _wait_for_host(self, host):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._host_next_request.get(host, now))
+            self._host_next_request[host] = start + self.delay
+        if start > now:
+            time.sleep(start - now)
+
+    def check(self, url, validators=None):
+        host = urlparse(url).netloc.lower()
+        with self._host_slot(host):
+            for attempt in range(self.retries + 1):
+                self._wait_for_host(host)
+                result = check_url(url, timeout=self.timeout, session=self._session(), **(validators or {}))
+                retry = result['error'] in RETRY_ERRORS or result['status_code'] in RETRY_STATUS_CODES
+                if not retry or attempt == self.retries:
+                    break
+                wait = self.backoff * 2 ** attempt
+                logger.debug(f'Retrying {url} in {wait}s (attempt {attempt + 1}/{self.retries})')
+                time.sleep(wait)
+        result['attempts'] = attempt + 1
+        return result
+
+    def check_all(self, urls, validators=None):
+        """ Checks all urls and returns a dictionary url -> result, in the same order as the input.
+        
+        ``validators`` optionally maps urls to the ``etag``/``last_modified`` of a previous check.
+        """
+        urls = list(urls)
+        validators = validators or {}
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.check, url, validators.get(url)): url for url in interleave_by_host(urls)}
+            for i, future in enumerate(as_completed(futures), 1):
+                url = futures[future]
+                results[url] = future.result()
+                logger.info(f'Checked link {i}/{len(urls)}: {url} ({results[url]["status"]})')
+        return {url: results[url] for url in urls}
+
+
 def check_external_links(output_file='stats/external_links.json', parse_git=False, 
-                        delay=0.5, timeout=10):
+                        delay=0.5, timeout=10, max_workers=8, per_host=2, retries=2,
+                        use_cache=True, cache_file=DEFAULT_CACHE_FILE, ok_ttl=7 * 24 * 3600, error_ttl=24 * 3600,
+                        history_file=None):
     """
     Check all external links in the digital garden.
     
     Args:
         output_file: Path to save results JSON file
         parse_git: Whether to parse git information
-        delay: Delay between requests in seconds (to be polite)
+        delay: Delay between requests to the same host in seconds (to be polite)
         timeout: Request timeout in seconds
+        max_workers: Maximum number of simultaneous requests
+        per_host: Maximum number of simultaneous requests to the same host
+        retries: Number of retries for timeouts, connection errors and 429/5xx answers
+        use_cache: Whether to reuse results of previous runs that have not expired
+        cache_file: Where results are kept between runs
+        ok_ttl: Seconds a result for a working link is reused
+        error_ttl: Seconds a result for a failing link is reused
+        history_file: History store to append the snapshot to. Defaults to history.sqlite next to output_file
     
     Returns:
         dict: Check results
@@ -132,27 +337,12 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
         }
     
     # Parse all notes
-    import os
-    f_walk = os.walk(content_path)
-    for dirs in f_walk:
-        if 'templates' in dirs[0]:
-            continue
-        cur_dir = dirs[0]
-        sub_dir = Path(cur_dir).absolute()
-        
-        if str(sub_dir).startswith('.') or 'templates' in str(sub_dir):
-            continue
-        
-        for file in dirs[2]:
-            if not file.endswith('.md'):
-                continue
-            filepath = Path(cur_dir) / file
-            logger.debug(f'Creating note for external link check: {filepath}')
-            Note.create_from_path(filepath, parse_git=parse_git)
+    for filepath in iter_notes():
+        logger.debug(f'Creating note for external link check: {filepath}')
+        Note.create_from_path(filepath, parse_git=parse_git)
     
     # Wait for all parsing to complete
-    while len([f for f in Note.futures_executor if f.running()]):
-        time.sleep(.01)
+    Note.wait_for_executor()
     Note.note_executor.shutdown(wait=True)
     
     results = {
@@ -164,7 +354,9 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
             'unique_external_links': 0,
             'ok_links': 0,
             'warning_links': 0,
-            'error_links': 0
+            'error_links': 0,
+            'fresh_checks': 0,
+            'cached_results': 0
         }
     }
     
@@ -196,11 +388,30 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
     logger.info(f'Found {results["summary"]["unique_external_links"]} unique external links')
     logger.info(f'Checking links (this may take a while)...')
     
-    # Check each unique link
-    for i, (link, source_notes) in enumerate(all_external_links.items(), 1):
-        logger.info(f'Checking link {i}/{len(all_external_links)}: {link}')
-        
-        check_result = check_url(link, timeout=timeout)
+    # Check each unique link that has no fresh result in the cache
+    cache = LinkCache(cache_file, ok_ttl=ok_ttl, error_ttl=error_ttl)
+    now = time.time()
+    if use_cache:
+        stale_links = [link for link in all_external_links if not cache.is_fresh(link, now)]
+    else:
+        stale_links = list(all_external_links)
+    logger.info(f'{len(all_external_links) - len(stale_links)} links have a fresh cached result, '
+                f'checking {len(stale_links)}')
+    
+    checker = LinkChecker(timeout=timeout, max_workers=max_workers, per_host=per_host, delay=delay,
+                          retries=retries)
+    validators = {link: cache.validators(link) for link in stale_links} if use_cache else {}
+    checked = checker.check_all(stale_links, validators=validators)
+    
+    for link, source_notes in all_external_links.items():
+        if link in checked:
+            check_result = cache.update(link, checked[link], now)
+            source = 'fresh'
+            results['summary']['fresh_checks'] += 1
+        else:
+            check_result = cache.get(link)
+            source = 'cached'
+            results['summary']['cached_results'] += 1
         
         link_result = {
             'url': link,
@@ -208,6 +419,9 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
             'status_code': check_result['status_code'],
             'final_url': check_result['final_url'],
             'error': check_result['error'],
+            'attempts': check_result.get('attempts', 0),
+            'source': source,
+            'checked_at': datetime.fromtimestamp(cache.get(link)['checked_at'], tz=timezone.utc).isoformat(),
             'found_in_notes': source_notes
         }
         
@@ -220,10 +434,10 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
             results['summary']['warning_links'] += 1
         else:
             results['summary']['error_links'] += 1
-        
-        # Be polite and wait between requests
-        if delay > 0 and i < len(all_external_links):
-            time.sleep(delay)
+    
+    cache.prune(all_external_links)
+    cache.save()
+    logger.info(f'Link cache saved to {cache.cache_file}')
     
     # Save to file
     output_path = Path(output_file)
@@ -234,13 +448,8 @@ def check_external_links(output_file='stats/external_links.json', parse_git=Fals
     
     logger.info(f'External link check results saved to {output_path}')
     
-    # Also save a timestamped version
-    timestamp = datetime.now(tz=timezone.utc).strftime('%Y%m%d_%H%M%S')
-    historical_path = output_path.parent / f'external_links_{timestamp}.json'
-    with open(historical_path, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
-    
-    logger.info(f'Historical snapshot saved to {historical_path}')
+    # Also append a snapshot to the history store
+    record_snapshot('external', results, history_file=history_file or output_path.parent / 'history.sqlite')
     
     return results
 
@@ -262,6 +471,8 @@ def print_external_links_summary(results):
     print(f'  ✅ OK (200): {results["summary"]["ok_links"]}')
     print(f'  ⚠️  Warning (non-200): {results["summary"]["warning_links"]}')
     print(f'  ❌ Error: {results["summary"]["error_links"]}')
+    print(f'  🔄 Checked now: {results["summary"]["fresh_checks"]}')
+    print(f'  💾 From cache: {results["summary"]["cached_results"]}')
     
     # Show problematic links
     problematic = [link for link in results['links_checked'] 
@@ -278,6 +489,8 @@ def print_external_links_summary(results):
                 print(f'     Error: {link["error"]}')
             if link['final_url'] and link['final_url'] != link['url']:
                 print(f'     Redirected to: {link["final_url"]}')
+            if link['source'] == 'cached':
+                print(f'     Cached result from {link["checked_at"]}')
             print(f'     Found in {len(link["found_in_notes"])} note(s):')
             for note in link["found_in_notes"][:3]:  # Show first 3 notes
                 print(f'       - "{note["title"]}" ({note["url"]})')
@@ -0,0 +1,236 @@
+"""
+Content discovery.
+Finds the files of the garden with ``os.scandir``, shared by the build and every analysis tool. Folders and files are
+listed in sorted order, so notes are discovered in the same order on every file system, and yielded as they are found,
+so notes can be parsed while the walk goes on.
+
+Files and folders matching a pattern of ``.gardenignore``, in the content folder, are skipped. It uses the syntax of
+``.gitignore``: ``*``, ``?``, ``**`` and ``[...]`` wildcards, a trailing ``/`` to match only folders, a leading or
+inner ``/`` to anchor the pattern to the content folder, ``!`` to include again something excluded by an earlier
+pattern and ``#`` for comments. :data:`DEFAULT_IGNORE` is always applied first::
+
+    # .gardenignore
+    drafts/
+    /private/**
+    *.tmp
+    !keep.tmp
+
+The listing of every folder is cached in ``.garden_cache/discovery.json`` together with its modification time. A
+folder whose modification time did not change since the last walk has the same entries, so it is not listed again.
+"""
+import json
+import logging
+import os
+import re
+import time
+from pathlib import Path
+
+from aqui_brain_dump import cache_path, content_path
+
+logger = logging.getLogger(__name__)
+
+IGNORE_FILE = '.gardenignore'
+DEFAULT_CACHE_FILE = cache_path / 'discovery.json'
+# Hidden folders (.git, .obsidian, .trash), dependencies and the templates of the note editor
+DEFAULT_IGNORE = ['.*/', 'node_modules/', '__pycache__/', 'templates/', IGNORE_FILE]
+# A folder modified this recently may change again within the resolution of its modification time, so its listing is
+# not cached
+RACY_SECONDS = 2
+
+
+def _translate(pattern):
+    """ Translates a gitignore pattern, without ``!`` or trailing ``/``, into a regular expression matched against
+    paths relative to the content folder. """
+    anchored = '/' in pattern.rstrip('/')
+    pattern = pattern.lstrip('/')
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                group = pattern[i + 1:end]
+                if group.startswith('!'):
+                    group = '^' + group[1:]
+                regex += f'[{group}]'
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    prefix = '' if anchored else '(?:.*/)?'
+    return re.compile(f'{prefix}{regex}')
+
+
+class IgnoreRules:
+    """ Patterns of a ``.gardenignore`` file. The last pattern matching a path decides whether it is ignored.
+
+    :param patterns: Lines of the ignore file
+    """
+    def __init__(self, patterns=()):
+        self.rules = []
+        for line in patterns:
+            line = line.rstrip('\n')
+            if not line.endswith('\\ '):
+                line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            self.rules.append((_translate(line.rstrip('/')), negate, dir_only))
+
+    @classmethod
+    def from_folder(cls, root=content_path):
+        patterns = list(DEFAULT_IGNORE)
+        try:
+            with open(Path(root) / IGNORE_FILE, 'r', encoding='utf-8') as f:
+                patterns += f.readlines()
+        except FileNotFoundError:
+            pass
+        return cls(patterns)
+
+    def ignored(self, rel_path, is_dir=False):
+        """ Whether a path, relative to the content folder and with ``/`` as separator, is ignored. """
+        result = False
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path):
+                result = not negate
+        return result
+
+
+class DirectoryCache:
+    """ Entries of every folder walked, keyed by the folder's modification time.
+
+    :param cache_file: JSON file where the listings are kept between runs, or None to keep them only in memory
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.listings = {}
+        self.hits = 0
+        self.misses = 0
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                self.listings = json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f'Ignoring unreadable discovery cache {self.cache_file}: {e}')
+
+    def list(self, folder):
+        """ Returns the sorted ``(name, is_dir)`` entries of a folder. Symbolic links to folders are left out, since
+        the walk does not follow them. """
+        key = os.fspath(folder)
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self.listings.get(key)
+        if cached is not None and cached[0] == mtime:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        entries = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    if is_dir and entry.is_symlink():
+                        continue
+                except OSError:
+                    continue
+                entries.append((entry.name, is_dir))
+        entries.sort()
+        if time.time_ns() - mtime > RACY_SECONDS * 1e9:
+            self.listings[key] = (mtime, entries)
+        else:
+            self.listings.pop(key, None)
+        return entries
+
+    def save(self):
+        if self.cache_file is None:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Every shard of a build walks the garden, so each process writes its own temporary file
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.listings, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+
+def walk(root=content_path, ignore=None, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Walks a folder top-down, in sorted order, skipping what the ignore rules exclude.
+
+    Args:
+        root: Folder to walk, the content folder by default
+        ignore: :class:`IgnoreRules`, by default those of ``DEFAULT_IGNORE`` and ``.gardenignore`` in ``root``
+        cache_file: Where to keep the listing of every folder between runs, None to always list them
+
+    Yields:
+        tuple: ``(folder, files)``, the absolute path of each folder and the sorted names of its files
+    """
+    root = Path(root).absolute()
+    ignore = ignore if ignore is not None else IgnoreRules.from_folder(root)
+    cache = DirectoryCache(cache_file)
+    walked = set()
+
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        folder = root / rel_dir if rel_dir else root
+        try:
+            entries = cache.list(folder)
+        except OSError as e:
+            logger.warning(f'Can not list {folder}: {e}')
+            continue
+        walked.add(os.fspath(folder))
+        prefix = f'{rel_dir}/' if rel_dir else ''
+        files = []
+        dirs = []
+        for name, is_dir in entries:
+            if ignore.ignored(prefix + name, is_dir):
+                continue
+            (dirs if is_dir else files).append(prefix + name)
+        yield folder, [name[len(prefix):] for name in files]
+        # Reversed, so that the first folder is popped first
+        stack.extend(reversed(dirs))
+
+    # Only reached when the walk is complete, so listings of folders that no longer exist can be dropped
+    cache.listings = {key: value for key, value in cache.listings.items() if key in walked}
+    logger.debug(f'Discovery listed {cache.misses} folders, {cache.hits} unchanged')
+    cache.save()
+
+
+def iter_files(root=content_path, suffix=None, **kwargs):
+    """ Yields the absolute path of every file of the garden, optionally only those ending with ``suffix``, in the
+    order of :func:`walk`. """
+    for folder, files in walk(root, **kwargs):
+        for file in files:
+            if suffix is None or file.endswith(suffix):
+                yield folder / file
+
+
+def iter_notes(root=content_path, **kwargs):
+    """ Yields the absolute path of every markdown file of the garden. """
+    return iter_files(root, suffix='.md', **kwargs)
@@ -0,0 +1,112 @@
+"""
+Anchors and internal references.
+Gives every heading an ``id`` made from its text, so ``[[Some note#A heading]]`` and ``[Text](/some_note/#a-heading)``
+land on it, and keeps, while the document is converted, what is needed to check the links of a note once every note is
+known (see :func:`aqui_brain_dump.analyze_links.validate_references`):
+
+- ``md.anchors``: every ``id`` of the document, those of the headings and of the footnotes included, and those written
+  in raw HTML.
+- ``md.link_references``: ``(href, written)`` of every internal link, image and embed, where ``written`` is how the
+  link appears in the markdown, to find it in the source file when it is broken.
+
+The wikilink and wikiimage extensions leave in ``md.reference_labels`` the markup of the elements they create, other
+links are found by their ``href`` as written.
+"""
+import re
+import xml.etree.ElementTree as etree
+from urllib.parse import unquote, urljoin, urlsplit
+
+from markdown import util
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# Links with a scheme (http:, mailto:, ...) or a host are not part of the garden
+EXTERNAL_RE = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*:|//)')
+RAW_ID_RE = re.compile(r'''\sid\s*=\s*["']([^"']+)["']''')
+# Escaped characters and inline HTML still stashed away when the tree processor runs
+STASHED_RE = re.compile(f'{util.STX}([0-9]+){util.ETX}|{util.STX}[^{util.ETX}]*{util.ETX}')
+
+
+def heading_id(text):
+    """ Id of a heading with the given text: lowercase, with every run of spaces and punctuation replaced by ``-``.
+    Headings that are the same ignoring case and punctuation have the same id, as sections of embeds. """
+    return re.sub(r'[\W_]+', '-', text).strip('-').lower()
+
+
+def is_internal(href):
+    return bool(href) and not EXTERNAL_RE.match(href)
+
+
+def reference_target(url, href, rewrites=None):
+    """ Url of the page an internal reference of the note at ``url`` points to, and the anchor in it (empty if none).
+    ``rewrites`` are the links of the note that were resolved to another url, see ``Note.resolve_links``. """
+    parts = urlsplit(href)
+    path = unquote(parts.path)
+    if path:
+        path = urljoin(url, (rewrites or {}).get(path, path))
+    return path or url, unquote(parts.fragment)
+
+
+def _text(element):
+    text = ''.join(element.itertext())
+    if util.STX in text:
+        text = STASHED_RE.sub(lambda m: chr(int(m.group(1))) if m.group(1) else '', text)
+    return text
+
+
+class AnchorTreeprocessor(Treeprocessor):
+    """ Sets the ids of the headings and collects the anchors and internal references of the document. """
+    def run(self, root):
+        anchors = self.md.anchors
+        references = self.md.link_references
+        labels = getattr(self.md, 'reference_labels', {})
+        ids = {element.get('id') for element in root.iter() if element.get('id')}
+        for element in root.iter():
+            if element.tag in HEADING_TAGS and not element.get('id'):
+                base = heading_id(_text(element)) or 'section'
+                anchor, n = base, 0
+                while anchor in ids:
+                    n += 1
+                    anchor = f'{base}_{n}'
+                ids.add(anchor)
+                element.set('id', anchor)
+            if element.get('id'):
+                anchors.append(element.get('id'))
+
+            if element.tag == 'a':
+                href = element.get('href')
+            elif element.tag == 'img':
+                href = element.get('src')
+            elif element.get('data-embed') is not None:
+                href = element.get('data-embed')
+                if element.get('data-section'):
+                    href += '#' + heading_id(element.get('data-section'))
+            else:
+                continue
+            if is_internal(href):
+                references.append((href, labels.get(element, href)))
+
+        for block in self.md.htmlStash.rawHtmlBlocks:
+            if isinstance(block, etree.Element):
+                continue
+            anchors.extend(RAW_ID_RE.findall(block))
+        self.md.reference_labels = {}
+
+
+class AnchorExtension(Extension):
+    def extendMarkdown(self, md):
+        self.md = md
+        md.registerExtension(self)
+        self.reset()
+        # After the inline patterns, which create the links, and the footnotes
+        md.treeprocessors.register(AnchorTreeprocessor(md), 'anchors', 16)
+
+    def reset(self):
+        self.md.anchors = []
+        self.md.link_references = []
+        self.md.reference_labels = {}
+
+
+def makeExtension(**kwargs):  # pragma: no cover
+    return AnchorExtension(**kwargs)
@@ -21,12 +21,15 @@ class CitationInlineProcessor(InlineProcessor):
             if cite in self.biblio:
                 a = etree.Element('a')
                 a.text = m[0].strip()
-                a.set('href', f'/literature/{m[0]}')
+                # The page that build_lit_pages writes for the citation
+                a.set('href', f'/lit_note/@{cite}/')
                 b = etree.Element('span')
                 b.text = self.biblio[cite]['title']
                 b.set('class', 'tooltiptext')
                 a.append(b)
                 a.set('class', 'litnote tooltip')
+                if hasattr(self.md, 'reference_labels'):
+                    self.md.reference_labels[a] = m.group(0)
             else:
                 a = m[0]
             return a, m.start(0), m.end(0)
@@ -7,11 +7,13 @@ from markdown.extensions import Extension
 from markdown.inlinepatterns import InlineProcessor
 import xml.etree.ElementTree as etree
 
-RE_TAGS = re.compile(r"(?<!`)(#+([^#\s.,\/!$%\^&\*;{}\[\]'\"=`~()<>”\\]|:[a-zA-Z0-9])+)")
+# A tag is made of segments separated by /, e.g. #physics/optics. A trailing / is not part of the tag
+TAG_SEGMENT = r"(?:[^#\s.,\/!$%\^&\*;{}\[\]'\"=`~()<>”\\]|:[a-zA-Z0-9])+"
+RE_TAGS = re.compile(rf"(?<!`)(#+{TAG_SEGMENT}(?:/{TAG_SEGMENT})*)")
 
 
 class TagInlineProcessor(InlineProcessor):
-    RE_TAGS = r"(#+([^#\s.,\/!$%\^&\*;{}\[\]'\"=`~()<>”\\]|:[a-zA-Z0-9])+)"
+    RE_TAGS = rf"(#+{TAG_SEGMENT}(?:/{TAG_SEGMENT})*)"
 
     def handleMatch(self, m, data):
         if m.group(1):
@@ -21,7 +23,7 @@ class TagInlineProcessor(InlineProcessor):
             self.md.tags.add(m.group(1))
             a = etree.Element('a')
             a.text = m[0]
-            a.set('href', '/tags/{}'.format(m.group(1).strip('#')))
+            a.set('href', '/tags/{}'.format(m.group(1).strip('#').lower()))
             return a, m.start(0), m.end(0)
 
 
@@ -4,19 +4,100 @@ WikiImage Extension
 
 Adapted directly from the official extension `Wikilinks <https://github.com/Python-Markdown/markdown/blob/master/markdown/extensions/meta.py>`_.
 The scope is to be able to render images that use the wikiformat (``![image](path.png)``).
+
+If the target is not an image, e.g. ``![[Some note]]`` or ``![[Some note#A heading]]``, the note (or only the section
+under that heading) is embedded. The note is not available while converting, so a placeholder is left in its place,
+see :func:`embed_placeholder`, and the url of the note is added to ``md.embeds`` and ``md.links``. The placeholders are
+replaced by :meth:`aqui_brain_dump.note.Note.expand_embeds` once every note is known. An embed is a block: if it is
+written inside a paragraph, the paragraph is closed before it and opened again after it.
 """
 
 import logging
 
 from markdown.extensions import Extension
 from markdown.inlinepatterns import InlineProcessor
+from markdown.treeprocessors import Treeprocessor
 import xml.etree.ElementTree as etree
 import re
 
+from aqui_brain_dump.backlinks_wikilinks import link_url, split_label
+
 
 logger = logging.getLogger(__name__)
 
 
+IMAGE_EXTENSIONS = {'.apng', '.avif', '.bmp', '.gif', '.ico', '.jpeg', '.jpg', '.png', '.svg', '.tif', '.tiff',
+                    '.webp'}
+
+
+def is_image(target):
+    """ Whether the target of ``![[target]]`` is an image, judging by its extension. """
+    target = target.split('|')[0].strip().lower()
+    return any(target.endswith(extension) for extension in IMAGE_EXTENSIONS)
+
+
+def split_embed(label):
+    """ Splits the label of an embed, ``note#section|text``, into the url of the note and the section (or None). """
+    target, section = split_label(label)
+    return link_url(target), section
+
+
+def embed_placeholder(url, section=None):
+    """ Element left in the HTML where a note is embedded. """
+    div = etree.Element('div')
+    div.set('class', 'transclusion')
+    div.set('data-embed', url)
+    if section:
+        div.set('data-section', section)
+    return div
+
+
+def is_embed_placeholder(element):
+    return element.tag == 'div' and element.get('data-embed') is not None
+
+
+def split_paragraph(paragraph):
+    """ Splits a paragraph with embed placeholders in it into the paragraphs before, between and after them and the
+    placeholders, without the paragraphs left empty. """
+    blocks = []
+    current = etree.Element('p', paragraph.attrib)
+    current.text = paragraph.text
+    for child in list(paragraph):
+        if not is_embed_placeholder(child):
+            current.append(child)
+            continue
+        blocks.append(current)
+        blocks.append(child)
+        current = etree.Element('p', paragraph.attrib)
+        current.text, child.tail = child.tail, None
+        if current.text:
+            current.text = current.text.lstrip()
+    blocks.append(current)
+    kept = []
+    for block in blocks:
+        if block.tag == 'p' and not len(block) and not (block.text or '').strip():
+            continue
+        if block.tag == 'p' and not len(block):
+            block.text = block.text.rstrip()
+        elif block.tag == 'p' and block[-1].tail:
+            block[-1].tail = block[-1].tail.rstrip()
+        kept.append(block)
+    return kept
+
+
+class EmbedTreeprocessor(Treeprocessor):
+    """ Moves the embed placeholders out of the paragraphs they were written in, a ``div`` can't be in a ``p``. """
+    def run(self, root):
+        if not getattr(self.md, 'embeds', None):
+            return
+        for parent in list(root.iter()):
+            for index, child in reversed(list(enumerate(parent))):
+                if child.tag == 'p' and any(is_embed_placeholder(element) for element in child):
+                    blocks = split_paragraph(child)
+                    blocks[-1].tail = child.tail
+                    parent[index:index + 1] = blocks
+
+
 def build_url(label, base, end):
     """ Build a url from the label, a base, and an end. """
     label = label.split('|')[0]
@@ -37,15 +118,20 @@ class WikiImageExtension(Extension):
 
     def reset(self):
         self.md.images = []
+        self.md.embeds = set()
 
     def extendMarkdown(self, md):
         self.md = md
+        md.registerExtension(self)
+        self.reset()
 
         # append to end of inline patterns
         WIKIIMAGE_RE = r'\!\[\[([\w0-9\/_\| -.]+)\]\]'
         wikiimage_pattern = WikiImageInlineProcessor(WIKIIMAGE_RE, self.getConfigs())
         wikiimage_pattern.md = md
         md.inlinePatterns.register(wikiimage_pattern, 'wikiimage', 80)
+        # After the inline patterns, before the anchors and the snippets of the links are collected
+        md.treeprocessors.register(EmbedTreeprocessor(md), 'embeds', 17)
 
 
 class WikiImageInlineProcessor(InlineProcessor):
@@ -54,6 +140,19 @@ class WikiImageInlineProcessor(InlineProcessor):
         self.config = config
 
     def handleMatch(self, m, data):
+        if m.group(1).strip() and not is_image(m.group(1)):
+            url, section = split_embed(m.group(1).strip())
+            logger.debug(f'Got embed of {url}')
+            if not hasattr(self.md, 'embeds'):
+                self.md.embeds = set()
+            if not hasattr(self.md, 'links'):
+                self.md.links = set()
+            self.md.embeds.add(url)
+            self.md.links.add(url)
+            div = embed_placeholder(url, section)
+            if hasattr(self.md, 'reference_labels'):
+                self.md.reference_labels[div] = m.group(0)
+            return div, m.start(0), m.end(0)
         if m.group(1).strip():
             base_url, end_url, html_class = self._getMeta()
             label = m.group(1).strip()
@@ -67,6 +166,8 @@ class WikiImageInlineProcessor(InlineProcessor):
 
             if html_class:
                 img.set('class', html_class)
+            if hasattr(self.md, 'reference_labels'):
+                self.md.reference_labels[img] = m.group(0)
         else:
             img = ''
         return img, m.start(0), m.end(0)
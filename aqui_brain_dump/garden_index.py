@@ -0,0 +1,385 @@
+"""
+Garden index.
+Keeps the parsed model of the garden in ``.garden_cache/garden.sqlite``, so questions about it are a query instead of
+parsing every note again: the url, path, folder, title, metadata, number of words and git dates of every note, and the
+links, tags, citations, anchors and internal references (see :mod:`aqui_brain_dump.extension_anchors`) of each.
+Backlinks are the links by target, and every column asked about is indexed::
+
+    garden_tools query orphans --folder physics
+    garden_tools query citing @Smith2020
+    garden_tools query backlinks /some_note/
+    garden_tools query tagged physics
+    garden_tools query broken
+    garden_tools query sql "SELECT title, words FROM notes ORDER BY words DESC LIMIT 10"
+
+The build brings it up to date with :func:`update_index` once the links of every note are resolved. Each note is
+stored with a digest of everything kept about it, and only notes whose digest changed are written again.
+``garden_tools query``, ``stats`` and ``links`` read the garden from the index, after :func:`refresh_index`: only the
+notes whose file changed since the last update (by modification time and size) are parsed. The links of every note are
+kept as written as well, and all of them are resolved again against the titles, paths and aliases in the index, so
+renaming, moving or deleting a note also updates the links of the notes that did not change. To read every note again,
+as the build does, parse them and call :func:`update_index`.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from pathlib import Path, PurePosixPath
+from types import SimpleNamespace
+
+from aqui_brain_dump import cache_path, content_path
+from aqui_brain_dump.extension_anchors import reference_target
+from aqui_brain_dump.tags import tag_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_FILE = cache_path / 'garden.sqlite'
+# Bump to build the index again from scratch, e.g. if what is stored for each note changes
+INDEX_FORMAT = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    url TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    folder TEXT NOT NULL,
+    title TEXT NOT NULL,
+    meta TEXT NOT NULL,
+    words INTEGER NOT NULL,
+    created TEXT,
+    modified TEXT,
+    edits INTEGER,
+    git INTEGER NOT NULL,
+    mtime_ns INTEGER,
+    size INTEGER,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notes_folder ON notes (folder);
+CREATE INDEX IF NOT EXISTS notes_path ON notes (path);
+CREATE TABLE IF NOT EXISTS links (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    PRIMARY KEY (source, target)
+);
+CREATE INDEX IF NOT EXISTS links_target ON links (target);
+CREATE TABLE IF NOT EXISTS labels (
+    source TEXT NOT NULL,
+    label TEXT NOT NULL,
+    PRIMARY KEY (source, label)
+);
+CREATE TABLE IF NOT EXISTS tags (
+    url TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (url, tag)
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE TABLE IF NOT EXISTS cites (
+    url TEXT NOT NULL,
+    cite TEXT NOT NULL,
+    PRIMARY KEY (url, cite)
+);
+CREATE INDEX IF NOT EXISTS cites_cite ON cites (cite);
+CREATE TABLE IF NOT EXISTS anchors (
+    url TEXT NOT NULL,
+    anchor TEXT NOT NULL,
+    PRIMARY KEY (url, anchor)
+);
+CREATE TABLE IF NOT EXISTS refs (
+    source TEXT NOT NULL,
+    href TEXT NOT NULL,
+    target TEXT NOT NULL,
+    fragment TEXT NOT NULL,
+    written TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_source ON refs (source);
+"""
+NOTE_COLUMNS = ('url', 'path', 'folder', 'title', 'meta', 'words', 'created', 'modified', 'edits', 'git', 'mtime_ns',
+                'size')
+# Table -> its columns, the first being the url of the note, for what is kept of every note besides its row
+CHILD_TABLES = {
+    'links': ('source', 'target'),
+    'labels': ('source', 'label'),
+    'tags': ('url', 'tag'),
+    'cites': ('url', 'cite'),
+    'anchors': ('url', 'anchor'),
+    'refs': ('source', 'href', 'target', 'fragment', 'written'),
+}
+
+
+def _date(value):
+    if value is None:
+        return None
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def note_record(note):
+    """ What the index keeps of a note: its row, the rows of each of the :data:`CHILD_TABLES` without the url of the
+    note, and the digest of all of them. """
+    path = PurePosixPath(Path(note.path).as_posix())
+    try:
+        stat = os.stat(note.file_path)
+        mtime_ns, size = stat.st_mtime_ns, stat.st_size
+    except OSError:
+        mtime_ns = size = None
+    folder = path.parent.as_posix()
+    row = {
+        'url': note.url,
+        'path': path.as_posix(),
+        'folder': '' if folder == '.' else folder,
+        'title': str(note.title),
+        'meta': json.dumps(note.meta, default=str, sort_keys=True, ensure_ascii=False),
+        'words': getattr(note, 'words', 0),
+        'created': _date(note.creation_date),
+        'modified': _date(note.last_mod),
+        'edits': note.number_edits,
+        'git': int(bool(getattr(note, 'parse_git', False))),
+        'mtime_ns': mtime_ns,
+        'size': size,
+    }
+    references = []
+    for href, written in getattr(note, 'references', ()):
+        target, fragment = reference_target(note.url, href, note.rewrites)
+        references.append((href, target, fragment, written))
+    children = {
+        'links': [(link,) for link in sorted(set(note.links))],
+        'labels': [(label,) for label in sorted(set(getattr(note, 'link_labels', None) or note.links))],
+        'tags': [(tag,) for tag in sorted({tag_name(tag) for tag in note.tags} - {''})],
+        'cites': [(cite,) for cite in sorted(set(note.cites))],
+        'anchors': [(anchor,) for anchor in sorted(set(getattr(note, 'anchors', ())))],
+        'refs': references,
+    }
+    digest = hashlib.sha1(json.dumps([row, children], ensure_ascii=False).encode('utf-8')).hexdigest()
+    return row, children, digest
+
+
+class GardenIndex:
+    """ SQLite index of the notes of a garden.
+
+    :param index_file: SQLite database, created if it does not exist
+    """
+    def __init__(self, index_file=DEFAULT_INDEX_FILE):
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.index_file), timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != INDEX_FORMAT:
+            with self.db:
+                for table in ('notes', *CHILD_TABLES):
+                    self.db.execute(f'DROP TABLE IF EXISTS {table}')
+        self.db.executescript(SCHEMA)
+        self.db.execute(f'PRAGMA user_version = {INDEX_FORMAT}')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def digests(self):
+        return dict(self.db.execute('SELECT url, digest FROM notes'))
+
+    def _delete(self, urls):
+        tables = [('notes', 'url')] + [(table, columns[0]) for table, columns in CHILD_TABLES.items()]
+        for table, column in tables:
+            self.db.executemany(f'DELETE FROM {table} WHERE {column} = ?', [(url,) for url in urls])
+
+    def write(self, records, removed=()):
+        """
+        Stores the notes whose digest changed and drops the ``removed`` urls.
+
+        Args:
+            records: :func:`note_record` of the notes to store
+            removed: Urls of notes that no longer exist
+
+        Returns:
+            int: Number of notes written
+        """
+        known = self.digests()
+        changed = [record for record in records if known.get(record[0]['url']) != record[2]]
+        with self.db:
+            self._delete(list(removed) + [row['url'] for row, _, _ in changed])
+            placeholders = ', '.join('?' for _ in NOTE_COLUMNS)
+            self.db.executemany(
+                f'INSERT INTO notes ({", ".join(NOTE_COLUMNS)}, digest) VALUES ({placeholders}, ?)',
+                [tuple(row[column] for column in NOTE_COLUMNS) + (digest,) for row, _, digest in changed])
+            for table, columns in CHILD_TABLES.items():
+                placeholders = ', '.join('?' for _ in columns)
+                self.db.executemany(f'INSERT OR IGNORE INTO {table} ({", ".join(columns)}) VALUES ({placeholders})',
+                                    [(row['url'], *values) for row, children, _ in changed
+                                     for values in children[table]])
+        return len(changed)
+
+    def update(self, notes):
+        """ Brings the index up to date with every note read from a file in ``notes`` (url -> note, as
+        ``Note.notes``), with its links already resolved. Returns the number of notes written. """
+        records = [note_record(note) for note in notes.values()
+                   if note.has_content and note.cite_key is None and os.path.isfile(note.file_path)]
+        urls = {record[0]['url'] for record in records}
+        removed = [url for url in self.digests() if url not in urls]
+        written = self.write(records, removed)
+        logger.info(f'Garden index: {written} notes written, {len(removed)} removed, {len(records)} in total')
+        return written
+
+    def query(self, sql, parameters=()):
+        return [dict(row) for row in self.db.execute(sql, parameters)]
+
+    def orphans(self, folder=None):
+        """ Notes no other note links to, only those in ``folder`` (or its subfolders) if given. """
+        folder = folder.strip('/') if folder else None
+        return self.query(
+            'SELECT url, title, path FROM notes n '
+            'WHERE (:folder IS NULL OR folder = :folder OR folder LIKE :folder || \'/%\') '
+            'AND NOT EXISTS (SELECT 1 FROM links l WHERE l.target = n.url AND l.source != n.url) '
+            'ORDER BY url', {'folder': folder})
+
+    def citing(self, cite):
+        """ Notes that cite ``cite``, with or without the ``@``. """
+        return self.query('SELECT n.url, n.title, n.path FROM cites c JOIN notes n ON n.url = c.url '
+                          'WHERE c.cite = ? ORDER BY n.url', (cite.strip('@').lower(),))
+
+    def backlinks(self, url):
+        return self.query('SELECT n.url, n.title, n.path FROM links l JOIN notes n ON n.url = l.source '
+                          'WHERE l.target = ? ORDER BY n.url', (url,))
+
+    def tagged(self, tag):
+        """ Notes with ``tag`` or any tag nested under it. """
+        name = tag_name(tag)
+        return self.query('SELECT DISTINCT n.url, n.title, n.path FROM tags t JOIN notes n ON n.url = t.url '
+                          'WHERE t.tag = :tag OR t.tag LIKE :tag || \'/%\' ORDER BY n.url', {'tag': name})
+
+    def broken(self):
+        """ Links to notes that do not exist. """
+        return self.query('SELECT l.source, l.target FROM links l LEFT JOIN notes n ON n.url = l.target '
+                          'WHERE n.url IS NULL ORDER BY l.source, l.target')
+
+    def generated_urls(self):
+        """ Urls of the pages the build generates for the tags, with their ancestors, and the citations. """
+        from aqui_brain_dump.tags import tag_page_url
+
+        urls = set()
+        for (tag,) in self.db.execute('SELECT DISTINCT tag FROM tags'):
+            parts = tag.split('/')
+            urls.update(tag_page_url('/'.join(parts[:depth])) for depth in range(1, len(parts) + 1))
+        urls.update(f'/lit_note/@{cite}/' for (cite,) in self.db.execute('SELECT DISTINCT cite FROM cites'))
+        return urls
+
+    def resolve_links(self, resolver):
+        """ Resolves the links of every note again from how they are written, as ``Note.resolve_links`` does, and
+        updates the links and the targets of the references that changed. Returns the number of notes whose links
+        changed. """
+        urls = {url for (url,) in self.db.execute('SELECT url FROM notes')}
+        rewrites = {}
+        for source, label in self.db.execute('SELECT source, label FROM labels'):
+            rewrites.setdefault(source, {})[label] = label if label in urls else resolver.resolve(label) or label
+        links = {}
+        for source, target in self.db.execute('SELECT source, target FROM links'):
+            links.setdefault(source, set()).add(target)
+        refs = self.db.execute('SELECT rowid, source, href, target FROM refs').fetchall()
+        changed = [source for source in urls if set(rewrites.get(source, {}).values()) != links.get(source, set())]
+        with self.db:
+            self.db.executemany('DELETE FROM links WHERE source = ?', [(source,) for source in changed])
+            self.db.executemany('INSERT OR IGNORE INTO links (source, target) VALUES (?, ?)',
+                                [(source, target) for source in changed
+                                 for target in rewrites.get(source, {}).values()])
+            for rowid, source, href, target in refs:
+                resolved, _ = reference_target(source, href, rewrites.get(source))
+                if resolved != target:
+                    self.db.execute('UPDATE refs SET target = ? WHERE rowid = ?', (resolved, rowid))
+        return len(changed)
+
+    def resolver(self):
+        """ :class:`~aqui_brain_dump.resolver.LinkResolver` of the notes in the index. """
+        from aqui_brain_dump.resolver import LinkResolver
+
+        return LinkResolver.from_notes(
+            SimpleNamespace(url=row['url'], path=row['path'], title=row['title'], meta=json.loads(row['meta']))
+            for row in self.db.execute('SELECT url, path, title, meta FROM notes'))
+
+    def stale_files(self, git=False):
+        """ Markdown files that are new or changed since they were indexed, and urls of the notes whose file is gone.
+        With ``git``, notes indexed without reading their dates from git are stale as well. """
+        from aqui_brain_dump.discovery import iter_notes
+
+        indexed = {row['path']: (row['url'], row['mtime_ns'], row['size'], row['git'])
+                   for row in self.db.execute('SELECT url, path, mtime_ns, size, git FROM notes')}
+        stale = []
+        for file_path in iter_notes():
+            path = file_path.relative_to(content_path).as_posix()
+            _, mtime_ns, size, from_git = indexed.pop(path, (None, None, None, 0))
+            stat = os.stat(file_path)
+            if (stat.st_mtime_ns, stat.st_size) != (mtime_ns, size) or (git and not from_git):
+                stale.append(file_path)
+        return stale, [url for url, _, _, _ in indexed.values()]
+
+
+def update_index(notes, index_file=DEFAULT_INDEX_FILE):
+    """ Updates the index with ``notes``, see :meth:`GardenIndex.update`. """
+    with GardenIndex(index_file) as index:
+        return index.update(notes)
+
+
+def refresh_index(index_file=DEFAULT_INDEX_FILE, parse_git=False):
+    """
+    Brings the index up to date by parsing only the notes whose file is new or changed, and resolves again the links
+    of every note, see :meth:`GardenIndex.resolve_links`.
+
+    Args:
+        index_file: SQLite database of the index
+        parse_git: Whether to read the dates of the notes from git. Notes indexed without them are parsed again
+
+    Returns:
+        GardenIndex: The index, open, to query it
+    """
+    from aqui_brain_dump.note import Note
+
+    index = GardenIndex(index_file)
+    stale, removed = index.stale_files(git=parse_git)
+    if not stale and not removed:
+        return index
+    logger.info(f'Garden index: parsing {len(stale)} changed notes')
+    notes = [Note.create_from_path(file_path, parse_git=parse_git) for file_path in stale]
+    Note.wait_for_executor()
+    # A note whose url changed (e.g. a new slug) is also gone under its old url
+    urls = {note.url for note in notes}
+    paths = {note.path.as_posix() for note in notes}
+    moved = [row['url'] for row in index.db.execute('SELECT url, path FROM notes')
+             if row['path'] in paths and row['url'] not in urls]
+    # The links of the parsed notes are stored as written and resolved with all the others
+    index.write([note_record(note) for note in notes], removed=removed + moved)
+    changed = index.resolve_links(index.resolver())
+    logger.info(f'Garden index: links of {changed} notes resolved to other notes')
+    return index
+
+
+def open_index(index_file=DEFAULT_INDEX_FILE, parse_git=False, reindex=False):
+    """
+    The index, up to date, for the analyses that read the garden from it.
+
+    Args:
+        index_file: SQLite database of the index
+        parse_git: Whether to read the dates of the parsed notes from git
+        reindex: Parse every note and resolve every link again, as the build does, instead of :func:`refresh_index`
+
+    Returns:
+        GardenIndex: The index, open, to query it
+    """
+    if not reindex:
+        return refresh_index(index_file, parse_git=parse_git)
+    from aqui_brain_dump.discovery import iter_notes
+    from aqui_brain_dump.note import Note
+
+    logger.info('Garden index: parsing every note')
+    for file_path in iter_notes():
+        Note.create_from_path(file_path, parse_git=parse_git)
+    Note.wait_for_executor()
+    Note.build_backlinks()
+    Note.sort_collections()
+    index = GardenIndex(index_file)
+    index.update(Note.notes)
+    return index
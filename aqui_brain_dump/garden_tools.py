@@ -7,9 +7,8 @@ import logging
 import sys
 from pathlib import Path
 
-from aqui_brain_dump.stats import generate_statistics, print_statistics_summary
-from aqui_brain_dump.analyze_links import analyze_internal_links, print_link_analysis_summary
-from aqui_brain_dump.check_external_links import check_external_links, print_external_links_summary
+# The analysis modules parse notes and pull in Markdown, Jinja and BeautifulSoup. They are imported inside each
+# command so that ``garden_tools --help`` stays fast.
 
 
 def setup_logging(verbose=False):
@@ -36,10 +35,14 @@ def setup_logging(verbose=False):
 
 def cmd_stats(args):
     """Generate statistics about your digital garden"""
+    from aqui_brain_dump.stats import generate_statistics, print_statistics_summary
+
     print('\n🌱 Generating digital garden statistics...\n')
     stats = generate_statistics(
         output_file=args.output,
-        parse_git=args.git
+        parse_git=args.git,
+        layout=args.layout,
+        reindex=args.reindex
     )
     print_statistics_summary(stats)
     print(f'\n💾 Statistics saved to: {args.output}')
@@ -47,10 +50,13 @@ def cmd_stats(args):
 
 def cmd_links(args):
     """Analyze internal links"""
+    from aqui_brain_dump.analyze_links import analyze_internal_links, print_link_analysis_summary
+
     print('\n🔗 Analyzing internal links...\n')
     analysis = analyze_internal_links(
         output_file=args.output,
-        parse_git=args.git
+        parse_git=args.git,
+        reindex=args.reindex
     )
     print_link_analysis_summary(analysis)
     print(f'\n💾 Analysis saved to: {args.output}')
@@ -58,20 +64,97 @@ def cmd_links(args):
 
 def cmd_external(args):
     """Check external links"""
+    from aqui_brain_dump.check_external_links import check_external_links, print_external_links_summary
+
     print('\n🌐 Checking external links...\n')
-    print(f'⏱️  This may take a while (delay: {args.delay}s between requests)\n')
+    print(f'⏱️  This may take a while ({args.workers} workers, {args.per_host} per host, '
+          f'delay: {args.delay}s between requests to the same host)\n')
     results = check_external_links(
         output_file=args.output,
         parse_git=args.git,
         delay=args.delay,
-        timeout=args.timeout
+        timeout=args.timeout,
+        max_workers=args.workers,
+        per_host=args.per_host,
+        retries=args.retries,
+        use_cache=not args.no_cache,
+        ok_ttl=args.ok_ttl * 3600,
+        error_ttl=args.error_ttl * 3600
     )
     print_external_links_summary(results)
     print(f'\n💾 Results saved to: {args.output}')
 
 
+def cmd_history(args):
+    """Show the evolution of metrics over time"""
+    from aqui_brain_dump.history import HistoryStore, import_json_snapshots, print_history
+
+    if args.import_json:
+        imported = import_json_snapshots(stats_dir=Path(args.file).parent, history_file=args.file)
+        print(f'\n📥 Imported {imported} snapshots into {args.file}')
+
+    with HistoryStore(args.file) as store:
+        if args.list or not args.metrics:
+            print(f'\n📚 {len(store.snapshots(kind=args.kind))} snapshots in {args.file}')
+            print('\nAvailable metrics:')
+            for name in store.metric_names(kind=args.kind):
+                print(f'  {name}')
+            print()
+            return
+        print_history(store, args.metrics, kind=args.kind, since=args.since)
+
+
+def cmd_diff(args):
+    """Compare two garden graphs"""
+    import json
+    from aqui_brain_dump.graph_diff import diff_graph_files, print_graph_diff_summary
+
+    diff = diff_graph_files(args.old, args.new, output_file=args.output, history_file=args.history)
+    if args.json:
+        print(json.dumps(diff, indent=2, ensure_ascii=False))
+        return
+    print_graph_diff_summary(diff)
+    if args.output:
+        print(f'\n💾 Diff saved to: {args.output}')
+
+
+def cmd_query(args):
+    """Query the garden index"""
+    import json
+    from aqui_brain_dump.garden_index import refresh_index, GardenIndex
+
+    index = GardenIndex(args.index) if args.no_refresh else refresh_index(args.index, parse_git=args.git)
+    with index:
+        if args.question in ('citing', 'backlinks', 'tagged', 'sql') and not args.argument:
+            print(f'\n❌ query {args.question} needs an argument')
+            sys.exit(1)
+        if args.question == 'orphans':
+            rows = index.orphans(folder=args.folder)
+        elif args.question == 'citing':
+            rows = index.citing(args.argument)
+        elif args.question == 'backlinks':
+            rows = index.backlinks(args.argument)
+        elif args.question == 'tagged':
+            rows = index.tagged(args.argument)
+        elif args.question == 'broken':
+            rows = index.broken()
+        else:
+            rows = index.query(args.argument)
+
+    if args.json:
+        print(json.dumps(rows, indent=2, ensure_ascii=False))
+        return
+    for row in rows:
+        print('  '.join(str(value) for value in row.values()))
+    print(f'\n{len(rows)} results')
+
+
 def cmd_all(args):
     """Run all analyses"""
+    from aqui_brain_dump.stats import generate_statistics, print_statistics_summary
+    from aqui_brain_dump.analyze_links import analyze_internal_links, print_link_analysis_summary
+    from aqui_brain_dump.check_external_links import check_external_links, print_external_links_summary
+
     print('\n🚀 Running all analyses...\n')
     
     # Statistics
@@ -80,7 +163,8 @@ def cmd_all(args):
     print('='*60)
     stats = generate_statistics(
         output_file='stats/garden_stats.json',
-        parse_git=args.git
+        parse_git=args.git,
+        reindex=args.reindex
     )
     print_statistics_summary(stats)
     
@@ -88,6 +172,7 @@ def cmd_all(args):
     print('\n' + '='*60)
     print('2/3: ANALYZING INTERNAL LINKS')
     print('='*60)
+    # The statistics already brought the index up to date, even with --reindex
     analysis = analyze_internal_links(
         output_file='stats/link_analysis.json',
         parse_git=args.git
@@ -103,7 +188,13 @@ def cmd_all(args):
         output_file='stats/external_links.json',
         parse_git=args.git,
         delay=args.delay,
-        timeout=args.timeout
+        timeout=args.timeout,
+        max_workers=args.workers,
+        per_host=args.per_host,
+        retries=args.retries,
+        use_cache=not args.no_cache,
+        ok_ttl=args.ok_ttl * 3600,
+        error_ttl=args.error_ttl * 3600
     )
     print_external_links_summary(results)
     
@@ -135,6 +226,16 @@ Examples:
   # Use git information for dates
   python -m aqui_brain_dump.garden_tools stats --git
   
+  # Show how the number of notes evolved
+  python -m aqui_brain_dump.garden_tools history total_notes
+  
+  # What changed since the previous statistics run
+  python -m aqui_brain_dump.garden_tools diff history:-2 history:-1
+  
+  # Orphaned notes in a folder, and notes citing a reference, from the garden index
+  python -m aqui_brain_dump.garden_tools query orphans --folder physics
+  python -m aqui_brain_dump.garden_tools query citing @Smith2020
+  
   # Verbose output
   python -m aqui_brain_dump.garden_tools stats -v
         """
@@ -151,6 +252,10 @@ Examples:
                              help='Output file path (default: stats/garden_stats.json)')
     stats_parser.add_argument('--git', action='store_true',
                              help='Parse git information for accurate dates')
+    stats_parser.add_argument('--no-layout', dest='layout', action='store_false',
+                             help='Save the graph without the position of every note')
+    stats_parser.add_argument('--reindex', action='store_true',
+                             help='Parse every note again instead of only those changed since the index was updated')
     stats_parser.set_defaults(func=cmd_stats)
     
     # Links command
@@ -159,6 +264,8 @@ Examples:
                              help='Output file path (default: stats/link_analysis.json)')
     links_parser.add_argument('--git', action='store_true',
                              help='Parse git information')
+    links_parser.add_argument('--reindex', action='store_true',
+                             help='Parse every note again instead of only those changed since the index was updated')
     links_parser.set_defaults(func=cmd_links)
     
     # External links command
@@ -168,19 +275,89 @@ Examples:
     external_parser.add_argument('--git', action='store_true',
                                 help='Parse git information')
     external_parser.add_argument('-d', '--delay', type=float, default=0.5,
-                                help='Delay between requests in seconds (default: 0.5)')
+                                help='Delay between requests to the same host in seconds (default: 0.5)')
     external_parser.add_argument('-t', '--timeout', type=int, default=10,
                                 help='Request timeout in seconds (default: 10)')
+    external_parser.add_argument('-w', '--workers', type=int, default=8,
+                                help='Maximum number of simultaneous requests (default: 8)')
+    external_parser.add_argument('--per-host', type=int, default=2,
+                                help='Maximum number of simultaneous requests to the same host (default: 2)')
+    external_parser.add_argument('--retries', type=int, default=2,
+                                help='Retries for timeouts, connection errors and 429/5xx answers (default: 2)')
+    external_parser.add_argument('--no-cache', action='store_true',
+                                help='Check every link again, ignoring results of previous runs')
+    external_parser.add_argument('--ok-ttl', type=float, default=168,
+                                help='Hours a result for a working link is reused (default: 168)')
+    external_parser.add_argument('--error-ttl', type=float, default=24,
+                                help='Hours a result for a failing link is reused (default: 24)')
     external_parser.set_defaults(func=cmd_external)
     
+    # History command
+    history_parser = subparsers.add_parser('history', help='Show metrics over time from the history store')
+    history_parser.add_argument('metrics', nargs='*',
+                               help='Metrics to show, e.g. total_notes or summary.orphaned_count')
+    history_parser.add_argument('-f', '--file', default='stats/history.sqlite',
+                               help='History store (default: stats/history.sqlite)')
+    history_parser.add_argument('-k', '--kind', choices=['stats', 'links', 'external'],
+                               help='Only use snapshots of this kind')
+    history_parser.add_argument('--since', help='Only show values from this ISO date on, e.g. 2024-01-01')
+    history_parser.add_argument('-l', '--list', action='store_true',
+                               help='List the available metrics')
+    history_parser.add_argument('--import-json', action='store_true',
+                               help='Import the timestamped JSON snapshots of earlier versions first')
+    history_parser.set_defaults(func=cmd_history)
+    
+    # Diff command
+    diff_parser = subparsers.add_parser('diff', help='Compare two garden graphs')
+    diff_parser.add_argument('old', help='Graph JSON file, or history:<id> (negative ids count back from the latest)')
+    diff_parser.add_argument('new', nargs='?', default='stats/garden_graph.json',
+                            help='Graph JSON file, or history:<id> (default: stats/garden_graph.json)')
+    diff_parser.add_argument('-o', '--output', default=None,
+                            help='Save the diff as JSON to this file')
+    diff_parser.add_argument('--json', action='store_true',
+                            help='Print the diff as JSON instead of a summary')
+    diff_parser.add_argument('--history', default='stats/history.sqlite',
+                            help='History store for history: references (default: stats/history.sqlite)')
+    diff_parser.set_defaults(func=cmd_diff)
+    
+    # Query command
+    query_parser = subparsers.add_parser('query', help='Query the garden index')
+    query_parser.add_argument('question', choices=['orphans', 'citing', 'backlinks', 'tagged', 'broken', 'sql'],
+                              help='orphans [--folder F], citing KEY, backlinks URL, tagged TAG, broken or sql QUERY')
+    query_parser.add_argument('argument', nargs='?', help='Citation key, note url, tag or SQL query')
+    query_parser.add_argument('--folder', help='Only orphans in this folder of the content, or its subfolders')
+    query_parser.add_argument('-f', '--index', default='.garden_cache/garden.sqlite',
+                              help='Garden index (default: .garden_cache/garden.sqlite)')
+    query_parser.add_argument('--no-refresh', action='store_true',
+                              help='Query the index as it is, without parsing the notes that changed first')
+    query_parser.add_argument('--git', action='store_true',
+                              help='Parse git information of the notes that changed')
+    query_parser.add_argument('--json', action='store_true',
+                              help='Print the results as JSON')
+    query_parser.set_defaults(func=cmd_query)
+    
     # All command
     all_parser = subparsers.add_parser('all', help='Run all analyses')
     all_parser.add_argument('--git', action='store_true',
                            help='Parse git information')
+    all_parser.add_argument('--reindex', action='store_true',
+                           help='Parse every note again instead of only those changed since the index was updated')
     all_parser.add_argument('-d', '--delay', type=float, default=0.5,
-                           help='Delay between requests for external links (default: 0.5)')
+                           help='Delay between requests to the same host for external links (default: 0.5)')
     all_parser.add_argument('-t', '--timeout', type=int, default=10,
                            help='Request timeout in seconds (default: 10)')
+    all_parser.add_argument('-w', '--workers', type=int, default=8,
+                           help='Maximum number of simultaneous requests for external links (default: 8)')
+    all_parser.add_argument('--per-host', type=int, default=2,
+                           help='Maximum number of simultaneous requests to the same host (default: 2)')
+    all_parser.add_argument('--retries', type=int, default=2,
+                           help='Retries for timeouts, connection errors and 429/5xx answers (default: 2)')
+    all_parser.add_argument('--no-cache', action='store_true',
+                           help='Check every link again, ignoring results of previous runs')
+    all_parser.add_argument('--ok-ttl', type=float, default=168,
+                           help='Hours a result for a working link is reused (default: 168)')
+    all_parser.add_argument('--error-ttl', type=float, default=24,
+                           help='Hours a result for a failing link is reused (default: 24)')
     all_parser.set_defaults(func=cmd_all)
     
     args = parser.parse_args()
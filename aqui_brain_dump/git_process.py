@@ -4,10 +4,12 @@ from collections import Counter
 from datetime import datetime
 from pathlib import Path
 
+from aqui_brain_dump.trace import traced
 
 logger = logging.getLogger(__name__)
 
 
+@traced('git:creation_date', cat='git')
 def get_creation_date(filename):
     """ Get the creation date of a filename using git.
 
@@ -33,6 +35,7 @@ def get_creation_date(filename):
     return date
 
 
+@traced('git:last_modification_date', cat='git')
 def get_last_modification_date(filename):
     """Get the last modification date of the given file.
 
@@ -57,6 +60,7 @@ def get_last_modification_date(filename):
             return date
 
 
+@traced('git:number_commits', cat='git')
 def get_number_commits(filename):
     """ Get the number of edits stored on git for a given file.
 
@@ -0,0 +1,154 @@
+"""
+Compare two garden graphs.
+Reports which notes, links, tags and citations were added or removed between two builds or two snapshots.
+
+Graphs can be read from a ``garden_graph.json`` file or from the history store with ``history:<id>``, where negative
+ids count back from the latest statistics snapshot (``history:-1`` is the latest, ``history:-2`` the one before).
+Every comparison is a difference of hashed sets, so the work is linear in the size of the graphs.
+"""
+import json
+import logging
+from pathlib import Path
+
+from aqui_brain_dump.history import DEFAULT_HISTORY_FILE, HistoryStore
+
+logger = logging.getLogger(__name__)
+
+
+def load_graph(ref, history_file=DEFAULT_HISTORY_FILE):
+    """
+    Load a graph from a JSON file or from the history store.
+
+    Args:
+        ref: Path to a graph JSON file, or ``history:<id>``
+        history_file: History store used for ``history:`` references
+
+    Returns:
+        dict: Graph with ``nodes`` and ``links``
+    """
+    if str(ref).startswith('history:'):
+        snapshot_id = int(str(ref)[len('history:'):])
+        with HistoryStore(history_file) as store:
+            if snapshot_id < 0:
+                snapshots = store.snapshots(kind='stats')
+                if len(snapshots) < -snapshot_id:
+                    raise ValueError(f'Only {len(snapshots)} statistics snapshots in {history_file}')
+                snapshot_id = snapshots[snapshot_id]['id']
+            logger.info(f'Loading graph of snapshot {snapshot_id} from {history_file}')
+            return store.graph_at(snapshot_id)
+    with open(ref, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _index(graph):
+    notes = {}
+    tags = set()
+    tag_assignments = set()
+    cites = set()
+    citations = set()
+    for node in graph.get('nodes', []):
+        if node.get('is_tag'):
+            tags.add(node['id'][len('/tags/'):].strip('/'))
+            continue
+        notes[node['id']] = node
+        for tag in node.get('tags', []):
+            tag = tag.strip('#').lower()
+            tags.add(tag)
+            tag_assignments.add((node['id'], tag))
+        for cite in node.get('cites', []):
+            cites.add(cite)
+            citations.add((node['id'], cite))
+    links = {(link['source'], link['target']) for link in graph.get('links', [])}
+    return notes, links, tags, tag_assignments, cites, citations
+
+
+def diff_graphs(old, new):
+    """
+    Compare two graphs.
+
+    Args:
+        old: Graph with ``nodes`` and ``links``
+        new: Graph with ``nodes`` and ``links``
+
+    Returns:
+        dict: Added and removed notes, links, tags and citations, sorted, plus a summary of the counts
+    """
+    old_notes, old_links, old_tags, old_assigned, old_cites, old_citations = _index(old)
+    new_notes, new_links, new_tags, new_assigned, new_cites, new_citations = _index(new)
+
+    def note_entries(ids, notes):
+        return [{'id': i, 'title': notes[i].get('title')} for i in sorted(ids)]
+
+    diff = {
+        'notes': {
+            'added': note_entries(new_notes.keys() - old_notes.keys(), new_notes),
+            'removed': note_entries(old_notes.keys() - new_notes.keys(), old_notes),
+        },
+        'links': {
+            'added': [{'source': s, 'target': t} for s, t in sorted(new_links - old_links)],
+            'removed': [{'source': s, 'target': t} for s, t in sorted(old_links - new_links)],
+        },
+        'tags': {
+            'added': sorted(new_tags - old_tags),
+            'removed': sorted(old_tags - new_tags),
+            'assigned': [{'note': n, 'tag': t} for n, t in sorted(new_assigned - old_assigned)],
+            'unassigned': [{'note': n, 'tag': t} for n, t in sorted(old_assigned - new_assigned)],
+        },
+        'citations': {
+            'added': sorted(new_cites - old_cites),
+            'removed': sorted(old_cites - new_cites),
+            'cited': [{'note': n, 'cite': c} for n, c in sorted(new_citations - old_citations)],
+            'uncited': [{'note': n, 'cite': c} for n, c in sorted(old_citations - new_citations)],
+        },
+    }
+    diff['summary'] = {
+        f'{section}_{change}': len(entries)
+        for section, changes in diff.items()
+        for change, entries in changes.items()
+    }
+    return diff
+
+
+def diff_graph_files(old_ref, new_ref, output_file=None, history_file=DEFAULT_HISTORY_FILE):
+    """
+    Compare two graphs given as files or history references and optionally save the result.
+
+    Returns:
+        dict: The diff, with the references under ``old`` and ``new``
+    """
+    diff = {'old': str(old_ref), 'new': str(new_ref)}
+    diff.update(diff_graphs(load_graph(old_ref, history_file), load_graph(new_ref, history_file)))
+    if output_file is not None:
+        output_path = Path(output_file)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(diff, f, indent=2, ensure_ascii=False)
+        logger.info(f'Graph diff saved to {output_path}')
+    return diff
+
+
+def print_graph_diff_summary(diff):
+    """Print a human-readable summary of a graph diff"""
+    print('\n' + '='*60)
+    print('GARDEN CHANGES')
+    print('='*60)
+    print(f'\nFrom: {diff["old"]}')
+    print(f'To:   {diff["new"]}')
+
+    sections = [
+        ('📝 NOTES', 'notes', lambda e: f'"{e["title"]}" ({e["id"]})'),
+        ('🔗 LINKS', 'links', lambda e: f'{e["source"]} → {e["target"]}'),
+        ('🏷️  TAGS', 'tags', lambda e: f'#{e}'),
+        ('📚 CITATIONS', 'citations', lambda e: f'@{e}'),
+    ]
+    for title, section, fmt in sections:
+        added = diff[section]['added']
+        removed = diff[section]['removed']
+        print(f'\n{title}: +{len(added)} / -{len(removed)}')
+        for sign, entries in (('+', added), ('-', removed)):
+            for entry in entries[:10]:
+                print(f'  {sign} {fmt(entry)}')
+            if len(entries) > 10:
+                print(f'  ... and {len(entries) - 10} more')
+
+    print('\n' + '='*60 + '\n')
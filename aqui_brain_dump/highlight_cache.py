@@ -0,0 +1,173 @@
+"""
+Cache of highlighted code blocks.
+Pygments lexes and formats every code block of every note on each build, which is the slowest part of converting
+code-heavy notes. The HTML of each block is kept in ``.garden_cache/highlight.sqlite``, keyed by a hash of everything
+that changes it: the code, its language, the options of ``codehilite`` (and of the block, e.g. ``hl_lines``) and the
+versions of Pygments and Markdown. Blocks that did not change are emitted without calling Pygments.
+
+The cache keeps at most ``max_entries`` blocks. Every hit updates the time the block was last used, and the least
+recently used blocks are dropped when it grows past that.
+
+:func:`install` makes ``fenced_code`` and ``codehilite`` use :class:`CachedCodeHilite`. Several processes can share
+the cache, e.g. the shards of a build.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from markdown.extensions import codehilite, fenced_code
+
+from aqui_brain_dump import cache_path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = cache_path / 'highlight.sqlite'
+DEFAULT_MAX_ENTRIES = 10000
+# Bump to discard every cached block, e.g. if the way they are stored changes
+CACHE_FORMAT = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    key TEXT PRIMARY KEY,
+    html TEXT NOT NULL,
+    used INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS blocks_used ON blocks (used);
+"""
+
+
+class HighlightCache:
+    """ Persistent, bounded map of block key -> highlighted HTML.
+
+    :param cache_file: SQLite database where the blocks are kept
+    :param max_entries: Blocks kept before the least recently used are dropped
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, max_entries=DEFAULT_MAX_ENTRIES):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+        self._inserted = 0
+        # Keys of the blocks reused since their last use was saved, written in batches
+        self._used = []
+
+    @property
+    def connection(self):
+        # A connection can not be used after a fork, every process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.fspath(self.cache_file)), exist_ok=True)
+            connection = sqlite3.connect(self.cache_file, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            self._pid = os.getpid()
+        return self._connection
+
+    def get(self, key):
+        with self._lock:
+            try:
+                row = self.connection.execute('SELECT html FROM blocks WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._used.append(key)
+                    if len(self._used) >= 500:
+                        self._save_used()
+            except sqlite3.Error as e:
+                logger.warning(f'Highlight cache {self.cache_file} not available: {e}')
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, html):
+        with self._lock:
+            try:
+                self.connection.execute('INSERT OR REPLACE INTO blocks (key, html, used) VALUES (?, ?, ?)',
+                                        (key, html, time.time_ns()))
+                self._inserted += 1
+                # Counting the rows on every insert would cost as much as the insert itself
+                if self._inserted % 100 == 0:
+                    self.evict()
+            except sqlite3.Error as e:
+                logger.warning(f'Highlight cache {self.cache_file} not available: {e}')
+
+    def _save_used(self):
+        used = time.time_ns()
+        self.connection.executemany('UPDATE blocks SET used = ? WHERE key = ?', [(used, key) for key in self._used])
+        self._used = []
+
+    def evict(self):
+        """ Drops the least recently used blocks beyond ``max_entries``. """
+        count = self.connection.execute('SELECT COUNT(*) FROM blocks').fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM blocks WHERE key IN (SELECT key FROM blocks ORDER BY used LIMIT ?)',
+                (count - self.max_entries,))
+            logger.debug(f'Dropped {count - self.max_entries} blocks from the highlight cache')
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._pid == os.getpid():
+                try:
+                    self._save_used()
+                    self.evict()
+                except sqlite3.Error as e:
+                    logger.warning(f'Highlight cache {self.cache_file} not available: {e}')
+                self._connection.close()
+            self._connection = None
+            self._used = []
+
+
+cache = HighlightCache()
+
+
+def block_key(highliter, shebang):
+    """ Hash of everything that changes the HTML of a code block. """
+    import markdown
+    import pygments
+
+    formatter = highliter.pygments_formatter
+    if not isinstance(formatter, str):
+        formatter = f'{formatter.__module__}.{formatter.__qualname__}'
+    parts = [
+        CACHE_FORMAT,
+        pygments.__version__,
+        markdown.__version__,
+        highliter.lang,
+        shebang,
+        highliter.guess_lang,
+        highliter.lang_prefix,
+        formatter,
+        sorted((key, repr(value)) for key, value in highliter.options.items()),
+    ]
+    digest = hashlib.sha256(repr(parts).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(highliter.src.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachedCodeHilite(codehilite.CodeHilite):
+    """ ``CodeHilite`` that reuses the HTML of blocks highlighted before. """
+    def hilite(self, shebang=True):
+        if not (codehilite.pygments and self.use_pygments):
+            return super().hilite(shebang=shebang)
+        key = block_key(self, shebang)
+        html = cache.get(key)
+        if html is None:
+            html = super().hilite(shebang=shebang)
+            cache.put(key, html)
+        return html
+
+
+def install():
+    """ Makes the ``fenced_code`` and ``codehilite`` extensions highlight through the cache. """
+    fenced_code.CodeHilite = CachedCodeHilite
+    codehilite.CodeHilite = CachedCodeHilite
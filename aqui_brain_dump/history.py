@@ -0,0 +1,274 @@
+"""
+History of garden snapshots.
+Keeps every statistics, link analysis and external link report in a single append-only SQLite database instead of a
+timestamped JSON file per run.
+
+- Numeric values of each report are stored as rows of a metrics table, indexed by name, so a time series is one query.
+- Full reports are stored as zlib-compressed JSON.
+- The garden graph is stored as a delta: only the nodes and links added or removed since the previous snapshot are
+  written. Any earlier graph can be rebuilt from the latest one by undoing the later changes.
+"""
+import json
+import logging
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_FILE = Path('stats') / 'history.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_kind ON snapshots (kind, timestamp);
+CREATE TABLE IF NOT EXISTS metrics (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    name TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS metrics_name ON metrics (name, snapshot_id);
+CREATE TABLE IF NOT EXISTS reports (
+    snapshot_id INTEGER PRIMARY KEY REFERENCES snapshots (id),
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS node_changes (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    change INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS node_changes_snapshot ON node_changes (snapshot_id);
+CREATE TABLE IF NOT EXISTS edge_changes (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots (id),
+    change INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edge_changes_snapshot ON edge_changes (snapshot_id);
+CREATE TABLE IF NOT EXISTS current_nodes (
+    id TEXT PRIMARY KEY,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS current_edges (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    PRIMARY KEY (source, target)
+);
+"""
+
+# Report keys that are never stored as metrics
+SKIPPED_METRICS = {'timestamp'}
+# Node positions change a little on every run, storing them would store every node again
+LAYOUT_KEYS = {'x', 'y'}
+
+
+def flatten_metrics(report, prefix='', depth=2):
+    """ Extracts the numeric values of a report as a dictionary of dotted names -> value.
+
+    Nested dictionaries are followed ``depth`` levels deep and lists are stored as ``<name>.count``.
+    """
+    metrics = {}
+    for key, value in report.items():
+        name = f'{prefix}{key}'
+        if key in SKIPPED_METRICS:
+            continue
+        if isinstance(value, bool):
+            metrics[name] = int(value)
+        elif isinstance(value, (int, float)):
+            if value == value and value not in (float('inf'), float('-inf')):
+                metrics[name] = value
+        elif isinstance(value, (list, tuple)):
+            metrics[f'{name}.count'] = len(value)
+        elif isinstance(value, dict) and depth > 1:
+            metrics.update(flatten_metrics(value, prefix=f'{name}.', depth=depth - 1))
+    return metrics
+
+
+def compress(data):
+    return zlib.compress(json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+
+
+def decompress(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class HistoryStore:
+    """
+    Append-only store of snapshots.
+
+    Args:
+        path: SQLite file, created if it does not exist
+    """
+    def __init__(self, path=DEFAULT_HISTORY_FILE):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_snapshot(self, kind, report, graph=None, timestamp=None):
+        """
+        Appends a snapshot.
+
+        Args:
+            kind: Name of the report, for example ``stats``, ``links`` or ``external``
+            report: The report dictionary. Its numeric values become metrics
+            graph: Optional graph with ``nodes`` and ``links``, stored as changes since the previous graph
+            timestamp: ISO timestamp, defaults to the ``timestamp`` of the report or now
+
+        Returns:
+            int: id of the new snapshot
+        """
+        timestamp = timestamp or report.get('timestamp') or datetime.now(tz=timezone.utc).isoformat()
+        with self.db:
+            cur = self.db.execute('INSERT INTO snapshots (kind, timestamp) VALUES (?, ?)', (kind, timestamp))
+            snapshot_id = cur.lastrowid
+            self.db.executemany('INSERT INTO metrics (snapshot_id, name, value) VALUES (?, ?, ?)',
+                                [(snapshot_id, name, value) for name, value in flatten_metrics(report).items()])
+            self.db.execute('INSERT INTO reports (snapshot_id, data) VALUES (?, ?)', (snapshot_id, compress(report)))
+            if graph is not None:
+                self._add_graph(snapshot_id, graph)
+        logger.info(f'Added {kind} snapshot {snapshot_id} to {self.path}')
+        return snapshot_id
+
+    def _add_graph(self, snapshot_id, graph):
+        old_nodes = dict(self.db.execute('SELECT id, data FROM current_nodes'))
+        new_nodes = {node['id']: json.dumps({key: value for key, value in node.items() if key not in LAYOUT_KEYS},
+                                            ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+                     for node in graph.get('nodes', [])}
+        old_edges = set(self.db.execute('SELECT source, target FROM current_edges'))
+        new_edges = {(link['source'], link['target']) for link in graph.get('links', [])}
+
+        removed_nodes = [(snapshot_id, -1, node_id, data) for node_id, data in old_nodes.items()
+                         if new_nodes.get(node_id) != data]
+        added_nodes = [(snapshot_id, 1, node_id, data) for node_id, data in new_nodes.items()
+                       if old_nodes.get(node_id) != data]
+        removed_edges = [(snapshot_id, -1, s, t) for s, t in old_edges - new_edges]
+        added_edges = [(snapshot_id, 1, s, t) for s, t in new_edges - old_edges]
+
+        self.db.executemany('INSERT INTO node_changes VALUES (?, ?, ?, ?)', removed_nodes + added_nodes)
+        self.db.executemany('INSERT INTO edge_changes VALUES (?, ?, ?, ?)', removed_edges + added_edges)
+        self.db.executemany('DELETE FROM current_nodes WHERE id = ?', [(n[2],) for n in removed_nodes])
+        self.db.executemany('INSERT INTO current_nodes VALUES (?, ?)', [(n[2], n[3]) for n in added_nodes])
+        self.db.executemany('DELETE FROM current_edges WHERE source = ? AND target = ?',
+                            [(e[2], e[3]) for e in removed_edges])
+        self.db.executemany('INSERT INTO current_edges VALUES (?, ?)', [(e[2], e[3]) for e in added_edges])
+        logger.debug(f'Graph changes: +{len(added_nodes)}/-{len(removed_nodes)} nodes, '
+                     f'+{len(added_edges)}/-{len(removed_edges)} links')
+
+    def snapshots(self, kind=None):
+        """ Returns a list of ``{'id', 'kind', 'timestamp'}`` in the order they were added. """
+        query = 'SELECT id, kind, timestamp FROM snapshots'
+        params = ()
+        if kind is not None:
+            query += ' WHERE kind = ?'
+            params = (kind,)
+        return [{'id': i, 'kind': k, 'timestamp': t} for i, k, t in self.db.execute(query + ' ORDER BY id', params)]
+
+    def metric_names(self, kind=None):
+        query = 'SELECT DISTINCT name FROM metrics'
+        params = ()
+        if kind is not None:
+            query += ' JOIN snapshots ON snapshots.id = metrics.snapshot_id WHERE kind = ?'
+            params = (kind,)
+        return sorted(name for name, in self.db.execute(query, params))
+
+    def metric_series(self, name, kind=None, since=None, until=None):
+        """ Returns the values of a metric over time as a list of ``(timestamp, value)`` tuples. """
+        query = ('SELECT timestamp, value FROM metrics JOIN snapshots ON snapshots.id = metrics.snapshot_id '
+                 'WHERE name = ?')
+        params = [name]
+        if kind is not None:
+            query += ' AND kind = ?'
+            params.append(kind)
+        if since is not None:
+            query += ' AND timestamp >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND timestamp <= ?'
+            params.append(until)
+        return list(self.db.execute(query + ' ORDER BY snapshots.id', params))
+
+    def report(self, snapshot_id):
+        row = self.db.execute('SELECT data FROM reports WHERE snapshot_id = ?', (snapshot_id,)).fetchone()
+        if row is None:
+            raise KeyError(f'No snapshot with id {snapshot_id}')
+        return decompress(row[0])
+
+    def graph_at(self, snapshot_id):
+        """ Rebuilds the graph as it was stored at ``snapshot_id`` by undoing every later change. """
+        nodes = dict(self.db.execute('SELECT id, data FROM current_nodes'))
+        edges = set(self.db.execute('SELECT source, target FROM current_edges'))
+        later_nodes = self.db.execute('SELECT change, id, data FROM node_changes WHERE snapshot_id > ? '
+                                      'ORDER BY snapshot_id DESC, change DESC', (snapshot_id,))
+        for change, node_id, data in later_nodes:
+            if change > 0:
+                nodes.pop(node_id, None)
+            else:
+                nodes[node_id] = data
+        later_edges = self.db.execute('SELECT change, source, target FROM edge_changes WHERE snapshot_id > ? '
+                                      'ORDER BY snapshot_id DESC', (snapshot_id,))
+        for change, source, target in later_edges:
+            if change > 0:
+                edges.discard((source, target))
+            else:
+                edges.add((source, target))
+        return {
+            'nodes': [json.loads(data) for _, data in sorted(nodes.items())],
+            'links': [{'source': s, 'target': t} for s, t in sorted(edges)],
+        }
+
+
+def record_snapshot(kind, report, graph=None, history_file=DEFAULT_HISTORY_FILE):
+    """ Appends a report (and optionally a graph) to the history file. Returns the snapshot id. """
+    with HistoryStore(history_file) as store:
+        return store.add_snapshot(kind, report, graph=graph)
+
+
+def import_json_snapshots(stats_dir=Path('stats'), history_file=DEFAULT_HISTORY_FILE):
+    """ Loads the timestamped JSON files written by earlier versions into the history store, oldest first. """
+    stats_dir = Path(stats_dir)
+    kinds = {'garden_stats_': 'stats', 'link_analysis_': 'links', 'external_links_': 'external'}
+    files = []
+    for prefix, kind in kinds.items():
+        for path in stats_dir.glob(f'{prefix}[0-9]*_[0-9]*.json'):
+            files.append((path.stem[len(prefix):], kind, path))
+
+    imported = 0
+    with HistoryStore(history_file) as store:
+        for timestamp, kind, path in sorted(files):
+            with open(path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+            graph = None
+            graph_path = stats_dir / f'garden_graph_{timestamp}.json'
+            if kind == 'stats' and graph_path.exists():
+                with open(graph_path, 'r', encoding='utf-8') as f:
+                    graph = json.load(f)
+            store.add_snapshot(kind, report, graph=graph)
+            imported += 1
+    logger.info(f'Imported {imported} snapshots from {stats_dir} into {history_file}')
+    return imported
+
+
+def print_history(store, names, kind=None, since=None):
+    """Print the time series of the given metrics"""
+    for name in names:
+        series = store.metric_series(name, kind=kind, since=since)
+        print(f'\n📈 {name} ({len(series)} snapshots)')
+        for timestamp, value in series:
+            value = int(value) if value is not None and float(value).is_integer() else value
+            print(f'  {timestamp}  {value}')
+    print()
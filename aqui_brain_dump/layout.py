@@ -0,0 +1,263 @@
+"""
+Graph layout.
+Positions the nodes of ``garden_graph.json`` when it is generated, so the visualisation can draw the garden right away
+instead of running a force simulation over every note when the page loads. Every node gets ``x`` and ``y``, centred on
+0, in units in which two linked notes on their own would be 1 apart. Force simulations such as d3-force start from the
+``x`` and ``y`` of their nodes, so the browser only has to settle what moved, if anything.
+
+The layout is force directed: links pull the notes they join like springs, every note pushes every other away with a
+force of one over their distance and gravity keeps unconnected notes close to the rest. Pushing every pair of notes
+apart is quadratic, so the repulsion is computed on a grid instead (a particle-mesh method): the notes are spread over
+the corners of the cells they fall in, the repulsion of every cell on every other is one FFT convolution, and each note
+takes the force of the corners around it. Linked notes and notes in the same cell, too close for the grid to tell
+apart, also push each other directly. Every iteration is then vectorized with NumPy and close to linear in the number
+of notes and links; each note moves along its force, at most a step that adapts to how the layout progresses.
+
+The positions of the previous ``garden_graph.json`` are the starting point of the next layout: notes keep the position
+they had and new notes start next to the notes they link to. Starting that close to the result, a few short steps are
+enough, and notes that were already laid out only take a fraction of them, so the garden keeps its shape from one run
+to the next.
+
+NumPy is optional (``pip install aqui_brain_dump[fast]``). Without it the graph is written without positions.
+"""
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+ITERATIONS = 300
+# Iterations when most nodes start where they were in the previous layout
+WARM_ITERATIONS = 50
+# Share of the nodes with a previous position needed to start from the previous layout
+WARM_SHARE = 0.5
+GRAVITY = 1.0
+# Cells per side of the grid on which the repulsion is computed
+MIN_GRID = 16
+MAX_GRID = 256
+# Nodes compared with the nodes that follow them in the same cell, for the repulsion the grid is too coarse to see
+NEAR_NODES = 4
+# Step of a warm start, and the share of it taken by the notes that were already laid out
+WARM_STEP = 0.2
+WARM_MOBILITY = 0.2
+# How much the step changes from one iteration to the next
+COOLING = 0.9
+# The layout stops once nodes move, on average, less than this in one iteration
+TOLERANCE = 0.01
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+
+
+def read_positions(graph_file):
+    """ Positions of the nodes of a graph JSON file, as id -> ``(x, y)``. Empty if the file does not exist, can not
+    be read or has no positions. """
+    try:
+        with open(graph_file, 'r', encoding='utf-8') as f:
+            graph = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f'Ignoring the positions of {graph_file}: {e}')
+        return {}
+    return {node['id']: (node['x'], node['y']) for node in graph.get('nodes', [])
+            if isinstance(node.get('x'), (int, float)) and isinstance(node.get('y'), (int, float))}
+
+
+def _start(np, ids, source, target, previous):
+    """ Starting positions: the previous ones if there are any, and a sunflower spiral for everything else. Returns
+    the positions and which nodes had a previous position. """
+    n = len(ids)
+    i = np.arange(n) + 0.5
+    positions = np.column_stack([np.sqrt(i) * np.cos(i * GOLDEN_ANGLE), np.sqrt(i) * np.sin(i * GOLDEN_ANGLE)])
+    known = np.array([node_id in previous for node_id in ids], dtype=bool)
+    if not known.any():
+        return positions, known
+    positions[known] = [previous[node_id] for node_id in ids if node_id in previous]
+
+    # New notes start around the known notes they link to, twice so that chains of new notes also get close
+    placed = known
+    for _ in range(2):
+        sums = np.zeros((n, 2))
+        counts = np.zeros(n)
+        for a, b in ((source, target), (target, source)):
+            useful = placed[b] & ~placed[a]
+            np.add.at(sums, a[useful], positions[b[useful]])
+            np.add.at(counts, a[useful], 1)
+        new = counts > 0
+        # Spread around the mean of their neighbours instead of all on the same point
+        offset = np.column_stack([np.cos(i * GOLDEN_ANGLE), np.sin(i * GOLDEN_ANGLE)])[new]
+        positions[new] = sums[new] / counts[new, None] + offset
+        placed = placed | new
+    return positions, known
+
+
+def _fft_size(minimum):
+    """ Smallest size of at least ``minimum`` with no prime factors but 2, 3 and 5, which FFTs handle fastest. """
+    size = minimum
+    while True:
+        rest = size
+        for factor in (2, 3, 5):
+            while rest % factor == 0:
+                rest //= factor
+        if rest == 1:
+            return size
+        size += 1
+
+
+def _kernel(np, grid):
+    """ FFT of the repulsion between the corners of a grid with cells of size 1, as ``x + iy``. """
+    offsets = np.arange(-(grid - 1), grid, dtype=float)
+    dx, dy = np.meshgrid(offsets, offsets, indexing='ij')
+    distance2 = dx * dx + dy * dy
+    distance2[grid - 1, grid - 1] = np.inf
+    # The convolution is circular, but with this size nothing wraps around onto the corners of the grid
+    size = _fft_size(2 * grid - 1)
+    return np.fft.fft2((dx + 1j * dy) / distance2, s=(size, size))
+
+
+def _repulsion(np, positions, grid, kernel):
+    """ Force of every node on every other, ``1 / distance`` away from each other, approximated on the grid. Returns
+    the forces and the cell of every node. """
+    low = positions.min(axis=0)
+    cell = max(float((positions.max(axis=0) - low).max()) / (grid - 1), 1e-9)
+    scaled = (positions - low) / cell
+    corner = np.minimum(np.floor(scaled).astype(np.int64), grid - 2)
+    fraction = scaled - corner
+    corners = []
+    for di in (0, 1):
+        for dj in (0, 1):
+            weight = (fraction[:, 0] if di else 1 - fraction[:, 0]) * (fraction[:, 1] if dj else 1 - fraction[:, 1])
+            corners.append(((corner[:, 0] + di) * grid + corner[:, 1] + dj, weight))
+
+    density = np.zeros(grid * grid)
+    for index, weight in corners:
+        density += np.bincount(index, weight, minlength=grid * grid)
+    size = kernel.shape[0]
+    field = np.fft.ifft2(np.fft.fft2(density.reshape(grid, grid), s=(size, size)) * kernel)
+    # In a grid of cells of size ``cell``, the force 1 / distance is that of cells of size 1 divided by ``cell``
+    field = field[grid - 1:2 * grid - 1, grid - 1:2 * grid - 1].ravel() / cell
+    force = sum(field[index] * weight for index, weight in corners)
+    return np.column_stack([force.real, force.imag]), corners[0][0]
+
+
+def _pair_repulsion(np, positions, first, second):
+    """ Exact repulsion between the nodes of each pair. """
+    delta = positions[first] - positions[second]
+    push = delta / np.maximum((delta * delta).sum(axis=1), 1e-6)[:, None]
+    force = np.zeros_like(positions)
+    for axis in (0, 1):
+        force[:, axis] += np.bincount(first, push[:, axis], minlength=len(positions))
+        force[:, axis] -= np.bincount(second, push[:, axis], minlength=len(positions))
+    return force
+
+
+def _near_pairs(np, cells):
+    """ Pairs of nodes in the same cell, each node with up to ``NEAR_NODES`` of the nodes after it. """
+    order = np.argsort(cells, kind='stable')
+    first, second = [], []
+    for k in range(1, NEAR_NODES + 1):
+        a, b = order[:-k], order[k:]
+        same = cells[a] == cells[b]
+        first.append(a[same])
+        second.append(b[same])
+    return np.concatenate(first), np.concatenate(second)
+
+
+def compute_layout(ids, links, previous=None, iterations=None):
+    """
+    Computes the position of every node of a graph.
+
+    Args:
+        ids: Ids of the nodes
+        links: ``(source, target)`` pairs of ids, links to unknown ids are ignored
+        previous: Positions of a previous layout, as id -> ``(x, y)``, to start from
+        iterations: Maximum number of iterations. Defaults to ``ITERATIONS``, or ``WARM_ITERATIONS`` when most nodes
+            have a previous position
+
+    Returns:
+        dict: id -> ``(x, y)``
+    """
+    import numpy as np
+
+    ids = list(ids)
+    n = len(ids)
+    if n == 0:
+        return {}
+    index = {node_id: i for i, node_id in enumerate(ids)}
+    pairs = {(min(index[s], index[t]), max(index[s], index[t])) for s, t in links
+             if s in index and t in index and s != t}
+    pairs = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+    source, target = pairs[:, 0], pairs[:, 1]
+
+    positions, known = _start(np, ids, source, target, previous or {})
+    warm = known.mean() >= WARM_SHARE
+    if iterations is None:
+        iterations = WARM_ITERATIONS if warm else ITERATIONS
+    # Largest step of a node in one iteration. A warm start mostly settles the new nodes, the others only move a
+    # fraction of the step so the garden keeps its shape
+    step = WARM_STEP if warm else max(1.0, math.sqrt(n) / 10)
+    mobility = np.where(known, WARM_MOBILITY, 1.0) if warm else np.ones(n)
+    energy = math.inf
+    progress = 0
+    grid = int(min(MAX_GRID, max(MIN_GRID, 2 * math.sqrt(n))))
+    kernel = _kernel(np, grid)
+
+    for iteration in range(iterations if n > 1 else 0):
+        force, cells = _repulsion(np, positions, grid, kernel)
+        # Linked nodes and nodes in the same cell get closer than the grid can keep apart
+        first, second = _near_pairs(np, cells)
+        force += _pair_repulsion(np, positions, np.concatenate([source, first]), np.concatenate([target, second]))
+        force -= GRAVITY * positions
+        pull = positions[target] - positions[source]
+        for axis in (0, 1):
+            force[:, axis] += np.bincount(source, pull[:, axis], minlength=n)
+            force[:, axis] -= np.bincount(target, pull[:, axis], minlength=n)
+        length = np.hypot(force[:, 0], force[:, 1])
+
+        # Adaptive step, as Yifan Hu's: longer after a few iterations that lowered the energy, shorter otherwise
+        new_energy = float((length * length).sum())
+        if new_energy < energy:
+            progress += 1
+            if progress >= 5:
+                progress = 0
+                step /= COOLING
+        else:
+            progress = 0
+            step *= COOLING
+        energy = new_energy
+
+        scale = np.minimum(length, step * mobility) / np.maximum(length, 1e-12)
+        positions += force * scale[:, None]
+        if float((length * scale).mean()) < TOLERANCE:
+            logger.debug(f'Layout converged after {iteration + 1} iterations')
+            break
+
+    positions -= positions.mean(axis=0)
+    return {node_id: (round(float(x), 2), round(float(y), 2)) for node_id, (x, y) in zip(ids, positions.tolist())}
+
+
+def add_layout(graph, previous_file=None, iterations=None):
+    """
+    Sets ``x`` and ``y`` of every node of a graph with ``nodes`` and ``links``, as in ``garden_graph.json``.
+
+    Args:
+        graph: Graph to lay out, changed in place
+        previous_file: Graph JSON file with the positions of the previous layout, if any
+        iterations: Maximum number of iterations, see :func:`compute_layout`
+
+    Returns:
+        bool: Whether the nodes got positions, False if NumPy is not installed
+    """
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        logger.info('NumPy is not installed, the graph is saved without positions')
+        return False
+    previous = read_positions(previous_file) if previous_file else {}
+    positions = compute_layout((node['id'] for node in graph['nodes']),
+                               ((link['source'], link['target']) for link in graph['links']),
+                               previous=previous, iterations=iterations)
+    for node in graph['nodes']:
+        node['x'], node['y'] = positions[node['id']]
+    logger.info(f'Laid out {len(positions)} nodes, {sum(node_id in previous for node_id in positions)} of them '
+                f'starting from the previous layout')
+    return True
@@ -0,0 +1,132 @@
+"""
+Local graph neighbourhoods.
+Adds to the ``connections.json`` of every note the notes up to ``hops`` links away from it, so the local graph of a
+note can be drawn without downloading the graph of the whole garden. Links are followed in both directions, and
+include those from the notes of a tag to its page.
+
+The links of every note are kept as adjacency arrays, as in a CSR matrix: the neighbours of note ``i`` are
+``neighbours[offsets[i]:offsets[i + 1]]``, with the direction of each link in ``directions``. Each neighbourhood is a
+breadth-first search over those arrays that stops adding notes once it has ``max_nodes``, so the work for each note is
+proportional to the links it visits, not to the size of the garden. To keep the most telling notes when the cap is
+reached, the neighbours of every note are sorted by their number of links, most connected first. Hubs, notes with more
+than ``HUB_DEGREE`` neighbours (tag pages, indexes), are shown but only expanded when they are the note itself, since
+everything is two hops away through them.
+
+Each neighbourhood is written compactly, as the list of its notes and the links between them given by their position
+in that list::
+
+    "neighbourhood": {
+      "nodes": [["/some_note/", "Some note", 0], ["/other/", "Other", 1], ...],
+      "links": [[0, 1], [2, 1], ...]
+    }
+
+where each node is ``[url, title, hops away]`` and each link ``[source, target]``.
+"""
+import logging
+from array import array
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOPS = 2
+MAX_NODES = 50
+HUB_DEGREE = 50
+OUTGOING = 1
+INCOMING = 2
+
+
+class LocalGraph:
+    """ Links between notes as adjacency arrays.
+
+    :param urls: Url of every note
+    :param edges: ``(source, target)`` pairs of urls. Pairs with urls not in ``urls`` are ignored
+    :param hops: Links away from a note included in its neighbourhood
+    :param max_nodes: Notes in a neighbourhood, including the note itself
+    """
+    def __init__(self, urls, edges, hops=DEFAULT_HOPS, max_nodes=MAX_NODES):
+        self.urls = sorted(urls)
+        self.index = {url: i for i, url in enumerate(self.urls)}
+        self.hops = hops
+        self.max_nodes = max_nodes
+
+        adjacency = [{} for _ in self.urls]
+        for source, target in edges:
+            i = self.index.get(source)
+            j = self.index.get(target)
+            if i is None or j is None or i == j:
+                continue
+            adjacency[i][j] = adjacency[i].get(j, 0) | OUTGOING
+            adjacency[j][i] = adjacency[j].get(i, 0) | INCOMING
+
+        self.offsets = array('l', [0])
+        self.neighbours = array('l')
+        self.directions = array('b')
+        for links in adjacency:
+            # Most connected first, so they are the ones kept when a neighbourhood is full
+            for j in sorted(links, key=lambda j: (-len(adjacency[j]), j)):
+                self.neighbours.append(j)
+                self.directions.append(links[j])
+            self.offsets.append(len(self.neighbours))
+
+    @classmethod
+    def from_notes(cls, notes, hops=DEFAULT_HOPS, max_nodes=MAX_NODES):
+        """ Graph of the links and backlinks of ``notes``, a dictionary url -> note as ``Note.notes``. """
+        edges = []
+        for note in notes.values():
+            edges.extend((note.url, link) for link in note.links)
+            edges.extend((backlink.url, note.url) for backlink in note.backlinks)
+        return cls(notes.keys(), edges, hops=hops, max_nodes=max_nodes)
+
+    def degree(self, i):
+        return self.offsets[i + 1] - self.offsets[i]
+
+    def neighbourhood(self, url, titles=None):
+        """
+        Breadth-first search of the notes up to ``hops`` links away from ``url``.
+
+        Args:
+            url: Note at the centre
+            titles: Optional function of a url returning the title of its note, the url is used otherwise
+
+        Returns:
+            dict: ``nodes``, as ``[url, title, hops]`` in the order they were found, and ``links`` between them, as
+            ``[source, target]`` positions in ``nodes``. None if the note is not in the graph
+        """
+        root = self.index.get(url)
+        if root is None:
+            return None
+        position = {root: 0}
+        depths = [0]
+        found = [root]
+        links = []
+        expanded = set()
+        frontier = [root]
+        for depth in range(1, self.hops + 1):
+            next_frontier = []
+            for node in frontier:
+                if node != root and self.degree(node) > HUB_DEGREE:
+                    continue
+                expanded.add(node)
+                for k in range(self.offsets[node], self.offsets[node + 1]):
+                    other = self.neighbours[k]
+                    if other not in position:
+                        if len(found) >= self.max_nodes:
+                            continue
+                        position[other] = len(found)
+                        found.append(other)
+                        depths.append(depth)
+                        next_frontier.append(other)
+                    elif other in expanded:
+                        # Seen from the other side already
+                        continue
+                    direction = self.directions[k]
+                    if direction & OUTGOING:
+                        links.append([position[node], position[other]])
+                    if direction & INCOMING:
+                        links.append([position[other], position[node]])
+            frontier = next_frontier
+
+        nodes = []
+        for i, depth in zip(found, depths):
+            node_url = self.urls[i]
+            nodes.append([node_url, titles(node_url) if titles is not None else node_url, depth])
+        return {'nodes': nodes, 'links': sorted(links)}
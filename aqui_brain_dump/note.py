@@ -1,24 +1,39 @@
-import datetime
 import logging
-import time
+import re
+from concurrent.futures import wait
 from concurrent.futures.thread import ThreadPoolExecutor
 from pathlib import Path
 import json
 
-import frontmatter
-from bs4 import BeautifulSoup
-from jinja2 import Environment, FileSystemLoader
-
 from aqui_brain_dump import content_path, get_creation_date, get_last_modification_date, get_number_commits, \
-    md, \
+    get_markdown, \
     output_path, static_url, template_path
 from aqui_brain_dump import datetimeformat
-from aqui_brain_dump.util import path_to_url, has_invalid_filename_chars
+from aqui_brain_dump.assets import static_asset
+from aqui_brain_dump.resolver import LinkResolver
+from aqui_brain_dump.trace import instrument_markdown, span
+from aqui_brain_dump.util import count_words, now, path_to_url, has_invalid_filename_chars, today
+
+_env = None
+
+# Placeholder left by ``![[note]]`` (see extension_wikiimage), out of any paragraph, maybe prettified
+EMBED_RE = re.compile(r'<div class="transclusion" data-embed="(?P<url>[^"]*)"'
+                      r'(?: data-section="(?P<section>[^"]*)")?>\s*</div>')
+HEADING_TAGS = ['h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+# id attribute of any element, to keep the ids of an embedded note out of the page that embeds it
+ID_ATTRIBUTE_RE = re.compile(r'(<[a-zA-Z][^>]*?\s)id=')
+
+
+def get_environment():
+    """ Returns the Jinja environment for the note templates, creating it on first use. """
+    global _env
+    if _env is None:
+        from jinja2 import Environment, FileSystemLoader
 
-env = Environment(loader=FileSystemLoader(template_path))
-env.filters['datetime'] = datetimeformat
-template_article = env.get_template('note.html')
-template_index = env.get_template('index.html')
+        _env = Environment(loader=FileSystemLoader(template_path))
+        _env.filters['datetime'] = datetimeformat
+        _env.filters['asset'] = static_asset
+    return _env
 
 
 logger = logging.getLogger(__name__)
@@ -31,22 +46,49 @@ class Note:
     tags_dict = {}
     lit_notes = {}
     bibliography = {}
+    resolver = None
+    # Drop the HTML of each note once its links and tags are known, and convert it again only to render it
+    low_memory = False
+    # Where to load dropped content from instead of converting the note again, e.g. the files of a sharded build
+    content_store = None
+    # (url, section) -> HTML of every note embedded so far, with its own embeds expanded
+    fragments = {}
+    # (url, url) of the embeds that would close a cycle, see find_embed_cycles
+    embed_cycles = set()
+    # Links of every note as adjacency arrays, for the neighbourhoods in connections.json, see neighbourhood.py
+    local_graph = None
+    # Url of every file copied from the content and static folders, to check the links to them
+    assets = set()
 
     def __init__(self, file_path, parse_git = True):
         self.file_path = file_path
         self.path = Path(file_path).relative_to(content_path)
         self.parse_git = parse_git
         self.content = None
+        self.has_content = False
+        self.rewrites = {}
+        # Links as written, before resolve_links replaced them by the url of the note they point to
+        self.link_labels = []
+        self.cite_key = None
         self.backlinks = set()
         self.links = set()
+        self.embeds = set()
+        # url -> sentence around the first link to it, see backlinks_wikilinks
+        self.link_snippets = {}
+        # Ids of the headings and other anchors, and (href, markup) of the internal links, see extension_anchors
+        self.anchors = []
+        self.references = []
+        self.related = []
+        self.related_scores = {}
         self.cites = set()
         self.title = ''
+        self.words = 0
         self.meta = {}
         self.tags = set()
         self.url = ''
-        self.last_mod = datetime.datetime.now()
+        self.last_mod = now()
         self.number_edits = 1
-        self.creation_date = datetime.datetime.now()
+        self.creation_date = now()
 
     def _generate_connections_data(self):
         """Generate connections data for this note including incoming and outgoing links"""
@@ -56,28 +98,35 @@ class Note:
                 'title': self.title,
             },
             'incoming': [],
-            'outgoing': []
+            'outgoing': [],
+            'related': [{'url': note.url, 'title': note.title, 'score': self.related_scores.get(note.url)}
+                        for note in self.related],
         }
+        if self.local_graph is not None:
+            neighbourhood = self.local_graph.neighbourhood(self.url, titles=lambda url: str(self.notes[url].title))
+            if neighbourhood is not None:
+                connections['neighbourhood'] = neighbourhood
         
         # Process incoming links (backlinks)
-        for backlink in self.backlinks:
+        for backlink in sorted(self.backlinks, key=lambda n: n.url):
             link_data = {
                 'url': backlink.url,
                 'title': backlink.title,
-                'exists': backlink.content is not None,
+                'exists': backlink.has_content,
                 'is_tag': backlink.url.startswith('/tags/'),
-                'is_external': False
+                'is_external': False,
+                'snippet': self.backlink_snippet(backlink),
             }
             connections['incoming'].append(link_data)
         
         # Process outgoing links
-        for link in self.links:
+        for link in sorted(self.links):
             linked_note = self.notes.get(link)
             if linked_note:
                 link_data = {
                     'url': linked_note.url,
                     'title': linked_note.title,
-                    'exists': linked_note.content is not None,
+                    'exists': linked_note.has_content,
                     'is_tag': linked_note.url.startswith('/tags/'),
                     'is_external': False
                 }
@@ -97,6 +146,28 @@ class Note:
 
 
 
+    @classmethod
+    def wait_for_executor(cls):
+        """ Blocks until every task submitted to the note executor (e.g. reading git information) is done. """
+        wait(cls.futures_executor)
+        # Finished futures are of no further use, and keep a lock each
+        cls.futures_executor.clear()
+
+    @classmethod
+    def reset(cls):
+        """ Forgets every note and starts a new executor, so that a new build can run in the same process. """
+        cls.note_executor.shutdown(wait=True)
+        cls.notes = {}
+        cls.note_executor = ThreadPoolExecutor(max_workers=20)
+        cls.futures_executor = []
+        cls.tags_dict = {}
+        cls.lit_notes = {}
+        cls.resolver = None
+        cls.fragments = {}
+        cls.embed_cycles = set()
+        cls.local_graph = None
+        cls.assets = set()
+
     @classmethod
     def create_from_path(cls, file_path, parse_git=False):
         logger.info(f'Creating note from file: {file_path}')
@@ -144,82 +215,154 @@ class Note:
             self.notes[str(self.path.absolute()).lower()] = self
             return
 
-        with open(self.file_path, 'r', encoding='utf-8') as f:
-            md.reset()
-            md.links = set()
+        with span('parse', cat='note', note=str(self.path)):
+            self._parse_contents()
+        if self.low_memory:
+            self.release_content()
 
-            try:
-                post = frontmatter.load(f)
-                self.content = md.convert(post.content)
-            except Exception as e:
-                logger.error(f'Error parsing {self.file_path}: {e}')
-                self.content = ''
+        logger.debug(f'Added {self} with url {self.url}')
+        self.notes[self.url] = self
+
+    def _convert(self, text):
+        """ Converts the markdown of the note to HTML, removing the first h1. Returns the HTML and the text of that h1,
+        or None if there was no h1. The links, tags and cites found are left in the markdown instance. """
+        from bs4 import BeautifulSoup
+
+        md = instrument_markdown(get_markdown())
+        md.reset()
+        md.links = set()
+        try:
+            with span('markdown'):
+                content = md.convert(text)
+        except Exception as e:
+            logger.error(f'Error parsing {self.file_path}: {e}')
+            content = ''
 
-            logger.debug(f'Converted {self.file_path}')
-            bs = BeautifulSoup(self.content, 'html.parser')
+        logger.debug(f'Converted {self.file_path}')
+        h1_title = None
+        with span('beautifulsoup'):
+            bs = BeautifulSoup(content, 'html.parser')
             h1 = bs.find('h1')
-            h1_title = None
             if h1 is not None and h1.get_text() != '':
                 logger.debug(f'Found title: {h1.get_text()}')
                 h1_title = h1.get_text()
                 h1.decompose()
-                self.content = bs.prettify()
-            if 'title' in post.metadata:
-                self.title = post.metadata['title']
-            elif h1_title is not None:
-                self.title = h1_title
-            else:
-                self.title = ' '.join(str(self.path).split('_')).strip('/').capitalize()
-                if self.title.endswith('.md'):
-                    self.title = self.title[:-3]
+                content = bs.prettify()
+        return content, h1_title
 
-            self.url = path_to_url(self.path)
-            if 'slug' in post.metadata:
-                self.url = post.metadata.get('url')
-            self.meta = post.metadata
-            self.links = md.links
-            logger.debug(f'{self.title} links: {self.links}')
-            self.tags = md.tags
-            self.cites = md.cites
-            for tag in self.tags:
-                tag = tag.lower()
-                # Check for invalid filename characters in tag
-                has_invalid, chars = has_invalid_filename_chars(tag)
-                if has_invalid:
-                    logger.warning(f'Invalid filename characters {chars} in tag: {tag} (file: {self.file_path})')
-                if tag not in self.tags_dict:
-                    self.tags_dict[tag] =[self, ]
-                else:
-                    self.tags_dict[tag].append(self)
+    def _parse_contents(self):
+        from aqui_brain_dump.parse_frontmatter import load
 
-            for cite in self.cites:
-                if cite not in self.lit_notes:
-                    self.lit_notes[cite] = [self, ]
-                else:
-                    self.lit_notes[cite].append(self)
+        try:
+            with span('frontmatter'):
+                metadata, text = load(self.file_path)
+        except Exception as e:
+            logger.error(f'Error parsing {self.file_path}: {e}')
+            metadata, text = {}, ''
+        self.content, h1_title = self._convert(text)
+        self.has_content = True
+        self.words = count_words(self.content)
+        md = get_markdown()
+        if 'title' in metadata:
+            self.title = metadata['title']
+        elif h1_title is not None:
+            self.title = h1_title
+        else:
+            self.title = ' '.join(str(self.path).split('_')).strip('/').capitalize()
+            if self.title.endswith('.md'):
+                self.title = self.title[:-3]
 
-            self.futures_executor.append(self.note_executor.submit(self.update_git_information))
+        self.url = path_to_url(self.path)
+        if 'slug' in metadata:
+            self.url = metadata.get('url')
+        self.meta = metadata
+        self.links = md.links
+        self.embeds = md.embeds
+        self.link_snippets = md.link_snippets
+        self.anchors = md.anchors
+        self.references = md.link_references
+        logger.debug(f'{self.title} links: {self.links}')
+        self.tags = md.tags
+        self.cites = md.cites
+        self.register()
 
-        logger.debug(f'Added {self} with url {self.url}')
-        self.notes[self.url] = self
+        self.futures_executor.append(self.note_executor.submit(self.update_git_information))
+
+    def register(self):
+        """ Adds the note to the pages of its tags and citations. """
+        for tag in sorted(self.tags):
+            tag = tag.lower()
+            # Check for invalid filename characters in tag
+            has_invalid, chars = has_invalid_filename_chars(tag)
+            if has_invalid:
+                logger.warning(f'Invalid filename characters {chars} in tag: {tag} (file: {self.file_path})')
+            if tag not in self.tags_dict:
+                self.tags_dict[tag] =[self, ]
+            else:
+                self.tags_dict[tag].append(self)
+
+        for cite in sorted(self.cites):
+            if cite not in self.lit_notes:
+                self.lit_notes[cite] = [self, ]
+            else:
+                self.lit_notes[cite].append(self)
 
     def update_git_information(self):
         if self.parse_git:
-            self.last_mod = get_last_modification_date(self.file_path)
-            self.creation_date = get_creation_date(self.file_path)
-            self.number_edits = get_number_commits(self.file_path)
+            with span('git', cat='note', note=str(self.path)):
+                self.last_mod = get_last_modification_date(self.file_path)
+                self.creation_date = get_creation_date(self.file_path)
+                self.number_edits = get_number_commits(self.file_path)
         else:
-            self.last_mod = datetime.date.today()
-            self.creation_date = datetime.date.today()
+            self.last_mod = today()
+            self.creation_date = today()
             self.number_edits = 1
 
+    def load_content(self):
+        """ Brings back the content dropped by :meth:`release_content`, with the links already resolved. """
+        if self.content is not None or not self.has_content:
+            return
+        if self.cite_key is not None:
+            self.content = self.bibliography.get(self.cite_key)
+            return
+        if self.content_store is not None:
+            self.content = self.content_store.get(self)
+        else:
+            from aqui_brain_dump.parse_frontmatter import load
+
+            with span('frontmatter'):
+                _, text = load(self.file_path)
+            self.content, _ = self._convert(text)
+        for link, target in self.rewrites.items():
+            self.content = rewrite_href(self.content, link, target)
+        if self.embeds:
+            self.content = self.expand_embeds(self.content)
+
+    def release_content(self):
+        """ Drops the HTML (or bibliography entry) of the note. ``has_content`` still tells whether it had any. """
+        self.content = None
+
     def render(self, base_url):
-        logger.debug(f'Preparing to render {self}')
+        with span('render', cat='note', note=str(self.path)):
+            if self.low_memory:
+                self.load_content()
+            self._render(base_url)
+            if self.low_memory:
+                self.release_content()
+
+    def render_html(self, base_url):
+        """ Returns the page of the note, rendered with its template, without writing it. """
         context = {
             'note': self,
             'static': static_url,
             'base_url': base_url,
             }
+        with span('template'):
+            template = get_environment().get_template(self.meta.get('template', 'note.html'))
+            return template.render(context)
+
+    def _render(self, base_url):
+        logger.debug(f'Preparing to render {self}')
         out_path = output_path / self.url[1:]
         # Check for invalid filename characters in the output path
         # has_invalid, chars = has_invalid_filename_chars(str(out_path))
@@ -231,27 +374,142 @@ class Note:
             logger.error(f'Error creating output path {out_path}: {e}')
             return
 
-        if 'template' in self.meta:
-            template = env.get_template(self.meta.get('template'))
-        else:
-            template = template_article
-        html = template.render(context)
+        html = self.render_html(base_url)
         
         # Write the HTML file
-        with open(out_path / 'index.html', 'w', encoding='utf-8') as out:
-            logger.debug(f'Writing {template} with {self} information, to {out_path}')
+        with span('write'), open(out_path / 'index.html', 'w', encoding='utf-8') as out:
+            logger.debug(f'Writing {self.meta.get("template", "note.html")} with {self} information, to {out_path}')
             out.write(html)
         
         # Generate and write connections JSON file
-        connections_data = self._generate_connections_data()
-        with open(out_path / 'connections.json', 'w', encoding='utf-8') as json_file:
-            json.dump(connections_data, json_file, indent=2, ensure_ascii=False)
-            logger.debug(f'Writing connections.json for {self} to {out_path}')
+        with span('connections'):
+            connections_data = self._generate_connections_data()
+            with open(out_path / 'connections.json', 'w', encoding='utf-8') as json_file:
+                json.dump(connections_data, json_file, indent=2, ensure_ascii=False)
+                logger.debug(f'Writing connections.json for {self} to {out_path}')
+
+    @classmethod
+    def build_resolver(cls):
+        """ Indexes every known note by slug, path, basename, title and aliases, see :mod:`aqui_brain_dump.resolver`.
+        """
+        cls.resolver = LinkResolver.from_notes(list(cls.notes.values()))
+        cls.resolver.report_ambiguous()
+        return cls.resolver
+
+    def resolve_links(self):
+        """ Replaces every link by the canonical URL of the note it points to, also in the rendered content. """
+        resolved = set()
+        self.link_labels = sorted(self.links)
+        for link in self.link_labels:
+            target = link
+            if link not in self.notes:
+                target = self.resolver.resolve(link) or link
+            if target != link:
+                logger.debug(f'Resolved link {link} in {self} to {target}')
+                self.rewrites[link] = target
+                if self.content:
+                    self.content = rewrite_href(self.content, link, target)
+            resolved.add(target)
+        self.links = resolved
+        self.embeds = {self.rewrites.get(url, url) for url in self.embeds}
+        snippets = {}
+        for url, text in self.link_snippets.items():
+            snippets.setdefault(self.rewrites.get(url, url), text)
+        self.link_snippets = snippets
+
+    def backlink_snippet(self, backlink):
+        """ Sentence of ``backlink`` (a note in :attr:`backlinks`) around its link to this note, or an empty string if
+        there is none, e.g. for the notes of a tag page. """
+        return backlink.link_snippets.get(self.url, '')
+
+    @classmethod
+    def find_embed_cycles(cls):
+        """ Finds the embeds that would make a note include itself, directly or through other notes, with a depth
+        first search that visits every note and embed once. Those embeds are shown as links instead. """
+        graph = {url: sorted(note.embeds) for url, note in cls.notes.items() if note.embeds}
+        visiting, done = 1, 2
+        state = {}
+        cycles = set()
+        for root in sorted(graph):
+            if root in state:
+                continue
+            state[root] = visiting
+            stack = [(root, iter(graph[root]))]
+            while stack:
+                url, targets = stack[-1]
+                for target in targets:
+                    if target not in state:
+                        state[target] = visiting
+                        stack.append((target, iter(graph.get(target, ()))))
+                        break
+                    if state[target] == visiting:
+                        cycles.add((url, target))
+                else:
+                    state[url] = done
+                    stack.pop()
+        for source, target in sorted(cycles):
+            logger.warning(f'Embedding {target} in {source} closes a cycle, it is shown as a link')
+        cls.embed_cycles = cycles
+        return cycles
+
+    @classmethod
+    def fragment(cls, url, section=None):
+        """ HTML of the note at ``url``, or of one of its sections, to embed it in other notes. Computed once per
+        build. None if there is no such note or section. """
+        key = (url, section)
+        if key in cls.fragments:
+            return cls.fragments[key]
+        note = cls.notes.get(url)
+        html = None
+        if note is not None and note.has_content and note.cite_key is None:
+            loaded = note.content is None
+            note.load_content()
+            html = note.expand_embeds(note.content)
+            if loaded:
+                note.release_content()
+            if section is not None:
+                html = section_html(html, section)
+                if html is None:
+                    logger.warning(f'No section {section} in {url}')
+            if html is not None:
+                html = embedded_ids(html)
+        cls.fragments[key] = html
+        return html
+
+    def expand_embeds(self, html):
+        """ Replaces the placeholders of the notes embedded in ``html`` by their content. """
+        from html import escape, unescape
+
+        if not html or 'data-embed="' not in html:
+            return html
+
+        def replace(m):
+            url = self.rewrites.get(m['url'], m['url'])
+            section = unescape(m['section']) if m['section'] else None
+            fragment = None
+            if (self.url, url) in self.embed_cycles:
+                css = 'transclusion transclusion-cycle'
+            else:
+                fragment = self.fragment(url, section)
+                css = 'transclusion transclusion-missing'
+            target = self.notes.get(url)
+            title = escape(str(target.title if target is not None else url))
+            if fragment is None:
+                embed = f'<div class="{css}"><a href="{escape(url)}">{title}</a></div>'
+            else:
+                embed = (f'<div class="transclusion" data-source="{escape(url)}">'
+                         f'<a class="transclusion-source" href="{escape(url)}">{title}</a>\n{fragment}</div>')
+            return embed
+
+        return EMBED_RE.sub(replace, html)
 
     @classmethod
     def build_backlinks(cls):
+        if cls.resolver is None:
+            cls.build_resolver()
         for note in list(cls.notes.values()):
-            for link in note.links:
+            note.resolve_links()
+            for link in sorted(note.links):
                 logger.debug(f'{note.url} links to {link}')
                 link_to = cls.notes.get(link, False)
                 if link_to:
@@ -259,11 +517,39 @@ class Note:
                     logger.debug(f'Adding {note} to backlinks of {link_to}')
                 else:
                     new_note = Note.create_from_url(link)
-                    while len([f for f in Note.futures_executor if f.running()]):
-                        time.sleep(.01)
+                    cls.resolver.add(new_note)
                     new_note.backlinks.add(note)
                     logger.debug(f'Creating {new_note} and appending {note} to its backlinks')
 
+    def to_record(self):
+        """ Returns the state of the note, without its content and backlinks, as a dictionary that can be pickled to
+        move the note to another process. """
+        record = dict(vars(self))
+        record['content'] = None
+        record['backlinks'] = set()
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """ Creates a note from :meth:`to_record`, without adding it to ``notes``. """
+        note = cls.__new__(cls)
+        note.__dict__.update(record)
+        return note
+
+    @classmethod
+    def sort_collections(cls):
+        """ Sorts the notes by url and replaces the sets of links, backlinks, tags and cites of every note by sorted
+        lists, so that templates and reports list them in the same order on every build. Call it once the graph is
+        complete. """
+        cls.notes = dict(sorted(cls.notes.items()))
+        for note in cls.notes.values():
+            if isinstance(note.backlinks, set):
+                note.backlinks = sorted(note.backlinks, key=lambda n: n.url)
+            note.links = sorted(note.links)
+            note.embeds = sorted(note.embeds)
+            note.tags = sorted(note.tags)
+            note.cites = sorted(note.cites)
+
     @classmethod
     def create_from_lit(cls, cite_key):
         logger.debug(f'Building note from lit cite {cite_key}')
@@ -283,12 +569,49 @@ class Note:
         note.meta['template'] = "lit_note.html"
         note.url = f"/lit_note/@{cite_key}/"
         note.notes[note.url] = note
-        note.content = biblio
+        note.cite_key = cite_key
+        note.has_content = biblio is not None
+        if not cls.low_memory:
+            note.content = biblio
         logger.debug(f'Added {note} to notes with url {note.url}')
         return note
 
     def __str__(self):
-        return self.title or str(self.path)
+        return str(self.title) if self.title else str(self.path)
 
     def __repr__(self):
-        return f'<Note {self.file_path or self.path}>'
\ No newline at end of file
+        return f'<Note {self.file_path or self.path}>'
+
+
+def rewrite_href(html, link, target):
+    """ Replaces the links to ``link`` in ``html``, with or without a ``#fragment``, by links to ``target``. """
+    return html.replace(f'href="{link}"', f'href="{target}"').replace(f'href="{link}#', f'href="{target}#')
+
+
+def _heading_key(text):
+    return re.sub(r'[\W_]+', ' ', text).strip().lower()
+
+
+def embedded_ids(html):
+    """ Renames the ``id`` of every element of an embedded note to ``data-embed-id``, so the headings it brings along
+    do not repeat the ids of the page that embeds it, and links to its anchors land on the page's own headings. """
+    return ID_ATTRIBUTE_RE.sub(r'\1data-embed-id=', html)
+
+
+def section_html(html, section):
+    """ Part of ``html`` under the heading ``section`` (compared ignoring case and punctuation), up to the next heading
+    of the same or a higher level. None if there is no such heading. """
+    from bs4 import BeautifulSoup
+
+    bs = BeautifulSoup(html, 'html.parser')
+    key = _heading_key(section)
+    heading = next((h for h in bs.find_all(HEADING_TAGS) if _heading_key(h.get_text()) == key), None)
+    if heading is None:
+        return None
+    level = HEADING_TAGS.index(heading.name)
+    parts = [str(heading)]
+    for sibling in heading.next_siblings:
+        if getattr(sibling, 'name', None) in HEADING_TAGS and HEADING_TAGS.index(sibling.name) <= level:
+            break
+        parts.append(str(sibling))
+    return ''.join(parts)
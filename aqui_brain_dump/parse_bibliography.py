@@ -1,6 +1,11 @@
 import json
+import logging
+import os
+from collections.abc import Mapping
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 
 def parse_bibliography(filename: Path):
     """ Parses a bibliographic record exported into json in the CSL Json format (easy to achieve with Zotero)
@@ -11,4 +16,110 @@ def parse_bibliography(filename: Path):
         bibliography = dict()
         for entry in data:
             bibliography[entry['id']] = entry
-    return bibliography
\ No newline at end of file
+    return bibliography
+
+
+def index_bibliography(filename: Path):
+    """ Scans a CSL Json export and returns a dictionary of entry id -> [byte offset, byte length] of each entry.
+    """
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    start = 3 if raw.startswith(b'\xef\xbb\xbf') else 0
+    text = raw[start:].decode('utf-8')
+    decoder = json.JSONDecoder()
+    offsets = {}
+
+    pos = text.index('[') + 1
+    char_pos, byte_pos = 0, start
+    while True:
+        while text[pos] in ' \t\n\r,':
+            pos += 1
+        if text[pos] == ']':
+            break
+        entry, end = decoder.raw_decode(text, pos)
+        byte_pos += len(text[char_pos:pos].encode('utf-8'))
+        length = len(text[pos:end].encode('utf-8'))
+        offsets[entry['id']] = [byte_pos, length]
+        byte_pos += length
+        char_pos = pos = end
+    return offsets
+
+
+class BibliographyStore(Mapping):
+    """ Read-only mapping of citation keys to CSL Json entries, loaded on demand.
+
+    On first access a small index of entry id -> byte range is built and saved next to the other cached data. Later
+    runs reuse it as long as the size and modification time of the bibliography file do not change. Only the entries
+    that are actually requested are read from disk and decoded.
+
+    :param filename: Path to the CSL Json export
+    :param index_file: Where to keep the index. Defaults to ``<filename>.idx.json`` inside ``cache_dir``
+    :param cache_dir: Folder for the index if ``index_file`` is not given. Defaults to the folder of ``filename``
+    """
+    INDEX_VERSION = 1
+
+    def __init__(self, filename: Path, index_file: Path = None, cache_dir: Path = None):
+        self.filename = Path(filename)
+        if index_file is None:
+            cache_dir = Path(cache_dir) if cache_dir is not None else self.filename.parent
+            index_file = cache_dir / f'{self.filename.name}.idx.json'
+        self.index_file = Path(index_file)
+        self._offsets = None
+        self._entries = {}
+        # Set to False to read entries from disk every time instead of keeping them, e.g. to build with low memory
+        self.keep_entries = True
+
+    @property
+    def offsets(self):
+        if self._offsets is None:
+            self._offsets = self._load_index()
+        return self._offsets
+
+    def _load_index(self):
+        try:
+            stat = self.filename.stat()
+        except FileNotFoundError:
+            logger.info(f'No bibliography file at {self.filename}')
+            return {}
+        source = [stat.st_size, stat.st_mtime_ns]
+
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get('version') == self.INDEX_VERSION and index.get('source') == source:
+                logger.debug(f'Using bibliography index {self.index_file}')
+                return index['offsets']
+        except (OSError, ValueError):
+            pass
+
+        logger.info(f'Indexing bibliography {self.filename}')
+        offsets = index_bibliography(self.filename)
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.index_file.with_name(f'{self.index_file.name}.{os.getpid()}.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'version': self.INDEX_VERSION, 'source': source, 'offsets': offsets}, f)
+            os.replace(tmp_file, self.index_file)
+        except OSError as e:
+            logger.warning(f'Could not save bibliography index to {self.index_file}: {e}')
+        return offsets
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __getitem__(self, key):
+        if key in self._entries:
+            return self._entries[key]
+        offset, length = self.offsets[key]
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            entry = json.loads(f.read(length).decode('utf-8'))
+        if self.keep_entries:
+            self._entries[key] = entry
+        return entry
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
@@ -0,0 +1,159 @@
+"""
+Frontmatter reader.
+Gives the same metadata and content as ``python-frontmatter``, which goes through the pure-Python YAML loader for every
+note. Most notes only have a few flat ``key: value`` lines, sometimes with a block list::
+
+    ---
+    title: Some note
+    description: 'Quoted: with a colon'
+    draft: false
+    aliases:
+      - Another name
+    ---
+
+Headers like that are read line by line. Every plain value is checked against the implicit resolvers of PyYAML, so
+``yes`` is still a bool, ``null`` is None and anything that would become a float, a date or any other type is left to
+YAML. Anything else (nested mappings, flow lists, multi-line strings, anchors, dates, ...) goes through the C loader of
+PyYAML when it is available, and its pure-Python ``SafeLoader`` otherwise.
+"""
+import re
+
+# Same boundary as python-frontmatter's YAML handler
+FM_BOUNDARY = re.compile(r'^-{3,}\s*$', re.M)
+# python-frontmatter's JSON handler
+JSON_BOUNDARY = re.compile(r'^(?:{|})$', re.M)
+
+KEY_RE = re.compile(r'([A-Za-z_][\w-]*):(?:[ ]+(.*))?')
+ITEM_RE = re.compile(r'([ ]*)-(?:[ ]+(.*))?')
+DECIMAL_RE = re.compile(r'[-+]?(?:0|[1-9][0-9]*)')
+# Characters that can not start a plain scalar
+INDICATORS = set('-?:,[]{}#&*!|>\'"%@`')
+
+STR_TAG = 'tag:yaml.org,2002:str'
+NULL_TAG = 'tag:yaml.org,2002:null'
+BOOL_TAG = 'tag:yaml.org,2002:bool'
+INT_TAG = 'tag:yaml.org,2002:int'
+
+_resolver = None
+
+
+class _Complex(Exception):
+    """ The header needs a real YAML parser. """
+
+
+def _resolve(value):
+    """ Tag the safe loader gives to a plain scalar. """
+    global _resolver
+    import yaml
+
+    if _resolver is None:
+        _resolver = yaml.resolver.Resolver()
+    return _resolver.resolve(yaml.ScalarNode, value, (True, False))
+
+
+def _scalar(value):
+    """ Converts a scalar as written after ``key:`` or ``-`` to what the YAML safe loader would give. """
+    if value is None or value == '':
+        return None
+    if not value.isprintable() or '\t' in value:
+        raise _Complex
+    value = value.rstrip(' ')
+    first = value[0]
+    if first == "'":
+        if len(value) > 1 and value.endswith("'") and "'" not in value[1:-1]:
+            return value[1:-1]
+        raise _Complex
+    if first == '"':
+        if len(value) > 1 and value.endswith('"') and '"' not in value[1:-1] and '\\' not in value:
+            return value[1:-1]
+        raise _Complex
+    if first in INDICATORS or ': ' in value or ' #' in value or value.endswith(':'):
+        raise _Complex
+
+    tag = _resolve(value)
+    if tag == STR_TAG:
+        return value
+    if tag == NULL_TAG:
+        return None
+    if tag == BOOL_TAG:
+        return value.lower() in ('yes', 'true', 'on')
+    if tag == INT_TAG and DECIMAL_RE.fullmatch(value):
+        return int(value)
+    raise _Complex
+
+
+def _parse_flat(fm):
+    """ Reads a header of flat keys with scalar or block list values. Raises ``_Complex`` for anything else. """
+    metadata = {}
+    key = None
+    indent = None
+    for line in fm.split('\n'):
+        if not line.strip() or line.lstrip(' ').startswith('#'):
+            continue
+        match = KEY_RE.fullmatch(line)
+        if match is not None:
+            key = match.group(1)
+            if _resolve(key) != STR_TAG:
+                raise _Complex
+            metadata[key] = _scalar(match.group(2))
+            indent = None
+            continue
+        match = ITEM_RE.fullmatch(line)
+        if match is None or key is None:
+            raise _Complex
+        items = metadata[key]
+        if indent is None:
+            # The first item of a list, which needs ``key:`` with nothing after it
+            if items is not None:
+                raise _Complex
+            items = metadata[key] = []
+            indent = match.group(1)
+        elif match.group(1) != indent:
+            raise _Complex
+        items.append(_scalar(match.group(2)))
+    return metadata
+
+
+def load_yaml(fm):
+    """ Loads YAML with the C safe loader if PyYAML was built with it. """
+    import yaml
+
+    return yaml.load(fm, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def parse(text):
+    """
+    Splits a note in its frontmatter and content.
+
+    Args:
+        text: Text of the note
+
+    Returns:
+        tuple: ``(metadata, content)``, the same as ``frontmatter.parse(text)``
+    """
+    text = text.strip()
+    if not FM_BOUNDARY.match(text):
+        if JSON_BOUNDARY.match(text):
+            import frontmatter
+
+            return frontmatter.parse(text)
+        return {}, text
+
+    try:
+        _, fm, content = FM_BOUNDARY.split(text, 2)
+    except ValueError:
+        return {}, text
+
+    try:
+        metadata = _parse_flat(fm)
+    except _Complex:
+        metadata = load_yaml(fm)
+        if not isinstance(metadata, dict):
+            metadata = {}
+    return metadata, content.strip()
+
+
+def load(file_path):
+    """ Reads a note and returns ``(metadata, content)``, see :func:`parse`. """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return parse(f.read())
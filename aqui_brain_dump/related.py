@@ -0,0 +1,302 @@
+"""
+Related notes.
+Suggests, for every note, the notes whose text and tags are most similar to its own, so notes that are about the same
+things find each other even if they are not linked. Each note is a sparse TF-IDF vector of the words of its markdown
+source and of its tags (``tag:physics``, also counting every parent of a nested tag), and its neighbours are the notes
+with the highest cosine similarity.
+
+The similarities are the product of the matrix of vectors with its transpose. With ``numpy`` and ``scipy`` installed
+(``pip install aqui_brain_dump[fast]``) it is a sparse matrix product, in blocks of rows. Without them, the same product
+is computed row by row from an inverted index, so every note is only compared with the notes that share a term with it.
+To keep both fast, words that appear in more than half of the notes or in a single one are left out, and only the
+``MAX_TERMS`` heaviest terms of each note are kept.
+
+The words of each note are kept in ``.garden_cache/related.pickle`` with the modification time of its file. On the next
+build only new or modified notes are read again and, if few of them changed, only the rows of the notes that share a
+term with them are computed again. The rest keep their neighbours, so their scores can drift slightly from a full
+computation until more than ``INCREMENTAL_LIMIT`` of the notes change at once.
+
+Templates get ``note.related`` (notes, most similar first) and ``note.related_scores`` (url -> similarity), and
+``connections.json`` lists them under ``related``.
+"""
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from aqui_brain_dump import cache_path
+from aqui_brain_dump.tags import tag_name
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_FILE = cache_path / 'related.pickle'
+DEFAULT_TOP_K = 5
+CACHE_FORMAT = 1
+# Words of at least three letters
+TOKEN_RE = re.compile(r'[^\W\d_]{3,}')
+# Targets of wikilinks and markdown links, code and html tags say little about the subject of a note
+NOISE_RE = re.compile(r'```.*?```|`[^`\n]*`|<[^>\n]+>|\]\([^)\n]*\)', re.S)
+STOPWORDS = frozenset('''
+about above after again against all also and any are because been before being below between both but can could did
+does doing down during each few for from further had has have having her here hers herself him himself his how into
+its itself just more most myself nor not now off once only other our ours ourselves out over own same she should some
+such than that the their theirs them themselves then there these they this those through too under until very was
+were what when where which while who whom why will with would you your yours yourself yourselves
+'''.split())
+TAG_WEIGHT = 3
+# Like the query terms of Lucene's MoreLikeThis, a few heavy terms are enough to find similar notes
+MAX_TERMS = 25
+# Terms in more than this share of the notes are left out, once the garden has at least MIN_NOTES_MAX_DF notes
+MAX_DF = 0.5
+MIN_NOTES_MAX_DF = 20
+MIN_SCORE = 0.05
+# Above this share of changed notes, every row is computed again
+INCREMENTAL_LIMIT = 0.05
+BLOCK_ROWS = 1024
+
+
+def note_terms(note):
+    """ Counts the words of the markdown of a note, without its frontmatter, plus its tags. """
+    from aqui_brain_dump.parse_frontmatter import load
+
+    try:
+        _, text = load(note.file_path)
+    except Exception as e:
+        logger.warning(f'Could not read {note.file_path} to find related notes: {e}')
+        text = ''
+    text = NOISE_RE.sub(' ', text)
+    counts = Counter(word for word in TOKEN_RE.findall(text.lower()) if word not in STOPWORDS)
+    for tag in note.tags:
+        name = tag_name(tag)
+        while name:
+            counts[f'tag:{name}'] += TAG_WEIGHT
+            name = name.rpartition('/')[0]
+    return counts
+
+
+def _stamp(note):
+    try:
+        stat = os.stat(note.file_path)
+    except OSError:
+        return None
+    return str(note.file_path), stat.st_mtime_ns, stat.st_size
+
+
+def _top(scores, top_k):
+    """ The ``top_k`` best ``(url, score)`` pairs, rounded, ties broken by url so the result is always the same. """
+    pairs = ((url, round(score, 4)) for url, score in scores if score >= MIN_SCORE)
+    return heapq.nsmallest(top_k, pairs, key=lambda pair: (-pair[1], pair[0]))
+
+
+class RelatedIndex:
+    """ Term counts of every note, their document frequencies and the neighbours found last time.
+
+    :param cache_file: Where the index is kept between builds, None to keep it only in memory
+    :param top_k: Neighbours per note
+    """
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, top_k=DEFAULT_TOP_K):
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.top_k = top_k
+        self.counts = {}
+        self.stamps = {}
+        self.df = Counter()
+        self.neighbours = {}
+        # Whether anything changed since the index was loaded, so it needs to be saved again
+        self.modified = False
+        if self.cache_file is None:
+            return
+        try:
+            with open(self.cache_file, 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f'Ignoring unreadable related notes cache {self.cache_file}: {e}')
+            return
+        if data.get('format') != CACHE_FORMAT:
+            return
+        self.counts = data['counts']
+        self.stamps = data['stamps']
+        self.df = data['df']
+        # Neighbours found for another number of them are of no use
+        if data.get('top_k') == top_k:
+            self.neighbours = data['neighbours']
+
+    def update(self, notes):
+        """
+        Counts the terms of new and modified notes and forgets the removed ones.
+
+        Returns:
+            dict: url -> set of the terms it had before and has now, for every note that changed
+        """
+        changed = {}
+        seen = set()
+        for note in notes:
+            seen.add(note.url)
+            stamp = _stamp(note)
+            if stamp is not None and self.stamps.get(note.url) == stamp:
+                continue
+            old = self.counts.get(note.url, {})
+            new = note_terms(note)
+            self.df.subtract(old.keys())
+            self.df.update(new.keys())
+            self.counts[note.url] = new
+            self.stamps[note.url] = stamp
+            changed[note.url] = set(old) | set(new)
+        for url in set(self.counts) - seen:
+            old = self.counts.pop(url)
+            self.stamps.pop(url, None)
+            self.neighbours.pop(url, None)
+            self.df.subtract(old.keys())
+            changed[url] = set(old)
+        self.df = +self.df
+        return changed
+
+    def vectors(self):
+        """ Normalized TF-IDF vectors, as url -> {term: weight}, with only the terms useful to compare notes. """
+        n = len(self.counts)
+        max_df = MAX_DF * n if n >= MIN_NOTES_MAX_DF else n
+        vectors = {}
+        for url, counts in self.counts.items():
+            weights = {}
+            for term, count in counts.items():
+                df = self.df[term]
+                if df < 2 or df > max_df:
+                    continue
+                weights[term] = (1 + math.log(count)) * (math.log((1 + n) / (1 + df)) + 1)
+            if len(weights) > MAX_TERMS:
+                weights = dict(heapq.nlargest(MAX_TERMS, weights.items(), key=lambda x: (x[1], x[0])))
+            norm = math.sqrt(sum(w * w for w in weights.values()))
+            if norm:
+                vectors[url] = {term: w / norm for term, w in weights.items()}
+        return vectors
+
+    def compute(self, vectors, rows):
+        """ Finds the neighbours of the notes in ``rows``. """
+        try:
+            import numpy  # noqa: F401
+            from scipy import sparse  # noqa: F401
+        except ImportError:
+            return self._compute_python(vectors, rows)
+        return self._compute_sparse(vectors, rows)
+
+    def _compute_python(self, vectors, rows):
+        postings = defaultdict(list)
+        for url, vector in vectors.items():
+            for term, weight in vector.items():
+                postings[term].append((url, weight))
+        for url in rows:
+            scores = defaultdict(float)
+            for term, weight in vectors.get(url, {}).items():
+                for other, other_weight in postings[term]:
+                    scores[other] += weight * other_weight
+            scores.pop(url, None)
+            self.neighbours[url] = _top(scores.items(), self.top_k)
+
+    def _compute_sparse(self, vectors, rows):
+        import numpy as np
+        from scipy import sparse
+
+        urls = sorted(vectors)
+        index = {url: i for i, url in enumerate(urls)}
+        terms = {}
+        data, indices, indptr = [], [], [0]
+        for url in urls:
+            for term, weight in vectors[url].items():
+                indices.append(terms.setdefault(term, len(terms)))
+                data.append(weight)
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix((np.array(data), np.array(indices), np.array(indptr)),
+                                   shape=(len(urls), max(len(terms), 1)))
+        transposed = matrix.T.tocsc()
+
+        for url in rows:
+            if url not in index:
+                self.neighbours[url] = []
+        rows = [url for url in rows if url in index]
+        for start in range(0, len(rows), BLOCK_ROWS):
+            block = rows[start:start + BLOCK_ROWS]
+            products = (matrix[[index[url] for url in block]] @ transposed).tocsr()
+            for i, url in enumerate(block):
+                begin, end = products.indptr[i], products.indptr[i + 1]
+                columns = products.indices[begin:end]
+                scores = products.data[begin:end]
+                keep = columns != index[url]
+                columns, scores = columns[keep], scores[keep]
+                if len(scores) > self.top_k:
+                    # Only the scores that can round to the k-th best or above go on to _top
+                    kth = np.partition(scores, len(scores) - self.top_k)[len(scores) - self.top_k]
+                    keep = scores >= kth - 1e-4
+                    columns, scores = columns[keep], scores[keep]
+                self.neighbours[url] = _top(zip([urls[j] for j in columns.tolist()], scores.tolist()), self.top_k)
+
+    def refresh(self, notes):
+        """ Brings the index and the neighbours of every note up to date. Returns url -> [(url, score)]. """
+        changed = self.update(notes)
+        n = len(self.counts)
+        complete = all(url in self.neighbours for url in self.counts)
+        if complete and not changed:
+            logger.info('No notes changed, reusing the related notes of the last build')
+            return self.neighbours
+
+        self.modified = True
+        vectors = self.vectors()
+        if complete and len(changed) <= INCREMENTAL_LIMIT * n:
+            touched = set().union(*changed.values())
+            rows = {url for url in changed if url in self.counts}
+            rows.update(url for url, vector in vectors.items() if touched.intersection(vector))
+            rows.update(url for url, neighbours in self.neighbours.items()
+                        if any(other in changed for other, _ in neighbours))
+            logger.info(f'{len(changed)} notes changed, finding related notes again for {len(rows)} of {n}')
+            self.compute(vectors, sorted(rows))
+        else:
+            logger.info(f'Finding related notes for {n} notes')
+            self.neighbours = {}
+            self.compute(vectors, sorted(self.counts))
+        for url in self.counts:
+            self.neighbours.setdefault(url, [])
+        return self.neighbours
+
+    def save(self):
+        if self.cache_file is None or not self.modified:
+            return
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_name(f'{self.cache_file.name}.{os.getpid()}.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({
+                'format': CACHE_FORMAT,
+                'top_k': self.top_k,
+                'counts': self.counts,
+                'stamps': self.stamps,
+                'df': self.df,
+                'neighbours': self.neighbours,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self.cache_file)
+
+
+def find_related(notes, top_k=DEFAULT_TOP_K, cache_file=DEFAULT_CACHE_FILE):
+    """
+    Sets ``related`` and ``related_scores`` of every note read from a file.
+
+    Args:
+        notes: Dictionary url -> note, as ``Note.notes``
+        top_k: Neighbours per note
+        cache_file: Where to keep the index between builds, None to always start from scratch
+
+    Returns:
+        dict: url -> list of ``(url, score)``, most similar first
+    """
+    sources = [note for note in notes.values()
+               if note.has_content and note.cite_key is None and os.path.isfile(note.file_path)]
+    index = RelatedIndex(cache_file, top_k=top_k)
+    neighbours = index.refresh(sources)
+    index.save()
+    for note in sources:
+        pairs = [(url, score) for url, score in neighbours.get(note.url, []) if url in notes]
+        note.related = [notes[url] for url, _ in pairs]
+        note.related_scores = dict(pairs)
+    return neighbours
@@ -0,0 +1,154 @@
+"""
+Wikilink Resolver
+=================
+
+Maps the many ways of writing a link to a note onto the note's canonical URL. After discovery every note is indexed
+under its URL slug, its path relative to the content folder, its basename, its title and any ``aliases`` given in the
+frontmatter. Pages the build generates (tag and literature pages, and the empty notes created for links to notes that do
+not exist) are only indexed under their URL, so they never take the place of a note. Keys are normalized (lowercase, punctuation and spaces collapsed to ``_``), so ``[[Some Note]]``,
+``[[some-note]]`` and ``[[sub/Some_Note]]`` all land on the same page.
+
+Lookups are a single dictionary access. Adding, removing or updating a single note only touches the keys of that note,
+so the index can be kept up to date while notes change.
+"""
+import logging
+import re
+from pathlib import PurePath
+
+logger = logging.getLogger(__name__)
+
+# Lower tiers win: an exact path beats a basename, which beats a title, which beats an alias.
+TIER_PATH = 0
+TIER_BASENAME = 1
+TIER_TITLE = 2
+TIER_ALIAS = 3
+
+RE_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_key(label):
+    """ Normalizes a link target, title or path to the form used as key in the index.
+
+    Each path segment is lowercased and every run of spaces, punctuation and underscores becomes a single ``_``.
+    A trailing ``.md`` is dropped, as are leading and trailing slashes.
+    """
+    label = str(label).strip().strip('/')
+    if label.lower().endswith('.md'):
+        label = label[:-3]
+    segments = [RE_NON_WORD.sub('_', s.lower()).strip('_') for s in label.split('/')]
+    return '/'.join(s for s in segments if s)
+
+
+def is_generated(note):
+    """ Whether a note was not read from a file of the content folder: tag and literature pages and empty notes. """
+    return not getattr(note, 'has_content', True) or getattr(note, 'cite_key', None) is not None
+
+
+def note_keys(note):
+    """ Returns a dictionary of normalized keys -> tier under which a note can be reached. Generated notes (see
+    :func:`is_generated`) can only be reached by their URL. """
+    keys = {}
+
+    def add(key, tier):
+        if key and tier < keys.get(key, TIER_ALIAS + 1):
+            keys[key] = tier
+
+    url_key = normalize_key(note.url)
+    add(url_key, TIER_PATH)
+    if is_generated(note):
+        return keys
+    add(url_key.split('/')[-1], TIER_BASENAME)
+    path = getattr(note, 'path', None)
+    if path is not None:
+        path_key = normalize_key(PurePath(path).as_posix())
+        add(path_key, TIER_PATH)
+        add(path_key.split('/')[-1], TIER_BASENAME)
+    add(normalize_key(note.title), TIER_TITLE)
+
+    meta = getattr(note, 'meta', None) or {}
+    aliases = meta.get('aliases', meta.get('alias', []))
+    if isinstance(aliases, str):
+        aliases = [aliases]
+    for alias in aliases or []:
+        add(normalize_key(alias), TIER_ALIAS)
+    return keys
+
+
+class LinkResolver:
+    """ Index from normalized keys to canonical note URLs.
+
+    Use :meth:`from_notes` to build it after discovery and :meth:`update` or :meth:`remove` to keep it current when a
+    single note changes. Keys claimed by more than one note at the same tier are reported in :attr:`ambiguous`.
+    """
+    def __init__(self):
+        self._index = {}  # key -> {url: tier}
+        self._keys = {}  # url -> keys registered for that url
+        self.ambiguous = {}  # key -> sorted list of urls
+
+    @classmethod
+    def from_notes(cls, notes):
+        resolver = cls()
+        for note in notes:
+            resolver.add(note)
+        return resolver
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, url):
+        return url in self._keys
+
+    def add(self, note):
+        if note.url in self._keys:
+            self.remove(note.url)
+        keys = note_keys(note)
+        self._keys[note.url] = keys
+        for key, tier in keys.items():
+            self._index.setdefault(key, {})[note.url] = tier
+            self._check_ambiguous(key)
+
+    def remove(self, url):
+        for key in self._keys.pop(url, {}):
+            entries = self._index.get(key, {})
+            entries.pop(url, None)
+            if not entries:
+                self._index.pop(key, None)
+            self._check_ambiguous(key)
+
+    def update(self, note):
+        """ Re-indexes a single note, for example after its file changed. """
+        self.add(note)
+
+    def _check_ambiguous(self, key):
+        entries = self._index.get(key, {})
+        if not entries:
+            self.ambiguous.pop(key, None)
+            return
+        best = min(entries.values())
+        candidates = sorted(url for url, tier in entries.items() if tier == best)
+        if len(candidates) > 1:
+            self.ambiguous[key] = candidates
+        else:
+            self.ambiguous.pop(key, None)
+
+    def resolve(self, target):
+        """ Returns the canonical URL for a link target, or ``None`` if no note matches.
+
+        If several notes match equally well, the first in alphabetical order is returned and a warning is logged.
+        """
+        key = normalize_key(target)
+        entries = self._index.get(key)
+        if not entries and '/' in key:
+            entries = self._index.get(key.split('/')[-1])
+        if not entries:
+            return None
+        best = min(entries.values())
+        candidates = sorted(url for url, tier in entries.items() if tier == best)
+        if len(candidates) > 1:
+            logger.warning(f'Link to {target} is ambiguous, candidates: {candidates}. Using {candidates[0]}')
+        return candidates[0]
+
+    def report_ambiguous(self):
+        for key, urls in sorted(self.ambiguous.items()):
+            logger.warning(f'Ambiguous link key "{key}" matches {len(urls)} notes: {", ".join(urls)}')
+        return self.ambiguous
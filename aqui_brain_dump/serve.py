@@ -0,0 +1,326 @@
+"""
+Development server.
+Previews the garden without building it. At startup every note is only scanned: its frontmatter is read and its
+wikilinks, tags and citations are found with regular expressions instead of converting the markdown, which is enough
+to build the titles, tag pages and backlinks. The snippets of the backlinks are taken from the markdown of the paragraph
+of each link. A page is converted and rendered, with the same templates as a build, the first time it is requested.
+
+Rendered pages are kept in a least recently used cache of ``cache_size`` pages. A page is rendered again when the
+source file of its note or its template changes. If the links of a note change, the pages of the notes it links to,
+before and after the change, are rendered again as well, and so are the pages that embed it. Tag and literature pages
+are built at startup only, and new notes need a restart::
+
+    brain_dump serve
+    brain_dump serve --port 8080 --cache-size 1000
+"""
+import argparse
+import json
+import logging
+import mimetypes
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from aqui_brain_dump import bibliography, content_path, static_path, static_url, template_path
+from aqui_brain_dump.note import Note
+from aqui_brain_dump.util import path_to_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 256
+
+FENCED_CODE_RE = re.compile(r'^(```|~~~).*?^\1', re.M | re.S)
+INLINE_CODE_RE = re.compile(r'`[^`\n]*`')
+# Targets of markdown links, [text](target), whose #fragments are not tags
+LINK_TARGET_RE = re.compile(r'\]\([^)\n]*\)')
+H1_RE = re.compile(r'^#[ \t]+(.+?)[ \t#]*$', re.M)
+# Blank lines and headings, which end paragraphs
+BLOCK_BREAK_RE = re.compile(r'\n[ \t]*\n|^#.*$', re.M)
+
+
+def scan_note(file_path):
+    """ Creates a note from its frontmatter and the links, tags and citations found in its text, without converting
+    the markdown. The note is not added to ``Note.notes``. """
+    from aqui_brain_dump.backlinks_wikilinks import WIKILINK_RE, link_url, snippet, split_label
+    from aqui_brain_dump.extension_citations import RE_CITES
+    from aqui_brain_dump.extension_tags import RE_TAGS
+    from aqui_brain_dump.extension_wikiimage import is_image, split_embed
+    from aqui_brain_dump.parse_frontmatter import load
+
+    note = Note(file_path, parse_git=False)
+    try:
+        metadata, text = load(file_path)
+    except Exception as e:
+        logger.error(f'Error parsing {file_path}: {e}')
+        metadata, text = {}, ''
+    text = FENCED_CODE_RE.sub('', text)
+    text = INLINE_CODE_RE.sub('', text)
+    text = LINK_TARGET_RE.sub(']', text)
+
+    note.meta = metadata
+    h1 = H1_RE.search(text)
+    if 'title' in metadata:
+        note.title = metadata['title']
+    elif h1 is not None:
+        note.title = h1.group(1)
+    else:
+        note.title = ' '.join(str(note.path).split('_')).strip('/').capitalize()
+        if note.title.endswith('.md'):
+            note.title = note.title[:-3]
+    note.url = path_to_url(note.path)
+    if 'slug' in metadata:
+        note.url = metadata.get('url')
+
+    note.links = set()
+    for m in re.finditer(r'(?<!!)' + WIKILINK_RE, text):
+        target, _ = split_label(m.group(1))
+        if not target:
+            continue
+        url = link_url(target)
+        note.links.add(url)
+        if url not in note.link_snippets:
+            # The paragraph of the link, as written, with wikilinks replaced by their text
+            begin, end = 0, len(text)
+            for block_break in BLOCK_BREAK_RE.finditer(text):
+                if block_break.end() <= m.start():
+                    begin = block_break.end()
+                elif block_break.start() >= m.end():
+                    end = block_break.start()
+                    break
+            paragraph = text[begin:end]
+            context = snippet(paragraph, m.start() - begin, m.end() - begin)
+            note.link_snippets[url] = re.sub(WIKILINK_RE, lambda w: w.group(1).split('|')[-1].strip(), context)
+    note.embeds = {split_embed(m.group(1))[0] for m in re.finditer(r'!' + WIKILINK_RE, text)
+                   if m.group(1).strip() and not is_image(m.group(1))}
+    note.links |= note.embeds
+    # The #section of [[note#section]] is not a tag
+    text = re.sub(WIKILINK_RE, lambda m: m.group(0) if split_label(m.group(1))[1] is None else '', text)
+    note.tags = {m.group(1) for m in RE_TAGS.finditer(text)}
+    note.cites = {m.group(1).strip('@').lower() for m in re.finditer(RE_CITES, text)}
+    note.has_content = True
+    note.update_git_information()
+    return note
+
+
+class PageCache:
+    """ Least recently used cache of rendered pages. Each page is stored with a version, and only returned while the
+    version asked for is the same. """
+    def __init__(self, max_pages=DEFAULT_CACHE_SIZE):
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url, version):
+        with self.lock:
+            entry = self.pages.get(url)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            self.pages.move_to_end(url)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, url, version, page):
+        with self.lock:
+            self.pages[url] = (version, page)
+            self.pages.move_to_end(url)
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+
+    def invalidate(self, url):
+        with self.lock:
+            self.pages.pop(url, None)
+
+
+def _mtime(path):
+    try:
+        return Path(path).stat().st_mtime_ns
+    except OSError:
+        return None
+
+
+class GardenServer:
+    """ Scans the garden and renders its pages on request.
+
+    :param base_url: Passed to the templates as ``base_url``
+    :param cache_size: Maximum number of rendered pages kept in memory
+    """
+    def __init__(self, base_url, cache_size=DEFAULT_CACHE_SIZE):
+        self.base_url = base_url
+        self.cache = PageCache(cache_size)
+        # Markdown instances are not thread safe, so pages are rendered one at a time
+        self.render_lock = threading.RLock()
+        self.mtimes = {}
+
+    def scan(self):
+        from aqui_brain_dump.__main__ import build_lit_pages, build_tag_pages
+        from aqui_brain_dump.discovery import iter_notes
+
+        start = time.perf_counter()
+        Note.bibliography = bibliography
+        for file_path in iter_notes():
+            note = scan_note(file_path)
+            note.notes[note.url] = note
+            note.register()
+            self.mtimes[note.url] = _mtime(note.file_path)
+        scanned = len(Note.notes)
+        build_tag_pages()
+        build_lit_pages()
+        Note.build_backlinks()
+        Note.find_embed_cycles()
+        logger.info(f'Scanned {scanned} notes in {time.perf_counter() - start:.2f}s')
+
+    def find_note(self, path):
+        for candidate in (path, path.rstrip('/') + '/', path.rstrip('/')):
+            note = Note.notes.get(candidate)
+            if note is not None:
+                return note
+        return None
+
+    def version(self, note):
+        template = template_path / note.meta.get('template', 'note.html')
+        return self.mtimes.get(note.url), _mtime(template)
+
+    def refresh(self, note):
+        """ Scans a note again after its file changed, and updates the links and backlinks it takes part in. """
+        logger.info(f'{note.file_path} changed, scanning it again')
+        scanned = scan_note(note.file_path)
+        old_links = set(note.links)
+        note.title = scanned.title
+        note.meta = scanned.meta
+        note.tags = scanned.tags
+        note.cites = scanned.cites
+        note.links = scanned.links
+        note.embeds = scanned.embeds
+        note.link_snippets = scanned.link_snippets
+        note.rewrites = {}
+        note.resolve_links()
+        new_links = set(note.links)
+        for link in old_links - new_links:
+            target = Note.notes.get(link)
+            if target is not None:
+                target.backlinks.discard(note)
+        for link in new_links - old_links:
+            target = Note.notes.get(link)
+            if target is None:
+                target = Note.create_from_url(link)
+                Note.resolver.add(target)
+            target.backlinks.add(note)
+        for link in old_links | new_links:
+            self.cache.invalidate(link)
+        # Notes that embed this one show its old content
+        Note.fragments.clear()
+        Note.find_embed_cycles()
+        for backlink in note.backlinks:
+            if note.url in backlink.embeds:
+                self.cache.invalidate(backlink.url)
+        self.mtimes[note.url] = _mtime(note.file_path)
+
+    def render(self, note):
+        """ Returns the page of a note, from the cache if neither its source nor its template changed. """
+        if note.url in self.mtimes and _mtime(note.file_path) != self.mtimes[note.url]:
+            with self.render_lock:
+                if _mtime(note.file_path) != self.mtimes[note.url]:
+                    self.refresh(note)
+        version = self.version(note)
+        page = self.cache.get(note.url, version)
+        if page is not None:
+            return page
+        with self.render_lock:
+            logger.info(f'Rendering {note.url}')
+            loaded = note.content is None
+            note.load_content()
+            try:
+                page = note.render_html(self.base_url).encode('utf-8')
+            finally:
+                if loaded:
+                    note.release_content()
+        self.cache.put(note.url, version, page)
+        return page
+
+    def static_file(self, base, relative):
+        base = Path(base).absolute()
+        path = (base / relative).resolve()
+        if base.resolve() not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def respond(self, path):
+        """ Returns the status, content type and body for a request path. """
+        if path.startswith(f'/{static_url}/'):
+            file = self.static_file(static_path, path[len(static_url) + 2:])
+        else:
+            file = self.static_file(content_path, path.lstrip('/'))
+        if file is not None and file.suffix != '.md':
+            content_type = mimetypes.guess_type(str(file))[0] or 'application/octet-stream'
+            return 200, content_type, file.read_bytes()
+
+        if path.endswith('/connections.json'):
+            note = self.find_note(path[:-len('connections.json')])
+            if note is not None:
+                data = json.dumps(note._generate_connections_data(), indent=2, ensure_ascii=False)
+                return 200, 'application/json', data.encode('utf-8')
+
+        if path.endswith('/index.html'):
+            path = path[:-len('index.html')]
+        note = self.find_note(path)
+        if note is None:
+            return 404, 'text/plain; charset=utf-8', f'No note at {path}'.encode('utf-8')
+        return 200, 'text/html; charset=utf-8', self.render(note)
+
+
+class GardenRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = unquote(urlsplit(self.path).path)
+        try:
+            status, content_type, body = self.server.garden.respond(path)
+        except Exception as e:
+            logger.exception(f'Error serving {path}')
+            status, content_type, body = 500, 'text/plain; charset=utf-8', str(e).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(host='127.0.0.1', port=8000, base_url=None, cache_size=DEFAULT_CACHE_SIZE):
+    base_url = base_url or f'http://{host}:{port}'
+    garden = GardenServer(base_url, cache_size=cache_size)
+    garden.scan()
+    server = ThreadingHTTPServer((host, port), GardenRequestHandler)
+    server.garden = garden
+    logger.info(f'Serving the garden on http://{host}:{port}/')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info(f'Page cache: {garden.cache.hits} hits, {garden.cache.misses} misses')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='brain_dump serve', description='Preview the garden, rendering on request')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on (default: 8000)')
+    parser.add_argument('--base-url', help='Base url passed to the templates (default: the address of the server)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f'Rendered pages kept in memory (default: {DEFAULT_CACHE_SIZE})')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    serve(host=args.host, port=args.port, base_url=args.base_url, cache_size=args.cache_size)
+
+
+if __name__ == '__main__':
+    main()
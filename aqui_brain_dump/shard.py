@@ -0,0 +1,270 @@
+"""
+Sharded build.
+Splits the content in ``N`` shards by a hash of the path of each file, so that the same file always lands in the same
+shard. The build then runs in two steps:
+
+- **map**: every shard is parsed on its own, in a separate process or on a separate machine that shares the file
+  system. Each shard copies its non-markdown files and saves the parsed notes (title, links, tags, cites, metadata and
+  git dates) plus their HTML, and the urls of the files it copied, to ``<shard dir>/shard_<i>_of_<N>.*``.
+- **reduce**: loads the notes of every shard, in the same order a single-process build discovers them, builds tag,
+  literature and missing pages and the backlinks of the whole garden, and renders the pages of every shard in a forked
+  worker. The HTML of each note is read back from its shard only when its page is written.
+
+The output is the same as the one of a single-process build::
+
+    # On one machine, with 4 processes
+    python -m aqui_brain_dump.shard build 4
+
+    # Spread over machines sharing the garden folder
+    python -m aqui_brain_dump.shard map 0 4     # on machine A
+    python -m aqui_brain_dump.shard map 1 4     # on machine B, ...
+    python -m aqui_brain_dump.shard reduce 4    # once every map is done
+"""
+import argparse
+import hashlib
+import logging
+import multiprocessing
+import os
+import pickle
+import subprocess
+import sys
+import zlib
+from functools import partial
+from pathlib import Path, PurePath
+
+from aqui_brain_dump import bibliography, cache_path, content_path
+from aqui_brain_dump.neighbourhood import DEFAULT_HOPS
+from aqui_brain_dump.note import Note
+from aqui_brain_dump.related import DEFAULT_TOP_K as DEFAULT_RELATED
+from aqui_brain_dump.tags import DEFAULT_PAGE_SIZE as DEFAULT_TAG_PAGE_SIZE
+from aqui_brain_dump.trace import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARD_DIR = cache_path / 'shards'
+SHARD_FORMAT = 5
+
+
+def shard_of(path, num_shards):
+    """ Shard of a file, given its path relative to the content folder. Stable between runs and machines. """
+    return zlib.crc32(PurePath(path).as_posix().encode('utf-8')) % num_shards
+
+
+def shard_files(shard_dir, index, num_shards):
+    """ Returns the paths of the notes and content files of a shard. """
+    base = Path(shard_dir) / f'shard_{index}_of_{num_shards}'
+    return Path(f'{base}.notes.pickle'), Path(f'{base}.html')
+
+
+def discovery_order():
+    """ Path of every note relative to the content folder -> position in which a single-process build finds it. """
+    from aqui_brain_dump.discovery import iter_notes
+
+    order = {}
+    for file_path in iter_notes():
+        order[file_path.relative_to(content_path).as_posix()] = len(order)
+    return order
+
+
+def map_shard(index, num_shards, shard_dir=DEFAULT_SHARD_DIR, parse_git=True):
+    """ Parses the notes of one shard and saves them. Run it once per shard, each in a new process. """
+    from aqui_brain_dump.__main__ import discover_notes, log_highlight_cache
+
+    order = discovery_order()
+    digest = hashlib.sha1('\n'.join(order).encode('utf-8')).hexdigest()
+    logger.info(f'Building shard {index} of {num_shards}')
+    discover_notes(parse_git=parse_git, select=lambda path: shard_of(path, num_shards) == index)
+    Note.note_executor.shutdown(wait=True)
+    log_highlight_cache()
+
+    notes_file, content_file = shard_files(shard_dir, index, num_shards)
+    notes_file.parent.mkdir(parents=True, exist_ok=True)
+    records = []
+    contents = {}
+    tmp_content = content_file.with_name(content_file.name + '.tmp')
+    with open(tmp_content, 'wb') as f:
+        for note in Note.notes.values():
+            path = note.path.as_posix()
+            data = (note.content or '').encode('utf-8')
+            contents[path] = (f.tell(), len(data))
+            f.write(data)
+            records.append((order[path], note.to_record()))
+
+    tmp_notes = notes_file.with_name(notes_file.name + '.tmp')
+    with open(tmp_notes, 'wb') as f:
+        pickle.dump({
+            'format': SHARD_FORMAT,
+            'num_shards': num_shards,
+            'digest': digest,
+            'records': records,
+            'contents': contents,
+            'assets': sorted(Note.assets),
+        }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_content, content_file)
+    os.replace(tmp_notes, notes_file)
+    logger.info(f'Saved {len(records)} notes of shard {index} to {notes_file}')
+    return len(records)
+
+
+class ShardContents:
+    """ Reads the HTML of a note back from the content file of its shard. Used as ``Note.content_store``.
+
+    :param index: Path of each note -> (shard, offset, length)
+    """
+    def __init__(self, shard_dir, num_shards, index):
+        self.shard_dir = Path(shard_dir)
+        self.num_shards = num_shards
+        self.index = index
+
+    def get(self, note):
+        shard, offset, length = self.index[note.path.as_posix()]
+        _, content_file = shard_files(self.shard_dir, shard, self.num_shards)
+        with open(content_file, 'rb') as f:
+            f.seek(offset)
+            return f.read(length).decode('utf-8')
+
+
+def load_shards(num_shards, shard_dir=DEFAULT_SHARD_DIR):
+    """ Replaces the discovery of a build: loads the notes saved by :func:`map_shard` for every shard. """
+    Note.bibliography = bibliography
+    Note.low_memory = True
+
+    records = []
+    index = {}
+    digests = set()
+    for shard in range(num_shards):
+        notes_file, _ = shard_files(shard_dir, shard, num_shards)
+        try:
+            with open(notes_file, 'rb') as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            raise RuntimeError(f'Shard {shard} of {num_shards} was not built, {notes_file} is missing')
+        if data.get('format') != SHARD_FORMAT or data.get('num_shards') != num_shards:
+            raise RuntimeError(f'{notes_file} was built by a different version or with a different number of shards')
+        digests.add(data['digest'])
+        records += data['records']
+        Note.assets.update(data['assets'])
+        for path, (offset, length) in data['contents'].items():
+            index[path] = (shard, offset, length)
+    if len(digests) > 1:
+        raise RuntimeError('The shards were built from different content, build them again')
+
+    Note.content_store = ShardContents(shard_dir, num_shards, index)
+    for _, record in sorted(records, key=lambda r: r[0]):
+        note = Note.from_record(record)
+        note.notes[note.url] = note
+        note.register()
+    logger.info(f'Loaded {len(records)} notes from {num_shards} shards')
+
+
+def render_shard(index, num_shards, base_url):
+    for note in Note.notes.values():
+        if shard_of(note.path, num_shards) == index:
+            note.render(base_url=base_url)
+
+
+def render_shards(num_shards, base_url='https://notes.aquiles.me'):
+    """ Renders the pages of every shard in a forked process that shares the graph built so far. """
+    try:
+        context = multiprocessing.get_context('fork')
+    except ValueError:
+        logger.warning('Processes can not be forked on this platform, rendering in a single process')
+        for index in range(num_shards):
+            render_shard(index, num_shards, base_url)
+        return
+
+    processes = [context.Process(target=render_shard, args=(index, num_shards, base_url))
+                 for index in range(num_shards)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    failed = [index for index, process in enumerate(processes) if process.exitcode != 0]
+    if failed:
+        raise RuntimeError(f'Rendering failed for shards {failed}')
+
+
+def reduce_stages(num_shards, base_url='https://notes.aquiles.me', shard_dir=DEFAULT_SHARD_DIR,
+                  tag_page_size=DEFAULT_TAG_PAGE_SIZE, related=DEFAULT_RELATED, hops=DEFAULT_HOPS):
+    """ The stages of a normal build, with discovery replaced by loading the shards and rendering split by shard. """
+    from aqui_brain_dump.__main__ import build_stages
+
+    stages = dict(build_stages(base_url=base_url, low_memory=True, tag_page_size=tag_page_size, related=related,
+                               hops=hops))
+    stages['discover'] = partial(load_shards, num_shards, shard_dir=shard_dir)
+    stages['render'] = partial(render_shards, num_shards, base_url=base_url)
+    return list(stages.items())
+
+
+def reduce_shards(num_shards, base_url='https://notes.aquiles.me', shard_dir=DEFAULT_SHARD_DIR,
+                  tag_page_size=DEFAULT_TAG_PAGE_SIZE, related=DEFAULT_RELATED, hops=DEFAULT_HOPS):
+    for name, stage in reduce_stages(num_shards, base_url=base_url, shard_dir=shard_dir, tag_page_size=tag_page_size,
+                                     related=related, hops=hops):
+        logger.debug(f'Starting stage {name}')
+        with span(name, cat='stage'):
+            stage()
+
+
+def build_sharded(num_shards, base_url='https://notes.aquiles.me', parse_git=True, shard_dir=DEFAULT_SHARD_DIR,
+                  tag_page_size=DEFAULT_TAG_PAGE_SIZE, related=DEFAULT_RELATED, hops=DEFAULT_HOPS):
+    """ Maps every shard in its own process, in parallel, and reduces them in this one. """
+    processes = []
+    for index in range(num_shards):
+        command = [sys.executable, '-m', 'aqui_brain_dump.shard', 'map', str(index), str(num_shards),
+                   '--shard-dir', str(shard_dir)]
+        if not parse_git:
+            command.append('--no-git')
+        processes.append(subprocess.Popen(command))
+    with span('map', cat='stage'):
+        failed = [index for index, process in enumerate(processes) if process.wait() != 0]
+    if failed:
+        raise RuntimeError(f'Building shards {failed} failed')
+    reduce_shards(num_shards, base_url=base_url, shard_dir=shard_dir, tag_page_size=tag_page_size, related=related,
+                  hops=hops)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the website in shards')
+    subparsers = parser.add_subparsers(dest='command')
+
+    map_parser = subparsers.add_parser('map', help='Parse the notes of one shard')
+    map_parser.add_argument('index', type=int, help='Shard to build, from 0 to count - 1')
+    map_parser.add_argument('count', type=int, help='Number of shards')
+    map_parser.add_argument('--no-git', action='store_true', help='Do not read dates from git')
+
+    reduce_parser = subparsers.add_parser('reduce', help='Merge the shards and render the website')
+    reduce_parser.add_argument('count', type=int, help='Number of shards')
+    reduce_parser.add_argument('base_url', nargs='?', default='https://notes.aquiles.me')
+    reduce_parser.add_argument('--tag-page-size', type=int, default=DEFAULT_TAG_PAGE_SIZE)
+    reduce_parser.add_argument('--related', type=int, default=DEFAULT_RELATED)
+    reduce_parser.add_argument('--hops', type=int, default=DEFAULT_HOPS)
+
+    build_parser = subparsers.add_parser('build', help='Map every shard in parallel and reduce them')
+    build_parser.add_argument('count', type=int, help='Number of shards')
+    build_parser.add_argument('base_url', nargs='?', default='https://notes.aquiles.me')
+    build_parser.add_argument('--no-git', action='store_true', help='Do not read dates from git')
+    build_parser.add_argument('--tag-page-size', type=int, default=DEFAULT_TAG_PAGE_SIZE)
+    build_parser.add_argument('--related', type=int, default=DEFAULT_RELATED)
+    build_parser.add_argument('--hops', type=int, default=DEFAULT_HOPS)
+
+    for sub in (map_parser, reduce_parser, build_parser):
+        sub.add_argument('--shard-dir', default=str(DEFAULT_SHARD_DIR),
+                         help='Folder for the shard files, shared by every machine (default: .garden_cache/shards)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.command == 'map':
+        map_shard(args.index, args.count, shard_dir=args.shard_dir, parse_git=not args.no_git)
+    elif args.command == 'reduce':
+        reduce_shards(args.count, base_url=args.base_url, shard_dir=args.shard_dir,
+                      tag_page_size=args.tag_page_size, related=args.related, hops=args.hops)
+    elif args.command == 'build':
+        build_sharded(args.count, base_url=args.base_url, parse_git=not args.no_git, shard_dir=args.shard_dir,
+                      tag_page_size=args.tag_page_size, related=args.related, hops=args.hops)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,82 +1,67 @@
 """
 Statistics generator for digital garden notes.
 Collects metrics about notes and saves them to track evolution over time.
+The notes, links, tags and citations are read from the garden index (see :mod:`aqui_brain_dump.garden_index`), parsing
+only the notes that changed since it was last updated, or every note with ``reindex``.
 """
 import json
 import logging
-from datetime import datetime, timezone
+from datetime import timezone
 from pathlib import Path
 from collections import Counter
 
-from aqui_brain_dump import content_path
-from aqui_brain_dump.note import Note
+from aqui_brain_dump.garden_index import DEFAULT_INDEX_FILE, open_index
+from aqui_brain_dump.history import record_snapshot
+from aqui_brain_dump.util import now
 
 logger = logging.getLogger(__name__)
 
 
-def count_words(content):
-    """Count words in HTML content (rough estimate)"""
-    if not content:
-        return 0
-    # Simple word count - strip HTML tags and count
-    import re
-    text = re.sub(r'<[^>]+>', '', content)
-    words = text.split()
-    return len(words)
-
-
-def generate_statistics(output_file='stats/garden_stats.json', parse_git=True):
+def generate_statistics(output_file='stats/garden_stats.json', parse_git=True, history_file=None, layout=True,
+                        index_file=DEFAULT_INDEX_FILE, reindex=False):
     """
     Generate comprehensive statistics about the digital garden.
     
     Args:
         output_file: Path to save statistics JSON file
         parse_git: Whether to parse git information for dates
+        history_file: History store to append the snapshot to. Defaults to history.sqlite next to output_file
+        layout: Whether to add the position of every node to the graph, see :mod:`aqui_brain_dump.layout`
+        index_file: Garden index to read the notes from, see :mod:`aqui_brain_dump.garden_index`
+        reindex: Parse every note again instead of only those that changed since the index was updated
     
     Returns:
         dict: Statistics dictionary
     """
     logger.info('Generating digital garden statistics')
-    
-    # Parse all notes
-    import os
-    f_walk = os.walk(content_path)
-    for dirs in f_walk:
-        if 'templates' in dirs[0]:
-            continue
-        logger.debug(f'Processing directory: {dirs[0]}')
-        cur_dir = dirs[0]
-        sub_dir = Path(cur_dir).absolute()
-        
-        if str(sub_dir).startswith('.') or 'templates' in str(sub_dir):
-            continue
-        
-        for file in dirs[2]:
-            if not file.endswith('.md'):
-                continue
-            filepath = Path(cur_dir) / file
-            logger.debug(f'Creating note for statistics: {filepath}')
-            Note.create_from_path(filepath, parse_git=parse_git)
-    
-    # Wait for all parsing to complete
-    import time
-    while len([f for f in Note.futures_executor if f.running()]):
-        time.sleep(.01)
-    Note.note_executor.shutdown(wait=True)
-    
-    # Build backlinks to get complete network data
-    Note.build_backlinks()
-    
+
+    with open_index(index_file, parse_git=parse_git, reindex=reindex) as index:
+        notes = index.query('SELECT url, title, path, words, created FROM notes ORDER BY url')
+        links = index.query('SELECT source, target FROM links ORDER BY source, target')
+        tags = {}
+        for row in index.query('SELECT url, tag FROM tags ORDER BY url, tag'):
+            tags.setdefault(row['url'], []).append(row['tag'])
+        cites = {}
+        for row in index.query('SELECT url, cite FROM cites ORDER BY url, cite'):
+            cites.setdefault(row['url'], []).append(row['cite'])
+        tag_counts = index.query('SELECT tag, COUNT(*) AS notes FROM tags GROUP BY tag ORDER BY tag')
+
+    existing = {note['url'] for note in notes}
+    # Links to notes that do not exist count as notes without content, as the empty pages the build makes for them
+    missing = sorted({link['target'] for link in links} - existing)
+    outgoing = Counter(link['source'] for link in links)
+    incoming = Counter(link['target'] for link in links)
+
     # Collect statistics
     stats = {
-        'timestamp': datetime.now(tz=timezone.utc).isoformat(),
-        'total_notes': 0,
-        'notes_with_content': 0,
+        'timestamp': now(tz=timezone.utc).isoformat(),
+        'total_notes': len(notes) + len(missing),
+        'notes_with_content': len(notes),
         'total_words': 0,
         'total_links': 0,
         'total_backlinks': 0,
-        'total_tags': len(Note.tags_dict),
-        'total_citations': len(Note.lit_notes),
+        'total_tags': len(tag_counts),
+        'total_citations': len({cite for note_cites in cites.values() for cite in note_cites}),
         'longest_note': {'title': None, 'words': 0, 'path': None},
         'shortest_note': {'title': None, 'words': float('inf'), 'path': None},
         'most_connected_note': {'title': None, 'connections': 0, 'path': None},
@@ -87,40 +72,32 @@ def generate_statistics(output_file='stats/garden_stats.json', parse_git=True):
         'notes_by_date': {},
     }
     
-    for url, note in Note.notes.items():
-        # Skip auto-generated notes without content
-        if note.content is None or note.content == '':
-            stats['total_notes'] += 1
-            continue
-        
-        stats['total_notes'] += 1
-        stats['notes_with_content'] += 1
-        
+    for note in notes:
         # Word count
-        word_count = count_words(note.content)
+        word_count = note['words']
         stats['total_words'] += word_count
         
         # Longest note
         if word_count > stats['longest_note']['words']:
             stats['longest_note'] = {
-                'title': note.title,
+                'title': note['title'],
                 'words': word_count,
-                'path': str(note.path),
-                'url': note.url
+                'path': note['path'],
+                'url': note['url']
             }
         
         # Shortest note (only count notes with content)
         if word_count > 0 and word_count < stats['shortest_note']['words']:
             stats['shortest_note'] = {
-                'title': note.title,
+                'title': note['title'],
                 'words': word_count,
-                'path': str(note.path),
-                'url': note.url
+                'path': note['path'],
+                'url': note['url']
             }
         
         # Link statistics
-        num_links = len(note.links) if hasattr(note, 'links') else 0
-        num_backlinks = len(note.backlinks) if hasattr(note, 'backlinks') else 0
+        num_links = outgoing[note['url']]
+        num_backlinks = incoming[note['url']]
         stats['total_links'] += num_links
         stats['total_backlinks'] += num_backlinks
         
@@ -129,94 +106,82 @@ def generate_statistics(output_file='stats/garden_stats.json', parse_git=True):
         # Most connected note
         if total_connections > stats['most_connected_note']['connections']:
             stats['most_connected_note'] = {
-                'title': note.title,
+                'title': note['title'],
                 'connections': total_connections,
                 'links': num_links,
                 'backlinks': num_backlinks,
-                'path': str(note.path),
-                'url': note.url
+                'path': note['path'],
+                'url': note['url']
             }
         
         # Most linked note (most backlinks)
         if num_backlinks > stats['most_linked_note']['backlinks']:
             stats['most_linked_note'] = {
-                'title': note.title,
+                'title': note['title'],
                 'backlinks': num_backlinks,
-                'path': str(note.path),
-                'url': note.url
+                'path': note['path'],
+                'url': note['url']
             }
         
         # Orphaned notes (no backlinks)
         if num_backlinks == 0:
             stats['orphaned_notes'].append({
-                'title': note.title,
-                'path': str(note.path),
-                'url': note.url
+                'title': note['title'],
+                'path': note['path'],
+                'url': note['url']
             })
         
         # Notes without outgoing links
         if num_links == 0:
             stats['notes_without_links'].append({
-                'title': note.title,
-                'path': str(note.path),
-                'url': note.url
+                'title': note['title'],
+                'path': note['path'],
+                'url': note['url']
             })
         
         # Track notes by creation date
-        if hasattr(note, 'creation_date') and note.creation_date:
-            date_str = str(note.creation_date)[:10]  # YYYY-MM-DD
+        if note['created']:
+            date_str = note['created'][:10]  # YYYY-MM-DD
             if date_str not in stats['notes_by_date']:
                 stats['notes_by_date'][date_str] = 0
             stats['notes_by_date'][date_str] += 1
     
     # Tag distribution
-    for tag, notes in Note.tags_dict.items():
-        stats['tag_distribution'][tag] = len(notes)
+    for row in tag_counts:
+        stats['tag_distribution'][f'#{row["tag"]}'] = row['notes']
     
     # Generate graph
     graph = {
         'nodes': [],
         'links': []
     }
-    
-    added_nodes = set()
-    
-    for url, note in Note.notes.items():
-        # Determine group
-        group = 'note'
-        is_tag = False
-        
-        if note.url.startswith('/tags/'):
-            group = 'tag'
-            is_tag = True
-        elif hasattr(note, 'tags') and note.tags:
-            group = list(note.tags)[0].lower()
-            
-        # A note is considered to "exist" if it has content AND it's not simply an auto-generated tag page
-        exists = note.content is not None and note.content != ''
-        if is_tag:
-            exists = True # We consider tags to always exist for coloring purposes as requested
-            
+
+    nodes = [dict(note, exists=True) for note in notes]
+    nodes += [{'url': url, 'title': url.strip('/').replace('_', ' ').capitalize(), 'words': 0, 'exists': False}
+              for url in missing]
+    for node in sorted(nodes, key=lambda node: node['url']):
+        url = node['url']
+        node_tags = tags.get(url, [])
         graph['nodes'].append({
-            'id': note.url,
-            'title': note.title,
-            'group': group,
-            'exists': exists,
-            'is_tag': is_tag,
-            'word_count': count_words(note.content),
-            'connections': len(getattr(note, 'links', [])) + len(getattr(note, 'backlinks', []))
+            'id': url,
+            'title': node['title'],
+            'group': f'#{min(node_tags)}' if node_tags else 'note',
+            'exists': node['exists'],
+            'is_tag': False,
+            'word_count': node['words'],
+            'connections': outgoing[url] + incoming[url],
+            'tags': node_tags,
+            'cites': cites.get(url, [])
+        })
+
+    for link in links:
+        graph['links'].append({
+            'source': link['source'],
+            'target': link['target']
         })
-        added_nodes.add(note.url)
-        
-    for url, note in Note.notes.items():
-        for link in getattr(note, 'links', []):
-            linked_note = Note.notes.get(link)
-            if linked_note:
-                graph['links'].append({
-                    'source': note.url,
-                    'target': linked_note.url
-                })
     
+    stats['notes_by_date'] = dict(sorted(stats['notes_by_date'].items()))
+
     # Calculate averages
     if stats['notes_with_content'] > 0:
         stats['avg_words_per_note'] = round(stats['total_words'] / stats['notes_with_content'], 2)
@@ -240,24 +205,19 @@ def generate_statistics(output_file='stats/garden_stats.json', parse_git=True):
     
     logger.info(f'Statistics saved to {output_path}')
     
-    # Save graph
+    # Save graph, laid out starting from the positions of the previous one
     graph_path = output_path.parent / 'garden_graph.json'
+    if layout:
+        from aqui_brain_dump.layout import add_layout
+
+        add_layout(graph, previous_file=graph_path)
     with open(graph_path, 'w', encoding='utf-8') as f:
         json.dump(graph, f, indent=2, ensure_ascii=False)
         
     logger.info(f'Graph saved to {graph_path}')
     
-    # Also save a timestamped version for historical tracking
-    timestamp = datetime.now(tz=timezone.utc).strftime('%Y%m%d_%H%M%S')
-    historical_path = output_path.parent / f'garden_stats_{timestamp}.json'
-    with open(historical_path, 'w', encoding='utf-8') as f:
-        json.dump(stats, f, indent=2, ensure_ascii=False)
-    
-    historical_graph_path = output_path.parent / f'garden_graph_{timestamp}.json'
-    with open(historical_graph_path, 'w', encoding='utf-8') as f:
-        json.dump(graph, f, indent=2, ensure_ascii=False)
-    
-    logger.info(f'Historical snapshot saved to {historical_path} and {historical_graph_path}')
+    # Also append a snapshot to the history store for historical tracking
+    record_snapshot('stats', stats, graph=graph, history_file=history_file or output_path.parent / 'history.sqlite')
     
     return stats
 
@@ -0,0 +1,120 @@
+"""
+Tag hierarchy and tag pages.
+Tags can be nested with ``/``: ``#physics/optics`` is a child of ``#physics``. Every tag knows the notes tagged with it
+directly and, rolled up, the notes tagged with it or with any of its descendants. Parents that are never used on their
+own still get a page.
+
+The rollups are computed once, in a single pass from the deepest tags up, so rendering a page only slices a list that
+is already sorted. Tag pages are split in pages of ``page_size`` notes::
+
+    /tags/physics           notes 1 to page_size
+    /tags/physics/page/2    the next page_size notes
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 50
+
+
+class Tag:
+    """ A tag in the hierarchy.
+
+    :param name: Name without ``#``, lowercase, e.g. ``physics/optics``
+    """
+    def __init__(self, name):
+        self.name = name
+        self.parent = None
+        self.children = []
+        # Notes tagged with exactly this tag
+        self.notes = []
+        # Notes tagged with this tag or any of its descendants, sorted by title
+        self.members = []
+
+    @property
+    def depth(self):
+        return self.name.count('/')
+
+    @property
+    def label(self):
+        """ Last part of the name, e.g. ``optics`` for ``physics/optics``. """
+        return self.name.rsplit('/', 1)[-1]
+
+    @property
+    def url(self):
+        return tag_page_url(self.name)
+
+    @property
+    def count(self):
+        return len(self.members)
+
+    def __repr__(self):
+        return f'<Tag {self.name} ({len(self.notes)}/{len(self.members)})>'
+
+
+def tag_name(tag):
+    """ Normalizes a tag as found in a note (``#Physics/Optics/``) to its name in the hierarchy (``physics/optics``).
+    """
+    return '/'.join(part for part in tag.strip('#').lower().split('/') if part)
+
+
+def tag_page_url(name, page=1):
+    if page > 1:
+        return f'/tags/{name}/page/{page}'
+    return f'/tags/{name}'
+
+
+def _sort_key(note):
+    return str(note.title).lower(), note.url
+
+
+def build_tag_tree(tags_dict):
+    """
+    Builds the hierarchy of tags and rolls up the notes of every tag into its ancestors.
+
+    Args:
+        tags_dict: Dictionary of tag -> list of notes, as ``Note.tags_dict``
+
+    Returns:
+        dict: name -> :class:`Tag` for every tag and every ancestor of a tag, sorted by name
+    """
+    tags = {}
+
+    def get(name):
+        tag = tags.get(name)
+        if tag is None:
+            tag = tags[name] = Tag(name)
+            if '/' in name:
+                tag.parent = get(name.rsplit('/', 1)[0])
+                tag.parent.children.append(tag)
+        return tag
+
+    direct = {}
+    for raw, notes in tags_dict.items():
+        name = tag_name(raw)
+        if not name:
+            continue
+        get(name)
+        members = direct.setdefault(name, {})
+        for note in notes:
+            members[note.url] = note
+
+    # Deepest first, so that every tag is complete before it is merged into its parent
+    rolled = {name: dict(direct.get(name, {})) for name in tags}
+    for name in sorted(tags, key=lambda n: n.count('/'), reverse=True):
+        tag = tags[name]
+        tag.notes = sorted(direct.get(name, {}).values(), key=_sort_key)
+        members = rolled.pop(name)
+        tag.members = sorted(members.values(), key=_sort_key)
+        tag.children.sort(key=lambda t: t.name)
+        if tag.parent is not None:
+            rolled[tag.parent.name].update(members)
+    return dict(sorted(tags.items()))
+
+
+def paginate(items, page_size=DEFAULT_PAGE_SIZE):
+    """ Splits a list in pages of ``page_size`` items. Always returns at least one (maybe empty) page. A page size of
+    0 or None means a single page. """
+    if not page_size or len(items) <= page_size:
+        return [list(items)]
+    return [items[i:i + page_size] for i in range(0, len(items), page_size)]
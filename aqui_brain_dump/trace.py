@@ -0,0 +1,193 @@
+"""
+Build tracing.
+Records how long each stage of a build takes, and each note inside it, as spans that can be opened in
+``chrome://tracing`` or https://ui.perfetto.dev, plus a summary of the slowest stages and notes.
+
+Tracing is off unless :func:`enable` is called (``brain_dump --profile``). While it is off, :func:`span` returns a
+shared no-op context manager, so the instrumented code only pays for one function call and one ``None`` check.
+
+Spans have a category that the summary relies on:
+
+- ``stage``: one per build stage (discover, backlinks, render, ...)
+- ``note``: work done for a single note (parse, git, render). The ``note`` argument names it
+- anything else: finer steps inside a note (frontmatter, markdown, extensions, beautifulsoup, write)
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+_NULL_SPAN = nullcontext()
+
+
+class Tracer:
+    """ Collects finished spans in memory, in the Chrome trace event format. """
+    def __init__(self):
+        self.events = []
+        self.start = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    @contextmanager
+    def span(self, name, cat, args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            # list.append is atomic, so spans from the git executor threads need no lock
+            self.events.append({
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': (start - self.start) / 1000,
+                'dur': (end - start) / 1000,
+                'pid': self.pid,
+                'tid': threading.get_ident(),
+                'args': args,
+            })
+
+
+def enable():
+    """ Starts recording spans, discarding any recorded before. """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def disable():
+    """ Stops recording and returns the tracer with everything recorded so far, or None. """
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def span(name, cat='step', **args):
+    """ Context manager that records the time spent inside it, if tracing is enabled. """
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, cat, args)
+
+
+def traced(name, cat='step'):
+    """ Decorator version of :func:`span`. """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name, cat, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_markdown(md):
+    """ Wraps every pre-, block-, tree-, inline- and postprocessor of a Markdown instance in a span, so the time of
+    each extension shows in the trace. Does nothing if tracing is off or the instance is already instrumented.
+    """
+    if _tracer is None or getattr(md, '_traced', False):
+        return md
+    registries = [
+        ('preprocessor', md.preprocessors, 'run'),
+        ('blockprocessor', md.parser.blockprocessors, 'run'),
+        ('treeprocessor', md.treeprocessors, 'run'),
+        ('inlinepattern', md.inlinePatterns, 'handleMatch'),
+        ('postprocessor', md.postprocessors, 'run'),
+    ]
+    for kind, registry, method in registries:
+        for item in registry._data.values():
+            name = f'{kind}:{type(item).__name__}'
+            original = getattr(item, method)
+            setattr(item, method, _wrap(original, name))
+    md._traced = True
+    return md
+
+
+def _wrap(func, name):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if _tracer is None:
+            return func(*args, **kwargs)
+        with _tracer.span(name, 'markdown', {}):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def write_chrome_trace(tracer, output_file):
+    """ Saves the spans as a Chrome trace JSON file. """
+    output_path = Path(output_file)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    thread_names = {threading.main_thread().ident: 'main'}
+    metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': tracer.pid, 'tid': tid, 'args': {'name': name}}
+                for tid, name in thread_names.items()]
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': metadata + tracer.events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+    logger.info(f'Trace with {len(tracer.events)} spans saved to {output_path}')
+    return output_path
+
+
+def summarize(tracer, top=10):
+    """
+    Aggregates the spans of a tracer.
+
+    Args:
+        tracer: A :class:`Tracer`
+        top: How many notes and steps to keep
+
+    Returns:
+        dict: ``stages`` (name -> seconds, in order), ``steps`` (name -> count and seconds, slowest first) and
+        ``notes`` (note -> seconds spent on its parse, git and render spans, slowest first)
+    """
+    stages = {}
+    steps = {}
+    notes = {}
+    for event in tracer.events:
+        seconds = event['dur'] / 1e6
+        if event['cat'] == 'stage':
+            stages[event['name']] = stages.get(event['name'], 0) + seconds
+            continue
+        step = steps.setdefault(event['name'], {'count': 0, 'seconds': 0})
+        step['count'] += 1
+        step['seconds'] += seconds
+        if event['cat'] == 'note':
+            note = str(event['args'].get('note'))
+            notes[note] = notes.get(note, 0) + seconds
+    return {
+        'stages': stages,
+        'steps': dict(sorted(steps.items(), key=lambda x: x[1]['seconds'], reverse=True)[:top]),
+        'notes': dict(sorted(notes.items(), key=lambda x: x[1], reverse=True)[:top]),
+    }
+
+
+def print_profile_summary(summary):
+    """Print a human-readable summary of a build profile"""
+    print('\n' + '='*60)
+    print('BUILD PROFILE')
+    print('='*60)
+
+    total = sum(summary['stages'].values())
+    print(f'\n⏱️  STAGES ({total:.3f}s total):')
+    for name, seconds in summary['stages'].items():
+        share = seconds / total if total else 0
+        print(f'  {name:<14} {seconds:8.3f}s {share:6.1%}')
+
+    print('\n🔬 SLOWEST STEPS (summed over all notes and threads):')
+    for name, step in summary['steps'].items():
+        print(f'  {name:<40} {step["seconds"]:8.3f}s  x{step["count"]}')
+
+    print('\n🐢 SLOWEST NOTES:')
+    for note, seconds in summary['notes'].items():
+        print(f'  {seconds:8.3f}s  {note}')
+
+    print('\n' + '='*60 + '\n')
@@ -1,3 +1,7 @@
+import datetime
+import os
+import re
+import sys
 from pathlib import Path
 
 INVALID_FILENAME_CHARS = set('<>:"|?*')
@@ -8,6 +12,16 @@ def has_invalid_filename_chars(name: str):
     return bool(found), found
 
 
+def count_words(content):
+    """Count words in HTML content (rough estimate)"""
+    if not content:
+        return 0
+    # Simple word count - strip HTML tags and count
+    text = re.sub(r'<[^>]+>', '', content)
+    words = text.split()
+    return len(words)
+
+
 def path_to_url(filename: Path, content_dir: Path = None) -> str:
     """Transforms a file path to a URL by following some simple rules such as transforming spaces to _ and setting all the characters to lowercase."""
     if content_dir is not None:
@@ -27,3 +41,43 @@ def path_to_url(filename: Path, content_dir: Path = None) -> str:
         url += '/'
     return url
 
+
+
+def peak_memory_mb():
+    """Returns the peak resident memory of the current process in MB, or None where the platform does not report it."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def source_date_epoch():
+    """Returns the timestamp set in the ``SOURCE_DATE_EPOCH`` environment variable as an int, or None if not set."""
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if not value:
+        return None
+    return int(value)
+
+
+def now(tz=None):
+    """Like ``datetime.now(tz)``, but pinned to ``SOURCE_DATE_EPOCH`` when it is set, so that builds are reproducible.
+
+    Without ``tz`` a naive datetime is returned, in UTC if pinned and in local time otherwise.
+    """
+    epoch = source_date_epoch()
+    if epoch is None:
+        return datetime.datetime.now(tz=tz)
+    pinned = datetime.datetime.fromtimestamp(epoch, tz=datetime.timezone.utc)
+    if tz is None:
+        return pinned.replace(tzinfo=None)
+    return pinned.astimezone(tz)
+
+
+def today():
+    """Like ``date.today()``, but pinned to ``SOURCE_DATE_EPOCH`` when it is set."""
+    return now().date()
@@ -0,0 +1,87 @@
+"""
+Frontmatter benchmark
+=====================
+
+Compares ``python-frontmatter`` with :mod:`aqui_brain_dump.parse_frontmatter` on every note of a garden. The notes are
+read into memory first, so only parsing is timed. Both must give the same metadata and content for every note, or the
+benchmark fails (exit code 1)::
+
+    # A synthetic garden of 2000 notes
+    python benchmarks/frontmatter_parser.py
+
+    # A real garden
+    python benchmarks/frontmatter_parser.py --garden ~/notes
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).absolute().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+sys.path.insert(0, str(REPO_DIR))
+
+from synthetic_garden import GardenGenerator  # noqa: E402
+
+
+def best_time(parse, texts, repeats):
+    """ Fastest of ``repeats`` passes over every text, in seconds. """
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for text in texts:
+            parse(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare python-frontmatter with the fast frontmatter reader')
+    parser.add_argument('--garden', help='Garden to read. Defaults to a synthetic garden')
+    parser.add_argument('--notes', type=int, default=2000, help='Notes of the synthetic garden (default: 2000)')
+    parser.add_argument('--repeats', type=int, default=3, help='Passes over the notes, the fastest counts (default: 3)')
+    args = parser.parse_args()
+
+    import frontmatter
+    from aqui_brain_dump import parse_frontmatter
+
+    with tempfile.TemporaryDirectory() as tmp:
+        garden = args.garden
+        if garden is None:
+            garden = GardenGenerator(notes=args.notes).write(Path(tmp) / 'garden')
+        files = sorted((Path(garden) / 'content').rglob('*.md'))
+        texts = [file.read_text(encoding='utf-8') for file in files]
+    if not texts:
+        print(f'No notes found in {garden}')
+        sys.exit(1)
+
+    different = [str(file) for file, text in zip(files, texts)
+                 if frontmatter.parse(text) != parse_frontmatter.parse(text)]
+    fast = 0
+    for text in texts:
+        try:
+            _, fm, _ = parse_frontmatter.FM_BOUNDARY.split(text.strip(), 2)
+            parse_frontmatter._parse_flat(fm)
+            fast += 1
+        except (ValueError, parse_frontmatter._Complex):
+            pass
+
+    reference = best_time(frontmatter.parse, texts, args.repeats)
+    current = best_time(parse_frontmatter.parse, texts, args.repeats)
+    print(f'{len(texts)} notes, {fast} ({fast / len(texts):.0%}) with a flat header')
+    print(f'  python-frontmatter: {reference * 1e6 / len(texts):8.1f} us per note ({reference:.3f}s)')
+    print(f'  parse_frontmatter:  {current * 1e6 / len(texts):8.1f} us per note ({current:.3f}s)')
+    print(f'  {reference / current:.1f}x faster, {(reference - current) * 1e6 / len(texts):.1f} us saved per note')
+
+    if different:
+        print(f'FAIL: {len(different)} notes parsed differently:')
+        for file in different[:20]:
+            print(f'  {file}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Reproducibility check
+=====================
+
+Builds the same garden twice, in fresh interpreters with different hash seeds and with ``SOURCE_DATE_EPOCH`` pinned,
+and checks that both outputs are byte-identical. Any file that differs, or exists in only one of the builds, is
+listed and the check fails (exit code 1)::
+
+    # A synthetic garden of 500 notes
+    python benchmarks/reproducible.py
+
+    # A real garden
+    python benchmarks/reproducible.py --garden ~/notes
+
+    # The second build sharded in 4 processes, which must give the same output as a single-process build
+    python benchmarks/reproducible.py --shards 4
+"""
+import argparse
+import filecmp
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).absolute().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from synthetic_garden import GardenGenerator  # noqa: E402
+
+IGNORED = shutil.ignore_patterns('output', '.garden_cache', 'logger.log')
+
+
+def build(garden, workdir, hash_seed, epoch, parse_git, shards=None):
+    """ Copies the garden to ``workdir``, builds it there and returns the output folder. """
+    shutil.copytree(garden, workdir, ignore=IGNORED)
+    env = dict(os.environ, PYTHONHASHSEED=str(hash_seed), SOURCE_DATE_EPOCH=str(epoch))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(REPO_DIR), env.get('PYTHONPATH')]))
+    command = [sys.executable, '-m', 'aqui_brain_dump', 'https://example.com']
+    if not parse_git:
+        command.append('no_git')
+    if shards:
+        command += ['--shards', str(shards)]
+    subprocess.run(command, cwd=workdir, env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return Path(workdir) / 'output'
+
+
+def compare_trees(a, b, relative=Path('.')):
+    """ Returns the relative paths of the files that differ or exist in only one of the two folders. """
+    comparison = filecmp.dircmp(a, b)
+    different = [relative / name for name in comparison.left_only + comparison.right_only]
+    _, mismatch, errors = filecmp.cmpfiles(a, b, comparison.common_files, shallow=False)
+    different += [relative / name for name in mismatch + errors]
+    for sub in comparison.common_dirs:
+        different += compare_trees(Path(a) / sub, Path(b) / sub, relative / sub)
+    return sorted(different)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that two builds of the same garden are byte-identical')
+    parser.add_argument('--garden', help='Garden to build. Defaults to a synthetic garden')
+    parser.add_argument('--notes', type=int, default=500, help='Notes of the synthetic garden (default: 500)')
+    parser.add_argument('--epoch', type=int, default=1700000000,
+                        help='SOURCE_DATE_EPOCH for both builds (default: 1700000000)')
+    parser.add_argument('--git', action='store_true', help='Read dates from git during the builds')
+    parser.add_argument('--shards', type=int, help='Build the second time in this many shards')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        garden = args.garden
+        if garden is None:
+            garden = GardenGenerator(notes=args.notes).write(tmp / 'garden')
+        first = build(garden, tmp / 'first', hash_seed=1, epoch=args.epoch, parse_git=args.git)
+        second = build(garden, tmp / 'second', hash_seed=2, epoch=args.epoch, parse_git=args.git,
+                       shards=args.shards)
+        different = compare_trees(first, second)
+
+    if different:
+        print(f'{len(different)} file(s) differ between two builds:')
+        for path in different[:50]:
+            print(f'  {path}')
+        sys.exit(1)
+    print('Both builds are byte-identical')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+"""
+Build benchmarks
+================
+
+Times every stage of ``brain_dump`` and the ``garden_tools`` analyses on synthetic gardens of several sizes, and
+compares results between runs::
+
+    # Time everything at the default scales and save the results
+    python benchmarks/run.py run --output benchmarks/results/current.json
+
+    # Only small gardens, only the build
+    python benchmarks/run.py run --scales 1000 --targets build
+
+    # The largest garden, built with --low-memory, must stay under 500 MB
+    python benchmarks/run.py run --scales 50000 --targets build_low_memory --max-memory 500
+
+    # Fail if any stage got more than 20% slower (or any target used 20% more memory) than in the baseline
+    python benchmarks/run.py compare benchmarks/results/baseline.json benchmarks/results/current.json
+
+Gardens are generated once per scale and seed, and kept in ``--workdir`` for later runs. Every target runs in its own
+interpreter, started inside the garden folder, so that runs do not share state, and the peak memory of that
+interpreter is recorded next to the timings.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS_DIR = Path(__file__).absolute().parent
+REPO_DIR = BENCHMARKS_DIR.parent
+sys.path.insert(0, str(BENCHMARKS_DIR))
+
+from synthetic_garden import GardenGenerator  # noqa: E402
+
+TARGETS = ['build', 'build_low_memory', 'stats', 'links', 'diff']
+DEFAULT_SCALES = [1000, 10000, 50000]
+
+
+def time_build(parse_git, low_memory=False):
+    from aqui_brain_dump.__main__ import build_stages
+
+    timings = {}
+    for name, stage in build_stages(base_url='https://example.com', parse_git=parse_git, low_memory=low_memory):
+        start = time.perf_counter()
+        stage()
+        timings[name] = time.perf_counter() - start
+    return timings
+
+
+def time_build_low_memory(parse_git):
+    return time_build(parse_git, low_memory=True)
+
+
+def time_stats(parse_git):
+    from aqui_brain_dump.stats import generate_statistics
+
+    start = time.perf_counter()
+    generate_statistics(output_file='stats/garden_stats.json', parse_git=parse_git)
+    return {'run': time.perf_counter() - start}
+
+
+def time_links(parse_git):
+    from aqui_brain_dump.analyze_links import analyze_internal_links
+
+    start = time.perf_counter()
+    analyze_internal_links(output_file='stats/link_analysis.json', parse_git=parse_git)
+    return {'run': time.perf_counter() - start}
+
+
+def time_diff(parse_git):
+    from aqui_brain_dump.graph_diff import diff_graph_files
+
+    if not Path('stats/garden_graph.json').exists():
+        time_stats(parse_git)
+    start = time.perf_counter()
+    diff_graph_files('stats/garden_graph.json', 'stats/garden_graph.json')
+    return {'run': time.perf_counter() - start}
+
+
+def worker(args):
+    """ Runs one target inside the garden folder and prints its timings and peak memory as JSON. """
+    os.chdir(args.garden)
+    sys.path.insert(0, str(REPO_DIR))
+    start = time.perf_counter()
+    import aqui_brain_dump  # noqa: F401
+    timings = {'import': time.perf_counter() - start}
+    timings.update(globals()[f'time_{args.target}'](args.git))
+    timings['total'] = sum(timings.values())
+    from aqui_brain_dump.util import peak_memory_mb
+    print(json.dumps({'timings': timings, 'peak_memory_mb': peak_memory_mb()}))
+
+
+def garden_path(workdir, scale, seed, git_commits):
+    path = Path(workdir) / f'garden_{scale}_{seed}_{git_commits}'
+    if not (path / 'content').exists():
+        print(f'Generating garden with {scale} notes in {path}', file=sys.stderr)
+        GardenGenerator(notes=scale, seed=seed).write(path, git_commits=git_commits)
+    return path
+
+
+def run(args):
+    results = {
+        'meta': {
+            'timestamp': datetime.now(tz=timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'commit': subprocess.run(['git', '-C', str(REPO_DIR), 'rev-parse', '--short', 'HEAD'],
+                                     stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode().strip(),
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'git': args.git,
+        },
+        'results': {},
+        'memory': {},
+    }
+    over_budget = []
+    for scale in args.scales:
+        path = garden_path(args.workdir, scale, args.seed, args.git_commits)
+        results['results'][str(scale)] = {}
+        results['memory'][str(scale)] = {}
+        for target in args.targets:
+            runs = []
+            for _ in range(args.repeat):
+                command = [sys.executable, str(Path(__file__).absolute()), 'worker', str(path), target]
+                if args.git:
+                    command.append('--git')
+                proc = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+                runs.append(json.loads(proc.stdout.decode().strip().splitlines()[-1]))
+            # Keep the fastest run of each stage, the least affected by noise
+            best = {stage: min(r['timings'][stage] for r in runs) for stage in runs[0]['timings']}
+            results['results'][str(scale)][target] = best
+            memory = runs[0]['peak_memory_mb']
+            if memory is not None:
+                memory = max(r['peak_memory_mb'] for r in runs)
+                results['memory'][str(scale)][target] = memory
+            print(f'{scale:>7} notes  {target:<6} ' +
+                  '  '.join(f'{stage}={seconds:.3f}s' for stage, seconds in best.items()) +
+                  (f'  memory={memory:.0f}MB' if memory is not None else ''))
+            if args.max_memory and memory is not None and memory > args.max_memory:
+                over_budget.append((scale, target, memory))
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f'Results saved to {output}')
+
+    if over_budget:
+        for scale, target, memory in over_budget:
+            print(f'{scale} notes {target} used {memory:.0f} MB, over the budget of {args.max_memory:.0f} MB')
+        sys.exit(1)
+
+
+def compare(args):
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline_data = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current_data = json.load(f)
+    baseline = baseline_data['results']
+    current = current_data['results']
+
+    regressions = []
+    for scale, targets in current.items():
+        for target, stages in targets.items():
+            for stage, seconds in stages.items():
+                base = baseline.get(scale, {}).get(target, {}).get(stage)
+                if base is None:
+                    continue
+                change = (seconds - base) / base if base > 0 else 0
+                flag = ''
+                if change > args.threshold and seconds - base > args.min_delta:
+                    flag = '  REGRESSION'
+                    regressions.append((scale, target, stage))
+                print(f'{scale:>7} {target:<6} {stage:<12} {base:8.3f}s -> {seconds:8.3f}s {change:+7.1%}{flag}')
+
+    for scale, targets in current_data.get('memory', {}).items():
+        for target, memory in targets.items():
+            base = baseline_data.get('memory', {}).get(scale, {}).get(target)
+            if not base:
+                continue
+            change = (memory - base) / base
+            flag = ''
+            if change > args.threshold:
+                flag = '  REGRESSION'
+                regressions.append((scale, target, 'memory'))
+            print(f'{scale:>7} {target:<6} {"memory":<12} {base:7.0f}MB -> {memory:7.0f}MB {change:+7.1%}{flag}')
+
+    if regressions:
+        print(f'\n{len(regressions)} stage(s) slower or bigger than {args.threshold:.0%} over the baseline')
+        sys.exit(1)
+    print('\nNo regressions')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark brain_dump and garden_tools on synthetic gardens')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                            help='Garden sizes in notes (default: 1000 10000 50000)')
+    run_parser.add_argument('--targets', nargs='+', choices=TARGETS, default=TARGETS,
+                            help='What to time (default: all)')
+    run_parser.add_argument('--repeat', type=int, default=1, help='Runs per target, the fastest is kept (default: 1)')
+    run_parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic gardens (default: 0)')
+    run_parser.add_argument('--git', action='store_true', help='Parse git information during the runs')
+    run_parser.add_argument('--git-commits', type=int, default=0,
+                            help='Give the synthetic gardens a git history with this many commits (default: 0)')
+    run_parser.add_argument('--workdir', default=str(BENCHMARKS_DIR / 'gardens'),
+                            help='Where synthetic gardens are kept (default: benchmarks/gardens)')
+    run_parser.add_argument('--max-memory', type=float,
+                            help='Fail if the peak memory of any target is above this many MB')
+    run_parser.add_argument('-o', '--output', help='Save the results as JSON to this file')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline', help='Results to compare against')
+    compare_parser.add_argument('current', help='New results')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='Relative slowdown that counts as a regression (default: 0.2)')
+    compare_parser.add_argument('--min-delta', type=float, default=0.05,
+                                help='Ignore slowdowns smaller than this many seconds (default: 0.05)')
+    compare_parser.set_defaults(func=compare)
+
+    worker_parser = subparsers.add_parser('worker')
+    worker_parser.add_argument('garden')
+    worker_parser.add_argument('target', choices=TARGETS)
+    worker_parser.add_argument('--git', action='store_true')
+    worker_parser.set_defaults(func=worker)
+
+    args = parser.parse_args()
+    if not args.command:
+        parser.print_help()
+        sys.exit(1)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup benchmark
+=================
+
+Guards the time it takes to start the command line tools. It runs ``garden_tools --help`` a few times in fresh
+interpreters and uses ``python -X importtime`` to check which modules are imported on the way.
+
+The startup time of a bare interpreter is measured first and subtracted, so the budget covers what this package adds
+on top of Python itself. The check fails (exit code 1) if that is above the budget, or if any of the heavy dependencies
+that should only be imported when notes are actually built shows up::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget 0.15 --runs 10
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['bs4', 'markdown', 'jinja2', 'pygments', 'networkx', 'requests', 'frontmatter', 'yaml']
+
+COMMANDS = {
+    'garden_tools --help': [sys.executable, '-m', 'aqui_brain_dump.garden_tools', '--help'],
+}
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def imported_modules(command):
+    """ Returns a dictionary of top-level module -> cumulative import time in microseconds. """
+    result = subprocess.run([command[0], '-X', 'importtime'] + command[1:],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE)
+    modules = {}
+    for line in result.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip().split('.')[0]
+        modules[name] = max(modules.get(name, 0), int(cumulative))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the startup time of the command line tools')
+    parser.add_argument('--budget', type=float, default=0.1,
+                        help='Maximum time in seconds on top of a bare interpreter for the fastest run (default: 0.1)')
+    parser.add_argument('--runs', type=int, default=5, help='Number of runs per command (default: 5)')
+    args = parser.parse_args()
+
+    baseline = min(time_command([sys.executable, '-c', 'pass'], args.runs))
+    print(f'Bare interpreter: {baseline * 1000:.1f} ms')
+
+    failed = False
+    for name, command in COMMANDS.items():
+        timings = time_command(command, args.runs)
+        best = min(timings)
+        print(f'{name}: best {best * 1000:.1f} ms, median {statistics.median(timings) * 1000:.1f} ms, '
+              f'{(best - baseline) * 1000:.1f} ms over the interpreter (budget {args.budget * 1000:.0f} ms)')
+        if best - baseline > args.budget:
+            print(f'  FAIL: {name} is over budget')
+            failed = True
+
+        modules = imported_modules(command)
+        slowest = sorted(modules.items(), key=lambda x: x[1], reverse=True)[:5]
+        for module, cumulative in slowest:
+            print(f'  {module}: {cumulative / 1000:.1f} ms')
+        heavy = [m for m in HEAVY_MODULES if m in modules]
+        if heavy:
+            print(f'  FAIL: {name} imports {", ".join(heavy)}')
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Synthetic garden generator
+==========================
+
+Writes a reproducible garden that looks like a real one: notes of varying length spread over folders, wikilinks that
+favour a few popular notes, tags (some nested), citations with a matching CSL Json bibliography, images, code fences
+and, optionally, a git history. It also writes the minimal templates and static files that ``brain_dump`` needs::
+
+    python benchmarks/synthetic_garden.py /tmp/garden --notes 10000
+    python benchmarks/synthetic_garden.py /tmp/garden --notes 1000 --git-commits 20
+
+The same arguments and seed always produce the same garden.
+"""
+import argparse
+import json
+import random
+import shutil
+import subprocess
+from pathlib import Path
+
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ze', 'pa', 'qui', 'do', 'fe', 'gu', 'ha', 'jo', 'be',
+             'cy', 'wa', 'xi', 'an', 'el', 'is', 'on', 'ur', 'tra', 'ste', 'pli', 'mor', 'gan']
+
+CODE_SNIPPETS = {
+    'python': 'def {name}(values):\n    total = 0\n    for value in values:\n        total += value * {n}\n    return total\n',
+    'javascript': 'function {name}(values) {{\n  return values.map(v => v * {n}).reduce((a, b) => a + b, 0);\n}}\n',
+    'bash': 'for f in *.md; do\n  echo "{name} $f" | wc -c  # {n}\ndone\n',
+}
+
+NOTE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{{ note.title }}</title>
+<link rel="stylesheet" href="{{ 'css/style.css'|asset }}"></head>
+<body><h1>{{ note.title }}</h1>
+{% if note.content %}{{ note.content }}{% endif %}
+<ul>{% for backlink in note.backlinks %}<li><a href="{{ backlink.url }}">{{ backlink.title }}</a>
+{{ note.backlink_snippet(backlink)|e }}</li>{% endfor %}</ul>
+</body></html>
+"""
+
+LIT_NOTE_TEMPLATE = """<!DOCTYPE html>
+<html><head><title>{{ note.title }}</title></head>
+<body><h1>{{ note.title }}</h1>
+<ul>{% for backlink in note.backlinks %}<li><a href="{{ backlink.url }}">{{ backlink.title }}</a></li>{% endfor %}</ul>
+</body></html>
+"""
+
+# Smallest valid PNG, used for every image
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+class GardenGenerator:
+    """
+    Generates a synthetic garden.
+
+    Args:
+        notes: Number of notes
+        words: Median number of words per note. Sizes follow a log-normal distribution around it
+        links: Mean number of wikilinks per note. Targets follow a power law, so a few notes become hubs
+        missing_links: Fraction of wikilinks that point to notes that do not exist
+        tags: Number of distinct tags, a fifth of them nested as ``parent/child``
+        tags_per_note: Mean number of tags per note
+        citations: Number of entries in the bibliography
+        cite_probability: Probability that a note cites something
+        image_probability: Probability that a note embeds an image
+        code_probability: Probability that a note has a code fence
+        folders: Number of folders the notes are spread over
+        seed: Random seed
+    """
+    def __init__(self, notes=1000, words=300, links=5, missing_links=0.05, tags=200, tags_per_note=1.5,
+                 citations=500, cite_probability=0.2, image_probability=0.1, code_probability=0.2, folders=20,
+                 seed=0):
+        self.num_notes = notes
+        self.words = words
+        self.links = links
+        self.missing_links = missing_links
+        self.num_tags = tags
+        self.tags_per_note = tags_per_note
+        self.num_citations = citations
+        self.cite_probability = cite_probability
+        self.image_probability = image_probability
+        self.code_probability = code_probability
+        self.folders = folders
+        self.random = random.Random(seed)
+
+        self.vocabulary = [self.word() for _ in range(5000)]
+        self.titles = self.unique_titles(notes)
+        self.paths = [self.note_path(i) for i in range(notes)]
+        self.tags = self.make_tags()
+        self.cite_keys = [f'{self.word()}{1950 + i % 75}{i}' for i in range(citations)]
+
+    def word(self):
+        return ''.join(self.random.choice(SYLLABLES) for _ in range(self.random.randint(1, 4)))
+
+    def unique_titles(self, n):
+        titles, seen = [], set()
+        while len(titles) < n:
+            title = ' '.join(self.word() for _ in range(self.random.randint(2, 4))).capitalize()
+            if title.lower() not in seen:
+                seen.add(title.lower())
+                titles.append(title)
+        return titles
+
+    def note_path(self, i):
+        name = self.titles[i].replace(' ', '_').lower() + '.md'
+        if self.folders and i % 3:
+            return f'folder_{i % self.folders}/{name}'
+        return name
+
+    def make_tags(self):
+        tags = [self.word() for _ in range(max(1, self.num_tags * 4 // 5))]
+        nested = [f'{self.random.choice(tags)}/{self.word()}' for _ in range(self.num_tags - len(tags))]
+        return tags + nested
+
+    def sentence(self):
+        return ' '.join(self.random.choice(self.vocabulary) for _ in range(self.random.randint(6, 18))).capitalize()
+
+    def link_target(self):
+        if self.random.random() < self.missing_links:
+            return ' '.join(self.word() for _ in range(2)).capitalize()
+        # Power law: low indices are picked much more often, and become hubs
+        i = min(int(self.random.paretovariate(1.2)) - 1, self.num_notes - 1)
+        return self.titles[i]
+
+    def note(self, i):
+        rnd = self.random
+        num_words = max(20, int(rnd.lognormvariate(0, 0.8) * self.words))
+        num_links = int(rnd.expovariate(1 / self.links)) if self.links else 0
+        num_tags = int(rnd.expovariate(1 / self.tags_per_note)) if self.tags_per_note else 0
+
+        lines = ['---', f'title: {self.titles[i]}']
+        if rnd.random() < 0.3:
+            lines.append(f'description: {self.sentence()}')
+        if rnd.random() < 0.1:
+            lines += ['aliases:', f'  - {self.titles[i]} alias']
+        lines += ['---', '', f'# {self.titles[i]}', '']
+
+        paragraph, words = [], 0
+        inline = ([f'[[{self.link_target()}]]' for _ in range(num_links)] +
+                  [f'#{rnd.choice(self.tags)}' for _ in range(num_tags)])
+        if self.cite_keys and rnd.random() < self.cite_probability:
+            inline += [f'@{rnd.choice(self.cite_keys)}' for _ in range(rnd.randint(1, 3))]
+        rnd.shuffle(inline)
+        while words < num_words:
+            sentence = self.sentence()
+            words += sentence.count(' ') + 1
+            if inline and rnd.random() < 0.5:
+                sentence += f' {inline.pop()}'
+            paragraph.append(sentence + '.')
+            if len(paragraph) >= rnd.randint(3, 6):
+                lines += [' '.join(paragraph), '']
+                paragraph = []
+        if paragraph or inline:
+            lines += [' '.join(paragraph + inline), '']
+
+        if rnd.random() < self.code_probability:
+            language = rnd.choice(sorted(CODE_SNIPPETS))
+            code = CODE_SNIPPETS[language].format(name=rnd.choice(self.vocabulary), n=rnd.randint(1, 9))
+            lines += [f'```{language}', code.rstrip(), '```', '']
+        if rnd.random() < self.image_probability:
+            lines += [f'![[images/image_{i % 50}.png]]', '']
+        return '\n'.join(lines)
+
+    def bibliography(self):
+        return [{
+            'id': key,
+            'type': 'article-journal',
+            'title': self.sentence(),
+            'author': [{'family': self.word().capitalize(), 'given': self.word().capitalize()}],
+            'issued': {'date-parts': [[1950 + i % 75]]},
+        } for i, key in enumerate(self.cite_keys)]
+
+    def write(self, path, git_commits=0):
+        """ Writes the garden to ``path``, replacing whatever was there. """
+        path = Path(path)
+        if path.exists():
+            shutil.rmtree(path)
+        content = path / 'content'
+        (content / 'images').mkdir(parents=True)
+        for i in range(min(50, self.num_notes)):
+            (content / 'images' / f'image_{i}.png').write_bytes(PNG)
+
+        (path / 'templates').mkdir()
+        (path / 'templates' / 'note.html').write_text(NOTE_TEMPLATE, encoding='utf-8')
+        (path / 'templates' / 'index.html').write_text(NOTE_TEMPLATE, encoding='utf-8')
+        (path / 'templates' / 'lit_note.html').write_text(LIT_NOTE_TEMPLATE, encoding='utf-8')
+        (path / 'static' / 'css').mkdir(parents=True)
+        (path / 'static' / 'css' / 'style.css').write_text('body { font-family: sans-serif; }\n', encoding='utf-8')
+        with open(path / 'citation_library.json', 'w', encoding='utf-8') as f:
+            json.dump(self.bibliography(), f, indent=2)
+
+        batches = max(1, git_commits)
+        if git_commits:
+            subprocess.run(['git', 'init', '-q', str(path)], check=True)
+        for batch in range(batches):
+            for i in range(batch, self.num_notes, batches):
+                note_path = content / self.paths[i]
+                note_path.parent.mkdir(parents=True, exist_ok=True)
+                note_path.write_text(self.note(i), encoding='utf-8')
+            if git_commits:
+                git = ['git', '-C', str(path), '-c', 'user.name=Garden', '-c', 'user.email=garden@example.com']
+                subprocess.run(git + ['add', '-A'], check=True)
+                subprocess.run(git + ['commit', '-q', '-m', f'Batch {batch}'], check=True)
+        return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic garden for benchmarks')
+    parser.add_argument('path', help='Folder to write the garden to. It is replaced if it exists')
+    parser.add_argument('-n', '--notes', type=int, default=1000, help='Number of notes (default: 1000)')
+    parser.add_argument('--words', type=int, default=300, help='Median words per note (default: 300)')
+    parser.add_argument('--links', type=float, default=5, help='Mean wikilinks per note (default: 5)')
+    parser.add_argument('--tags', type=int, default=200, help='Number of distinct tags (default: 200)')
+    parser.add_argument('--citations', type=int, default=500, help='Bibliography entries (default: 500)')
+    parser.add_argument('--code', type=float, default=0.2, help='Probability of a code fence (default: 0.2)')
+    parser.add_argument('--images', type=float, default=0.1, help='Probability of an image (default: 0.1)')
+    parser.add_argument('--git-commits', type=int, default=0,
+                        help='Create a git repository with this many commits (default: 0, no repository)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    generator = GardenGenerator(notes=args.notes, words=args.words, links=args.links, tags=args.tags,
+                                citations=args.citations, code_probability=args.code,
+                                image_probability=args.images, seed=args.seed)
+    path = generator.write(args.path, git_commits=args.git_commits)
+    print(f'Wrote {args.notes} notes to {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -163,21 +163,22 @@ def compare_historical_stats():
     Example function to compare current stats with historical data.
     This shows how you can track growth over time.
     """
-    stats_dir = Path('stats')
-    
-    # Get all historical stats files
-    historical_files = sorted(stats_dir.glob('garden_stats_*.json'))
-    
-    if len(historical_files) < 2:
+    from aqui_brain_dump.history import HistoryStore
+
+    history_file = Path('stats') / 'history.sqlite'
+    if not history_file.exists():
         print("Not enough historical data to compare")
         return
-    
-    # Compare first and last
-    with open(historical_files[0]) as f:
-        old_stats = json.load(f)
-    
-    with open(historical_files[-1]) as f:
-        new_stats = json.load(f)
+
+    with HistoryStore(history_file) as store:
+        snapshots = store.snapshots(kind='stats')
+        if len(snapshots) < 2:
+            print("Not enough historical data to compare")
+            return
+
+        # Compare first and last
+        old_stats = store.report(snapshots[0]['id'])
+        new_stats = store.report(snapshots[-1]['id'])
     
     print(f"\n{'='*60}")
     print("GROWTH COMPARISON")
@@ -32,5 +32,8 @@ setup(
         'networkx>=3.2.0',
         'python-frontmatter>=1.0.0',
         'requests>=2.28.0',
-    ]
+    ],
+    extras_require={
+        'fast': ['numpy>=1.24', 'scipy>=1.10'],
+    },
 )